@@ -0,0 +1,366 @@
+"""
+Admission control in front of the LLM-backed endpoints.
+
+Every request to an admitted path must get through three gates before the
+app sees it:
+
+- a per-user token bucket (``user_id`` from the JSON body, else the client
+  address, which is the proxy's unless uvicorn runs with ``--proxy-headers``):
+  an empty bucket is answered at once with 429 and ``Retry-After``;
+- a global token bucket (requests per second for the whole worker) and a cap
+  on admitted requests in flight: when either is exhausted the request waits
+  in a bounded priority queue, ``simple`` mode ahead of ``indepth`` and
+  batches;
+- the queue itself: when it is full, or the expected wait is longer than
+  ``max_wait_seconds``, the request is rejected with 503 and ``Retry-After``
+  instead of joining. The expected wait counts both the global rate and, once
+  the in-flight cap is reached, the measured time an admitted request holds
+  its slot. A full queue makes room for a higher-priority request
+  by shedding its newest lowest-priority waiter.
+
+Rejected requests cost no more than reading their body, so admitted requests
+keep their latency under overload. Limits are per worker process.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+PRIORITY_HIGH = 0  # simple mode, feedback
+PRIORITY_LOW = 1   # indepth mode, batches
+
+# Bodies larger than this are passed through unparsed (admitted at cost 1)
+_MAX_PARSE_BYTES = 1 << 20
+
+
+class AdmissionRejected(Exception):
+    """Request refused by admission control; ``status`` is 429 or 503"""
+
+    def __init__(self, status: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``"""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """Seconds until ``cost`` tokens are available (0 if they are now)"""
+        self._refill()
+        missing = min(cost, self.burst) - self._tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else (0.0 if missing <= 0 else math.inf)
+
+    def take(self, cost: float = 1.0) -> None:
+        self._refill()
+        self._tokens -= min(cost, self.burst)
+
+
+class _Waiter:
+    __slots__ = ("priority", "cost", "future", "enqueued")
+
+    def __init__(self, priority: int, cost: float, future: asyncio.Future):
+        self.priority = priority
+        self.cost = cost
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """Per-user and global token buckets, an in-flight cap and a priority wait queue"""
+
+    def __init__(
+        self,
+        user_rate: float = 5.0,
+        user_burst: float = 50.0,
+        global_rate: float = 50.0,
+        global_burst: float = 50.0,
+        max_in_flight: int = 32,
+        max_queue: int = 256,
+        max_wait_seconds: float = 2.0,
+        max_users: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.max_users = max_users
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_burst, clock)
+        # LRU of user buckets; an evicted user comes back with a full bucket
+        self._users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._queued = 0
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Moving average of how long an admitted request holds its slot; 0 until one finishes
+        self._service_seconds = 0.0
+        self._counts = {
+            "admitted": 0, "enqueued": 0, "rejected_user": 0, "rejected_overload": 0, "shed": 0, "timed_out": 0,
+        }
+        self._wait_seconds = {PRIORITY_HIGH: 0.0, PRIORITY_LOW: 0.0}
+        self._waited = {PRIORITY_HIGH: 0, PRIORITY_LOW: 0}
+
+    def _user_bucket(self, key: str) -> TokenBucket:
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, self._clock)
+            self._users[key] = bucket
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def _can_start(self, cost: float) -> bool:
+        return self._in_flight < self.max_in_flight and self._global.wait_time(cost) == 0.0
+
+    def _start(self, cost: float) -> None:
+        self._global.take(cost)
+        self._in_flight += 1
+
+    def _expected_wait(self, priority: int, cost: float) -> float:
+        """Rough wait behind the queued requests this one would not overtake, for tokens and for a slot"""
+        ahead = [w for _, _, w in self._queue if not w.future.done() and w.priority <= priority]
+        rate = self._global.rate if self._global.rate > 0 else math.inf
+        token_wait = (sum(w.cost for w in ahead) + cost) / rate
+        # Each round of max_in_flight requests beyond the free slots takes one service time
+        missing_slots = len(ahead) + 1 - max(0, self.max_in_flight - self._in_flight)
+        if missing_slots <= 0 or self.max_in_flight <= 0:
+            return token_wait
+        return max(token_wait, math.ceil(missing_slots / self.max_in_flight) * self._service_seconds)
+
+    def _shed_for(self, priority: int) -> bool:
+        """Reject the newest waiter of lower priority than ``priority``; False if there is none"""
+        victim = None
+        for _, sequence, waiter in self._queue:
+            if waiter.future.done() or waiter.priority <= priority:
+                continue
+            if victim is None or (waiter.priority, sequence) > (victim[1].priority, victim[0]):
+                victim = (sequence, waiter)
+        if victim is None:
+            return False
+        victim[1].future.set_exception(AdmissionRejected(
+            503, "Server is overloaded; request shed in favour of interactive traffic", self.max_wait_seconds
+        ))
+        self._queued -= 1
+        self._counts["shed"] += 1
+        return True
+
+    async def acquire(self, key: str, priority: int = PRIORITY_HIGH, cost: float = 1.0) -> float:
+        """
+        Admit one request (raises AdmissionRejected); returns the admission
+        time, to pass to the matching release()
+        """
+        # A batch bigger than a bucket can ever hold costs a full bucket
+        cost = min(cost, self.user_burst, self._global.burst)
+        bucket = self._user_bucket(key)
+        wait = bucket.wait_time(cost)
+        if wait > 0:
+            self._counts["rejected_user"] += 1
+            raise AdmissionRejected(429, "Too many requests for this user, slow down", wait)
+        bucket.take(cost)
+
+        if not self._queued and self._can_start(cost):
+            self._start(cost)
+            self._counts["admitted"] += 1
+            return self._clock()
+
+        expected = self._expected_wait(priority, cost)
+        if expected > self.max_wait_seconds:
+            self._counts["rejected_overload"] += 1
+            raise AdmissionRejected(503, "Server is overloaded, please retry shortly", expected)
+        if self._queued >= self.max_queue and not self._shed_for(priority):
+            self._counts["rejected_overload"] += 1
+            raise AdmissionRejected(503, "Server is overloaded, please retry shortly", self.max_wait_seconds)
+
+        waiter = _Waiter(priority, cost, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        self._queued += 1
+        self._counts["enqueued"] += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if waiter.future.done() and not waiter.future.exception():
+                self._record_wait(waiter)  # granted as the timeout fired
+                return self._clock()
+            self._abandon(waiter)
+            self._counts["timed_out"] += 1
+            raise AdmissionRejected(503, "Server is overloaded, please retry shortly", self.max_wait_seconds)
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot granted meanwhile
+            if waiter.future.done() and not waiter.future.cancelled() and not waiter.future.exception():
+                self.release()
+            else:
+                self._abandon(waiter)
+            raise
+        self._record_wait(waiter)
+        return self._clock()
+
+    def _record_wait(self, waiter: _Waiter) -> None:
+        self._counts["admitted"] += 1
+        self._wait_seconds[waiter.priority] += time.monotonic() - waiter.enqueued
+        self._waited[waiter.priority] += 1
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if not waiter.future.done():
+            waiter.future.cancel()
+            self._queued -= 1
+
+    def release(self, admitted_at: Optional[float] = None) -> None:
+        """An admitted request finished; ``admitted_at`` is what acquire() returned"""
+        self._in_flight -= 1
+        if admitted_at is not None:
+            held = self._clock() - admitted_at
+            self._service_seconds = held if not self._service_seconds else 0.8 * self._service_seconds + 0.2 * held
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Grant queued requests in priority order while tokens and slots allow"""
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if waiter.future.done():  # shed, timed out or cancelled
+                heapq.heappop(self._queue)
+                continue
+            if self._in_flight >= self.max_in_flight:
+                return  # release() dispatches again
+            wait = self._global.wait_time(waiter.cost)
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                return
+            heapq.heappop(self._queue)
+            self._start(waiter.cost)
+            self._queued -= 1
+            waiter.future.set_result(None)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "avg_service_seconds": round(self._service_seconds, 3),
+            "tracked_users": len(self._users),
+            **self._counts,
+            "wait_seconds_total": {"high": self._wait_seconds[PRIORITY_HIGH], "low": self._wait_seconds[PRIORITY_LOW]},
+            "waited": {"high": self._waited[PRIORITY_HIGH], "low": self._waited[PRIORITY_LOW]},
+        }
+
+
+def request_priority(body: Any) -> int:
+    """simple-mode advice and feedback go first; indepth advice and batches wait"""
+    if isinstance(body, list):
+        return PRIORITY_LOW
+    if isinstance(body, dict) and body.get("mode") == "indepth":
+        return PRIORITY_LOW
+    return PRIORITY_HIGH
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController to POSTs on ``paths``.
+    Reads the JSON body once (and replays it to the app) to find the user_id,
+    mode and, for batches, the number of requests.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str]):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        parsed = None
+        if len(body) <= _MAX_PARSE_BYTES:
+            try:
+                parsed = json.loads(body)
+            except ValueError:
+                pass  # the endpoint reports the bad JSON
+        user_id = None
+        if isinstance(parsed, dict):
+            user_id = parsed.get("user_id")
+        elif isinstance(parsed, list):
+            user_id = next((item.get("user_id") for item in parsed if isinstance(item, dict) and item.get("user_id")), None)
+        client = scope.get("client")
+        key = f"user:{user_id}" if user_id else f"addr:{client[0] if client else 'unknown'}"
+        cost = float(max(1, len(parsed))) if isinstance(parsed, list) else 1.0
+
+        try:
+            admitted_at = await self.controller.acquire(key, request_priority(parsed), cost)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=e.status, content={"detail": e.detail}, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, replay, send)
+            return
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            self.controller.release(admitted_at)
+
+
+def admission_from_env() -> Optional[AdmissionController]:
+    """
+    ADMISSION_ENABLED (default off), ADMISSION_USER_RATE / _USER_BURST,
+    ADMISSION_GLOBAL_RATE / _GLOBAL_BURST, ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT_SECONDS
+    """
+    if os.getenv("ADMISSION_ENABLED", "false").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    return AdmissionController(
+        user_rate=float(os.getenv("ADMISSION_USER_RATE", "5")),
+        user_burst=float(os.getenv("ADMISSION_USER_BURST", "50")),
+        global_rate=float(os.getenv("ADMISSION_GLOBAL_RATE", "50")),
+        global_burst=float(os.getenv("ADMISSION_GLOBAL_BURST", "50")),
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "256")),
+        max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "2")),
+    )
@@ -0,0 +1,266 @@
+"""
+Response cache in front of the Gemini calls in get_advice / get_feedback.
+
+Requests are keyed on a canonical fingerprint so near-identical payloads
+(same category, income band, expense breakdown, canned chat prompt) share one
+LLM answer. The in-memory tier is a size-bounded LRU with a TTL per category;
+an optional SQLite file adds a persistent tier that survives restarts.
+
+Expired answers are kept for a grace period (``stale_seconds``) and served
+by ``get_stale`` only as a degraded fallback while Gemini is unavailable.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Money fields are bucketed before hashing so tiny differences still hit
+MONEY_ROUNDING_NPR = 500
+
+# Seconds an answer stays fresh, per category. Market-driven answers expire
+# quickly; rule-based ones (tax slabs, expense cutting) can live longer.
+DEFAULT_TTLS: Dict[str, int] = {
+    "buy": 6 * 3600,
+    "loan": 6 * 3600,
+    "tax": 24 * 3600,
+    "big-goal": 12 * 3600,
+    "festival": 12 * 3600,
+    "reduce-expense": 24 * 3600,
+    "invest": 3600,
+    "side-income": 24 * 3600,
+    "feedback": 24 * 3600,
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\s?.!,;:]+$")
+
+
+def round_money(value: Optional[float], step: int = MONEY_ROUNDING_NPR) -> int:
+    """Round an NPR amount to the nearest bucket"""
+    if not value:
+        return 0
+    return int(round(float(value) / step) * step)
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = _WHITESPACE_RE.sub(" ", (message or "").strip().lower())
+    return _TRAILING_PUNCT_RE.sub("", text)
+
+
+def _normalize_expenses(expenses: Dict[str, float]) -> list:
+    return sorted(
+        (key.strip().lower(), round_money(value)) for key, value in expenses.items()
+    )
+
+
+def _digest(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def advice_fingerprint(request: Any, past_context: str = "") -> str:
+    """
+    Canonical cache key for an AdviceRequest. ``past_context`` is the user's
+    history as it appears in the prompt; answers personalised with it are
+    keyed on it, so they are never served to someone with other history.
+    """
+    key = {
+        "category": request.category,
+        "mode": request.mode,
+        "income": round_money(request.monthly_income_npr),
+        "savings": round_money(request.current_savings_npr),
+        "expenses": _normalize_expenses(request.monthly_expenses_npr),
+        "location": (request.location or "").strip().lower(),
+        "message": normalize_message(request.message),
+        "extra_profile": request.extra_profile or {},
+    }
+    if past_context:
+        key["past_context"] = past_context
+    return "advice:" + _digest(key)
+
+
+def feedback_fingerprint(request: Any) -> str:
+    """Canonical cache key for a FeedbackRequest"""
+    return "feedback:" + _digest({
+        "month": request.month,
+        "expenses": _normalize_expenses(request.expenses),
+        "location": (request.location or "").strip().lower(),
+        "income": round_money(request.monthly_income_npr),
+        "previous": _normalize_expenses(request.previous_expenses or {}),
+    })
+
+
+class _DiskTier:
+    """SQLite-backed persistent tier; all methods are blocking"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY,"
+            " category TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " value TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Tuple[str, str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, category, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and row[2] <= time.time() and not allow_stale:
+                return None
+            return row
+
+    def set(self, key: str, category: str, expires_at: float, value: str, purge_before: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, category, expires_at, value) VALUES (?, ?, ?, ?)",
+                (key, category, expires_at, value),
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (purge_before,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+            self._conn.commit()
+
+
+class ResponseCache:
+    """LRU + per-category TTL cache of parsed LLM responses"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttls: Optional[Dict[str, int]] = None,
+        default_ttl: int = 3600,
+        disk_path: Optional[str] = None,
+        stale_seconds: int = 24 * 3600,
+    ):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk = _DiskTier(disk_path) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def ttl_for(self, category: str) -> int:
+        return self.ttls.get(category, self.default_ttl)
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached value, or None"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            now = time.time()
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(value)
+            # Past its TTL: kept only as a stale fallback until the grace period ends
+            if expires_at + self.stale_seconds <= now:
+                del self._entries[key]
+            self.expirations += 1
+
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None:
+                value, _category, expires_at = row
+                self._remember(key, expires_at, value)
+                self.disk_hits += 1
+                return json.loads(value)
+
+        self.misses += 1
+        return None
+
+    async def get_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached value even if expired (within ``stale_seconds``), for when Gemini is down"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+        elif self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key, True)
+            if row is None:
+                return None
+            value, _category, expires_at = row
+        else:
+            return None
+        if expires_at + self.stale_seconds <= time.time():
+            return None
+        self.stale_hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, value: Dict[str, Any], category: str) -> None:
+        ttl = self.ttl_for(category)
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        raw = json.dumps(value, separators=(",", ":"))
+        self._remember(key, expires_at, raw)
+        if self._disk is not None:
+            purge_before = time.time() - self.stale_seconds
+            await asyncio.to_thread(self._disk.set, key, category, expires_at, raw, purge_before)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_hits": self.stale_hits,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "persistent": self._disk is not None,
+        }
+
+
+def cache_from_env() -> ResponseCache:
+    """Build a ResponseCache configured from ADVICE_CACHE_* environment variables"""
+    ttls = dict(DEFAULT_TTLS)
+    for category in ttls:
+        override = os.getenv("ADVICE_CACHE_TTL_" + category.upper().replace("-", "_"))
+        if override:
+            ttls[category] = int(override)
+    return ResponseCache(
+        max_entries=int(os.getenv("ADVICE_CACHE_MAX_ENTRIES", "1024")),
+        ttls=ttls,
+        default_ttl=int(os.getenv("ADVICE_CACHE_TTL_SECONDS", "3600")),
+        disk_path=os.getenv("ADVICE_CACHE_DB_PATH") or None,
+        stale_seconds=int(os.getenv("ADVICE_CACHE_STALE_SECONDS", str(24 * 3600))),
+    )
@@ -0,0 +1,376 @@
+"""
+Asynchronous advice jobs: submit now, poll or subscribe for the answer.
+
+In-depth advice can outlast a load balancer's HTTP timeout, and the Gemini
+call is wasted when the connection drops. A job is stored in an embedded
+SQLite file (WAL mode) when it is submitted and run by ``workers`` asyncio
+workers in this process, highest priority first (``simple`` mode ahead of
+``indepth``, as in admission control). Each state change is committed
+before it is reported, so a restart picks up every queued job and re-runs
+the ones that were running.
+
+Submissions are idempotent: the client's ``Idempotency-Key`` (or, without
+one, a hash of the request body) maps to one job; submitting it again
+returns that job instead of running the request twice. Reusing a key with a
+different body is an ``IdempotencyConflict``; resubmitting a failed job
+runs it again.
+
+Failures with a ``retry_after`` (Gemini busy or down) are retried up to
+``max_attempts`` times. Finished jobs are deleted after
+``retention_seconds``.
+
+A job is claimed atomically, so processes sharing the file never run it at
+the same time; but a process that starts requeues every job marked running,
+including ones another live process is running. With several worker
+processes, give each its own file or accept that a restart may run a job
+twice.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS advice_jobs ("
+    " id TEXT PRIMARY KEY,"
+    " idempotency_key TEXT NOT NULL UNIQUE,"
+    " request_hash TEXT NOT NULL,"
+    " request TEXT NOT NULL,"
+    " priority INTEGER NOT NULL,"
+    " status TEXT NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " status_code INTEGER,"
+    " result TEXT,"
+    " error TEXT,"
+    " created_at REAL NOT NULL,"
+    " started_at REAL,"
+    " finished_at REAL)",
+    "CREATE INDEX IF NOT EXISTS idx_advice_jobs_status ON advice_jobs (status, finished_at)",
+)
+
+_COLUMNS = (
+    "id, idempotency_key, request_hash, request, priority, status, attempts,"
+    " status_code, result, error, created_at, started_at, finished_at"
+)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobFailed(Exception):
+    """Raised by a job handler: HTTP status and detail, and whether to retry"""
+
+    def __init__(self, status: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are waiting; the submission was not stored"""
+
+    def __init__(self, queued: int):
+        super().__init__(f"{queued} advice jobs are already waiting")
+        self.queued = queued
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with a different request body"""
+
+
+def request_hash(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _row_to_job(row: tuple) -> Dict[str, Any]:
+    (job_id, _, _, request, priority, status, attempts,
+     status_code, result, error, created_at, started_at, finished_at) = row
+    return {
+        "job_id": job_id,
+        "status": status,
+        "priority": priority,
+        "attempts": attempts,
+        "status_code": status_code,
+        "result": json.loads(result) if result else None,
+        "error": error,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "request": json.loads(request),
+    }
+
+
+class JobQueue:
+    """Persistent priority queue of advice jobs with an in-process worker pool"""
+
+    def __init__(
+        self,
+        path: str,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        workers: int = 4,
+        max_attempts: int = 3,
+        max_queued: int = 10000,
+        retention_seconds: float = 86400,
+    ):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._submit_lock: Optional[asyncio.Lock] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._waiting = 0  # queued, including retries not yet due
+        self._running = 0
+        self._counts = {"submitted": 0, "deduplicated": 0, "recovered": 0, "completed": 0, "failed": 0, "retried": 0, "purged": 0}
+        self._queue_seconds = 0.0
+        self._run_seconds = 0.0
+
+    # -- storage --------------------------------------------------------------
+
+    async def _db(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        def call():
+            with self._db_lock:
+                with self._conn:
+                    return fn(self._conn)
+        return await asyncio.to_thread(call)
+
+    async def _update(self, job_id: str, **fields: Any) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        await self._db(lambda conn: conn.execute(
+            f"UPDATE advice_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)
+        ))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job as stored, or None if it does not exist (or was purged)"""
+        row = await self._db(lambda conn: conn.execute(
+            f"SELECT {_COLUMNS} FROM advice_jobs WHERE id = ?", (job_id,)
+        ).fetchone())
+        return _row_to_job(row) if row else None
+
+    # -- lifecycle ------------------------------------------------------------
+
+    async def start(self) -> None:
+        """Requeue unfinished jobs from the store and start the workers"""
+        self._queue = asyncio.PriorityQueue()
+        self._submit_lock = asyncio.Lock()
+
+        def recover(conn: sqlite3.Connection) -> List[tuple]:
+            # A job left running was interrupted by a restart: run it again
+            conn.execute("UPDATE advice_jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+            return conn.execute(
+                "SELECT id, priority, created_at FROM advice_jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+
+        for job_id, priority, created_at in await self._db(recover):
+            self._enqueue(job_id, priority, created_at)
+            self._counts["recovered"] += 1
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running stay stored and run after a restart"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job_id: str, priority: int, created_at: float) -> None:
+        self._waiting += 1
+        self._queue.put_nowait((priority, next(self._seq), job_id, created_at))
+
+    # -- submit / wait --------------------------------------------------------
+
+    async def submit(
+        self, payload: Dict[str, Any], priority: int, idempotency_key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Store and queue a job for ``payload``; returns (job, created). An
+        existing job with the same key is returned instead (created=False).
+        """
+        body_hash = request_hash(payload)
+        key = f"key:{idempotency_key}" if idempotency_key else f"body:{body_hash}"
+        async with self._submit_lock:
+            row = await self._db(lambda conn: conn.execute(
+                f"SELECT {_COLUMNS} FROM advice_jobs WHERE idempotency_key = ?", (key,)
+            ).fetchone())
+            if row is not None:
+                job = _row_to_job(row)
+                if row[2] != body_hash:
+                    raise IdempotencyConflict(f"Idempotency-Key {idempotency_key!r} was used for a different request")
+                if job["status"] != FAILED:
+                    self._counts["deduplicated"] += 1
+                    return job, False
+                # Resubmitting a failed job runs it again
+                await self._update(job["job_id"], status=QUEUED, attempts=0, error=None, status_code=None, finished_at=None)
+                self._enqueue(job["job_id"], job["priority"], time.time())
+                self._counts["submitted"] += 1
+                return await self.get(job["job_id"]), True
+
+            if self._waiting >= self.max_queued:
+                raise JobQueueFull(self._waiting)
+            job_id = uuid.uuid4().hex
+            created_at = time.time()
+            await self._db(lambda conn: conn.execute(
+                "INSERT INTO advice_jobs (id, idempotency_key, request_hash, request, priority, status, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, body_hash, json.dumps(payload, ensure_ascii=False, default=str), priority, QUEUED, created_at),
+            ))
+        self._enqueue(job_id, priority, created_at)
+        self._counts["submitted"] += 1
+        return await self.get(job_id), True
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """The job once it has finished, or as it is after ``timeout`` seconds"""
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED or timeout <= 0:
+            return job
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        # The job may have finished between the read above and registering the event
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            if self._finished.get(job_id) is event:
+                del self._finished[job_id]
+                event.set()
+            return job
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await self.get(job_id)
+
+    # -- workers --------------------------------------------------------------
+
+    async def _worker(self) -> None:
+        while True:
+            priority, _, job_id, queued_at = await self._queue.get()
+            self._waiting -= 1
+            self._running += 1
+            try:
+                await self._run(job_id, priority, queued_at)
+            except Exception as e:
+                # Storage failure: the job stays stored as it was and runs after a restart
+                print(f"Advice job {job_id} could not be processed: {e}")
+            finally:
+                self._running -= 1
+
+    async def _run(self, job_id: str, priority: int, queued_at: float) -> None:
+        job = await self.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return
+        started_at = time.time()
+        claimed = await self._db(lambda conn: conn.execute(
+            "UPDATE advice_jobs SET status = ?, attempts = attempts + 1, started_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, started_at, job_id, QUEUED),
+        ).rowcount)
+        if not claimed:
+            return  # taken by another process sharing the file
+        self._queue_seconds += max(0.0, started_at - queued_at)
+        attempts = job["attempts"] + 1
+        started = time.perf_counter()
+        try:
+            result = await self.handler(job["request"])
+        except JobFailed as e:
+            self._run_seconds += time.perf_counter() - started
+            if e.retry_after is not None and attempts < self.max_attempts:
+                await self._update(job_id, status=QUEUED, error=e.detail, status_code=e.status)
+                self._counts["retried"] += 1
+                self._waiting += 1
+                asyncio.get_running_loop().call_later(
+                    e.retry_after, self._requeue, (priority, next(self._seq), job_id, time.time() + e.retry_after)
+                )
+                return
+            await self._finish(job_id, FAILED, status_code=e.status, error=e.detail)
+        except Exception as e:
+            self._run_seconds += time.perf_counter() - started
+            print(f"Advice job {job_id} failed: {e}")
+            await self._finish(job_id, FAILED, status_code=500, error=str(e))
+        else:
+            self._run_seconds += time.perf_counter() - started
+            await self._finish(job_id, DONE, status_code=200, result=json.dumps(result, ensure_ascii=False, default=str), error=None)
+
+    def _requeue(self, item: tuple) -> None:
+        self._queue.put_nowait(item)
+
+    async def _finish(self, job_id: str, status: str, **fields: Any) -> None:
+        await self._update(job_id, status=status, finished_at=time.time(), **fields)
+        self._counts["completed" if status == DONE else "failed"] += 1
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(min(3600.0, max(1.0, self.retention_seconds / 10)))
+            cutoff = time.time() - self.retention_seconds
+            try:
+                purged = await self._db(lambda conn: conn.execute(
+                    "DELETE FROM advice_jobs WHERE status IN (?, ?) AND finished_at < ?", (*FINISHED, cutoff)
+                ).rowcount)
+                self._counts["purged"] += purged
+            except Exception as e:
+                print(f"Advice job purge failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        started = self._counts["completed"] + self._counts["failed"] + self._counts["retried"]
+        return {
+            "path": self.path,
+            "workers": self.workers,
+            "queued": self._waiting,
+            "running": self._running,
+            **self._counts,
+            "avg_queue_seconds": round(self._queue_seconds / started, 3) if started else 0.0,
+            "avg_run_seconds": round(self._run_seconds / started, 3) if started else 0.0,
+        }
+
+
+def on_code_filesystem(path: str) -> bool:
+    """
+    True when ``path`` is on the same filesystem as this code. On container
+    hosts such as Render that disk is replaced on every deploy; a persistent
+    disk is a separate mount.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    return os.stat(directory).st_dev == os.stat(os.path.dirname(os.path.abspath(__file__))).st_dev
+
+
+def jobs_from_env(handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> Optional[JobQueue]:
+    """
+    ADVICE_JOBS_DB_PATH (empty disables), ADVICE_JOBS_WORKERS,
+    ADVICE_JOBS_MAX_ATTEMPTS, ADVICE_JOBS_MAX_QUEUED, ADVICE_JOBS_RETENTION_SECONDS
+    """
+    path = os.getenv(
+        "ADVICE_JOBS_DB_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.db"),
+    )
+    if not path:
+        return None
+    return JobQueue(
+        path,
+        handler,
+        workers=int(os.getenv("ADVICE_JOBS_WORKERS", "4")),
+        max_attempts=int(os.getenv("ADVICE_JOBS_MAX_ATTEMPTS", "3")),
+        max_queued=int(os.getenv("ADVICE_JOBS_MAX_QUEUED", "10000")),
+        retention_seconds=float(os.getenv("ADVICE_JOBS_RETENTION_SECONDS", "86400")),
+    )
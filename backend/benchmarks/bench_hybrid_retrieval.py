@@ -0,0 +1,99 @@
+"""
+Query latency of vector, BM25 and hybrid (RRF) retrieval for one user.
+
+Builds a synthetic per-user index (Zipf-distributed vocabulary plus account
+numbers and scheme names, random unit vectors) and times the search path
+that /api/v1/query runs after the query embedding is computed. Exits non-zero
+when hybrid p95 exceeds the latency budget.
+
+    python backend/benchmarks/bench_hybrid_retrieval.py --chunks 100000 --dim 768
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_index import VectorStore
+
+SPECIAL_TOKENS = ["ssf", "cit", "nabil", "nic", "asia", "global", "ime", "emi", "nepse", "dashain"]
+
+
+def synthetic_chunks(count: int, rng: np.random.Generator, words_per_chunk: int = 80):
+    vocab = np.array([f"w{i}" for i in range(30000)])
+    ranks = np.minimum(rng.zipf(1.2, size=(count, words_per_chunk)) - 1, len(vocab) - 1)
+    texts = []
+    for row in range(count):
+        words = list(vocab[ranks[row]])
+        words.append(SPECIAL_TOKENS[row % len(SPECIAL_TOKENS)])
+        words.append(f"{row:010d}")  # account-number-like exact token
+        texts.append(" ".join(words))
+    return texts
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {p: float(np.percentile(ms, p)) for p in (50, 95, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=20.0, help="hybrid p95 budget")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    root = tempfile.mkdtemp(prefix="bench_retrieval_")
+    try:
+        store = VectorStore(root)
+        started = time.perf_counter()
+        texts = synthetic_chunks(args.chunks, rng)
+        batch = 10_000
+        for start in range(0, args.chunks, batch):
+            vectors = rng.standard_normal((min(batch, args.chunks - start), args.dim)).astype(np.float32)
+            store.add("bench-user", vectors, texts[start:start + batch])
+        index = store.index("bench-user")
+        print(f"built {args.chunks} chunks x {args.dim} dims in {time.perf_counter() - started:.1f}s "
+              f"(ivf rows: {index._manifest.get('ivf_count', 0)})")
+
+        queries = []
+        for _ in range(args.queries):
+            row = int(rng.integers(args.chunks))
+            text = f"{SPECIAL_TOKENS[row % len(SPECIAL_TOKENS)]} {row:010d} {texts[row].split()[0]}"
+            queries.append((rng.standard_normal(args.dim).astype(np.float32), text, row))
+
+        # Warm up page cache and lazy structures
+        for vector, text, _ in queries[:5]:
+            store.search("bench-user", vector, args.top_k, text, "hybrid")
+
+        print(f"{'mode':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        results = {}
+        for mode in ("vector", "keyword", "hybrid"):
+            samples, hits = [], 0
+            for vector, text, row in queries:
+                t0 = time.perf_counter()
+                found = store.search("bench-user", vector, args.top_k, text, mode)
+                samples.append(time.perf_counter() - t0)
+                hits += any(r["metadata"]["chunk_id"] == row for r in found)
+            results[mode] = percentiles(samples)
+            p = results[mode]
+            print(f"{mode:>8} {p[50]:>8.2f} {p[95]:>8.2f} {p[99]:>8.2f}   exact-token hit rate {hits / len(queries):.2f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if results["hybrid"][95] > args.budget_ms:
+        print(f"FAIL: hybrid p95 {results['hybrid'][95]:.2f} ms > {args.budget_ms} ms budget")
+        sys.exit(1)
+    print(f"OK: hybrid p95 within {args.budget_ms} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Throughput of the old blocking Gemini call path vs. the async LLM pool.
+
+Uses a fake client with a fixed upstream latency, so it measures only how
+many requests one event loop can keep in flight. Like google-genai 1.0.0's
+``client.aio``, the fake's async call is a blocking call run through
+``asyncio.to_thread``, so the pool is also measured with the loop's default
+executor left at its stock size (min(32, CPUs + 4) threads), the cap the
+pool lifts. Every run gets a fresh event loop. A second table shows how many
+upstream calls a burst of identical prompts costs with and without
+single-flight coalescing.
+
+    python backend/benchmarks/bench_llm_pool.py --latency 0.2 --requests 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_pool import LLMPool
+
+
+class _FakeResponse:
+    text = '{"ok": true}'
+
+
+class _BlockingModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, *, model, contents, config=None):
+        time.sleep(self.latency)
+        return _FakeResponse()
+
+
+class _AsyncModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate_content(self, *, model, contents, config=None):
+        # google-genai 1.0.0 runs its blocking HTTP request in a worker thread
+        self.calls += 1
+        await asyncio.to_thread(time.sleep, self.latency)
+        return _FakeResponse()
+
+
+class _Aio:
+    def __init__(self, latency: float):
+        self.models = _AsyncModels(latency)
+
+
+class FakeClient:
+    """Mimics client.models (blocking) and client.aio.models (async)"""
+
+    def __init__(self, latency: float):
+        self.models = _BlockingModels(latency)
+        self.aio = _Aio(latency)
+
+
+async def _blocking_handler(client: FakeClient):
+    # What get_advice did before: sync call inside an async handler
+    return client.models.generate_content(model="fake", contents="prompt")
+
+
+async def _pooled_handler(pool: LLMPool):
+    return await pool.generate_content(model="fake", contents="prompt")
+
+
+async def _drive(handler, concurrency: int, total: int) -> float:
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await handler()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - started)
+
+
+async def _pooled(sized: bool, latency: float, concurrency: int, total: int, max_concurrency: int) -> float:
+    # Every request sends the same prompt, so coalescing is off here
+    pool = LLMPool(FakeClient(latency), max_concurrency=max_concurrency, max_queue=total, coalesce=False)
+    if sized:
+        # What the app's startup hook does; unsized calls share the stock default executor
+        pool.install_executor()
+    return await _drive(lambda: _pooled_handler(pool), concurrency, total)
+
+
+async def _burst(latency: float, total: int, max_concurrency: int, coalesce: bool):
+    client = FakeClient(latency)
+    pool = LLMPool(client, max_concurrency=max_concurrency, max_queue=total, coalesce=coalesce)
+    pool.install_executor()
+    started = time.perf_counter()
+    await asyncio.gather(*(_pooled_handler(pool) for _ in range(total)))
+    return client.aio.models.calls, time.perf_counter() - started
+
+
+def main(latency: float, total: int, max_concurrency: int):
+    print(f"upstream latency {latency * 1000:.0f} ms, {total} requests per run, pool cap {max_concurrency},"
+          f" stock default executor {min(32, (os.cpu_count() or 1) + 4)} threads")
+    print(f"{'clients':>8} {'blocking req/s':>16} {'stock executor':>16} {'pooled req/s':>14}")
+    for concurrency in (1, 10, 100):
+        client = FakeClient(latency)
+        # The blocking path serializes everything, so a short run is enough
+        blocking = asyncio.run(_drive(lambda: _blocking_handler(client), concurrency, min(total, 20)))
+        unsized = asyncio.run(_pooled(False, latency, concurrency, total, max_concurrency))
+        pooled = asyncio.run(_pooled(True, latency, concurrency, total, max_concurrency))
+        print(f"{concurrency:>8} {blocking:>16.1f} {unsized:>16.1f} {pooled:>14.1f}")
+
+    print()
+    print(f"burst of {total} identical prompts at once")
+    print(f"{'coalesce':>8} {'upstream calls':>16} {'seconds':>10}")
+    for coalesce in (False, True):
+        calls, seconds = asyncio.run(_burst(latency, total, max_concurrency, coalesce))
+        print(f"{str(coalesce):>8} {calls:>16} {seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream latency in seconds")
+    parser.add_argument("--requests", type=int, default=200, help="requests per pooled run")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="pool cap")
+    args = parser.parse_args()
+    main(args.latency, args.requests, args.max_concurrency)
@@ -0,0 +1,205 @@
+"""
+Output tokens and latency of the compact advice contract versus the legacy one.
+
+The legacy contract had Gemini write the answer twice (response_np and
+response_en) under AdviceResponse's long key names; the compact contract
+(compact_output.py) writes it once under short keys. For every category and
+mode the same answer is measured both ways:
+
+- offline (default): the canned answers of fake_gemini.py serialized in each
+  contract, sized with model_routing.estimate_tokens. In-depth answers
+  repeat the prose to ~300 words. No network needed.
+- ``--live``: real Gemini calls through the backend's own prompt, schema and
+  route (GEMINI_API_KEY required), ``--runs`` per contract, alternating, and
+  the output tokens billed (thinking included) plus wall time per call. The
+  legacy prompt and schema are rebuilt from the compact ones by renaming
+  keys back.
+
+Results are saved as JSON under benchmarks/results/:
+
+    python backend/benchmarks/bench_output_contract.py
+    GEMINI_API_KEY=... python backend/benchmarks/bench_output_contract.py --live --runs 3
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from compact_output import ALTERNATIVE_KEYS, ADVICE_KEYS, compact_advice, expand_advice
+from fake_gemini import _ADVICE_EXTRAS, _PROSE, _TIPS
+from finance import CATEGORY_RULES
+from load_test import git_commit
+from model_routing import estimate_tokens, output_tokens
+
+MODES = ("simple", "indepth")
+
+SAMPLE_MESSAGES = {
+    "buy": "I want to buy a Pulsar N160 bike",
+    "loan": "Should I take a 15 lakh home loan?",
+    "tax": "How can I save tax this year with SSF and CIT?",
+    "big-goal": "I want to study in Australia in two years",
+    "festival": "Plan my Dashain budget",
+    "reduce-expense": "Help me cut my monthly expenses",
+    "invest": "Where should I invest 30,000 a month?",
+    "side-income": "How can I earn extra money on weekends?",
+}
+
+_TEXT_ALIASES = '"response_np": {desc},\n  "response_en": "English answer with the same content",'
+
+
+def sample_answer(category: str, mode: str) -> Dict[str, Any]:
+    """Public advice dict a model could have written for this category and mode"""
+    prose = _PROSE.format(location="Kathmandu")
+    if mode == "indepth":
+        prose = " ".join([prose] * 4)
+    return {"response_np": prose, "response_en": prose, "tips": _TIPS, **_ADVICE_EXTRAS[category]}
+
+
+def legacy_reply(compact: Dict[str, Any]) -> Dict[str, Any]:
+    """The same reply in the legacy contract: every compact key spelled out, text twice"""
+    expanded = expand_advice(compact)
+    return {"response_np": expanded.pop("response_np"), "response_en": expanded.pop("response_en"), **expanded}
+
+
+def legacy_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact response schema with the legacy key names and both text fields"""
+    schema = copy.deepcopy(schema)
+    properties = schema["properties"]
+    text = properties.pop("r")
+    renamed = {"response_np": text, "response_en": dict(text)}
+    for key, value in properties.items():
+        if key == "alt":
+            items = value["items"]
+            items["properties"] = {ALTERNATIVE_KEYS[k]: v for k, v in items["properties"].items()}
+            items["required"] = [ALTERNATIVE_KEYS[k] for k in items["required"]]
+        renamed[ADVICE_KEYS[key]] = value
+    schema["properties"] = renamed
+    schema["required"] = ["response_np", "response_en"] + [ADVICE_KEYS[k] for k in schema["required"] if k != "r"]
+    return schema
+
+
+def legacy_prompt(prompt: str) -> str:
+    """Prompt whose JSON template uses the legacy keys"""
+    prompt = re.sub(r'"r": ("[^"]*"),', lambda m: _TEXT_ALIASES.format(desc=m.group(1)), prompt)
+    keys = {**ADVICE_KEYS, **ALTERNATIVE_KEYS}
+    return re.sub(r'"(t|m|s|alt|n|p)":', lambda m: f'"{keys[m.group(1)]}":', prompt)
+
+
+def offline(args) -> List[Dict[str, Any]]:
+    rows = []
+    for category in CATEGORY_RULES:
+        for mode in MODES:
+            compact = compact_advice(sample_answer(category, mode), category)
+            legacy = legacy_reply(compact)
+            legacy_tokens = estimate_tokens(json.dumps(legacy, ensure_ascii=False))
+            compact_tokens = estimate_tokens(json.dumps(compact, ensure_ascii=False))
+            rows.append({
+                "category": category,
+                "mode": mode,
+                "legacy_output_tokens": legacy_tokens,
+                "compact_output_tokens": compact_tokens,
+                "reduction": round(1 - compact_tokens / legacy_tokens, 3),
+            })
+    return rows
+
+
+async def live(args) -> List[Dict[str, Any]]:
+    os.environ.setdefault("HISTORY_DB_PATH", "")
+    os.environ.setdefault("ADVICE_JOBS_DB_PATH", "")
+    os.environ.setdefault("ADVICE_CACHE_DB_PATH", "")
+    import main
+
+    rows = []
+    for category in CATEGORY_RULES:
+        for mode in MODES:
+            request = main.AdviceRequest(
+                category=category,
+                message=SAMPLE_MESSAGES[category],
+                monthly_income_npr=85000,
+                monthly_expenses_npr={"food": 14200, "rent": 18000, "transport": 4000},
+                current_savings_npr=120000,
+                mode=mode,
+            )
+            route = main.router.route(category, mode)
+            contents = main.build_advice_prompt(request, True)
+            system_prompt = main.SYSTEM_PROMPTS[category]
+            schema = main.ADVICE_SCHEMAS[category]
+            contracts = {
+                "compact": (system_prompt, schema),
+                "legacy": (legacy_prompt(system_prompt), legacy_schema(schema)),
+            }
+            samples: Dict[str, Dict[str, list]] = {name: {"tokens": [], "seconds": []} for name in contracts}
+            for run in range(args.runs):
+                # Alternate which contract goes first so warm-up favours neither
+                order = list(contracts) if run % 2 == 0 else list(reversed(list(contracts)))
+                for name in order:
+                    instruction, contract_schema = contracts[name]
+                    started = time.perf_counter()
+                    response = await main.llm_pool.generate_content(
+                        model=route.model,
+                        contents=contents,
+                        config=main.structured.config(
+                            contract_schema, system_instruction=instruction, **route.config_kwargs()
+                        ),
+                    )
+                    samples[name]["seconds"].append(time.perf_counter() - started)
+                    samples[name]["tokens"].append(output_tokens(response.usage_metadata))
+            row = {"category": category, "mode": mode, "model": route.model}
+            for name in contracts:
+                row[f"{name}_output_tokens"] = statistics.median(samples[name]["tokens"])
+                row[f"{name}_seconds"] = round(statistics.median(samples[name]["seconds"]), 3)
+            row["reduction"] = round(1 - row["compact_output_tokens"] / max(row["legacy_output_tokens"], 1), 3)
+            rows.append(row)
+            print(f"{category:>15} {mode:>8} {row['legacy_output_tokens']:>8} {row['compact_output_tokens']:>8}"
+                  f" {row['reduction']:>7.1%} {row['legacy_seconds']:>9.2f} {row['compact_seconds']:>9.2f}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="call Gemini (GEMINI_API_KEY) instead of sizing canned answers")
+    parser.add_argument("--runs", type=int, default=3, help="live calls per category, mode and contract")
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"), help="directory for the results JSON")
+    args = parser.parse_args()
+
+    if args.live:
+        print(f"{'category':>15} {'mode':>8} {'legacy':>8} {'compact':>8} {'saved':>7} {'legacy s':>9} {'compact s':>9}")
+        rows = asyncio.run(live(args))
+    else:
+        rows = offline(args)
+        print(f"{'category':>15} {'mode':>8} {'legacy':>8} {'compact':>8} {'saved':>7}   (estimated output tokens)")
+        for row in rows:
+            print(f"{row['category']:>15} {row['mode']:>8} {row['legacy_output_tokens']:>8}"
+                  f" {row['compact_output_tokens']:>8} {row['reduction']:>7.1%}")
+    legacy_total = sum(row["legacy_output_tokens"] for row in rows)
+    compact_total = sum(row["compact_output_tokens"] for row in rows)
+    print(f"\ntotal output tokens: legacy {legacy_total}, compact {compact_total} ({1 - compact_total / legacy_total:.1%} fewer)")
+
+    commit = git_commit()
+    report = {
+        "git_commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "rows": rows,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"output-contract-{'live' if args.live else 'offline'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    main()
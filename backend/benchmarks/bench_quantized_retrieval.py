@@ -0,0 +1,181 @@
+"""
+Recall@top_k, memory footprint and query latency of quantized retrieval.
+
+Builds one synthetic user index (clustered unit vectors, so neighbours are
+meaningful) and searches it as float32 and as int8 with several re-rank
+shortlist sizes. Recall is measured against an exact float32 brute-force
+search over every row, so with the default sizes the IVF index's own
+misses are included. Memory is what the index keeps open (the store's
+budget counts the same number); latency covers the vector search only.
+
+A second pass spreads smaller indexes over many users behind a memory
+budget and reports evictions and cold (reopened) versus warm query
+latency. Results are saved as JSON under benchmarks/results/:
+
+    python backend/benchmarks/bench_quantized_retrieval.py --chunks 50000 --dim 768
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from embeddings import normalize_rows
+from load_test import git_commit
+from vector_index import UserVectorIndex, VectorStore
+
+
+def clustered_vectors(count: int, dim: int, rng: np.random.Generator, per_cluster: int = 50) -> np.ndarray:
+    centers = normalize_rows(rng.standard_normal((max(1, count // per_cluster), dim)))
+    rows = centers[rng.integers(len(centers), size=count)] + 0.6 * rng.standard_normal((count, dim)) / np.sqrt(dim)
+    return normalize_rows(rows)
+
+
+def percentiles(samples: List[float]) -> Dict[int, float]:
+    ms = np.asarray(samples) * 1000
+    return {p: round(float(np.percentile(ms, p)), 3) for p in (50, 95, 99)}
+
+
+def file_bytes(path: str, names) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in names if os.path.exists(os.path.join(path, name)))
+
+
+def bench_single(args, rng: np.random.Generator, root: str) -> List[Dict[str, Any]]:
+    path = os.path.join(root, "single")
+    vectors = clustered_vectors(args.chunks, args.dim, rng)
+    builder = UserVectorIndex(path, ivf_threshold=args.ivf_threshold, nprobe=args.nprobe)
+    started = time.perf_counter()
+    for start in range(0, args.chunks, 10_000):
+        block = vectors[start:start + 10_000]
+        builder.add(block, [f"chunk {row}" for row in range(start, start + len(block))])
+    print(f"built {args.chunks} chunks x {args.dim} dims in {time.perf_counter() - started:.1f}s "
+          f"(ivf rows: {builder._manifest.get('ivf_count', 0)})")
+
+    queries = normalize_rows(vectors[rng.integers(args.chunks, size=args.queries)]
+                             + 0.3 * rng.standard_normal((args.queries, args.dim)) / np.sqrt(args.dim))
+    truth = [set(np.argsort(-(vectors @ query))[:args.top_k].tolist()) for query in queries]
+
+    configs = [("float32", "none", 1)] + [
+        (f"int8 rerank x{factor}" if factor > 1 else "int8 no rerank", "int8", factor)
+        for factor in args.rerank_factors
+    ]
+    disk = {
+        "none": file_bytes(path, ["vectors.f32"]),
+        "int8": file_bytes(path, ["vectors.f32", "vectors.i8", "scales.f32"]),
+    }
+    print(f"\n{'config':>18} {'recall@' + str(args.top_k):>10} {'open MB':>9} {'disk MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    results = []
+    for name, quantization, factor in configs:
+        index = UserVectorIndex(path, ivf_threshold=args.ivf_threshold, nprobe=args.nprobe,
+                                quantization=quantization, rerank_factor=factor)
+        for query in queries[:5]:
+            index.search_rows(query, args.top_k)
+        samples, recall = [], 0.0
+        for query, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            found = index.search_rows(query, args.top_k)
+            samples.append(time.perf_counter() - t0)
+            recall += len(expected & {row for row, _ in found}) / args.top_k
+        row = {
+            "config": name,
+            "quantization": quantization,
+            "rerank_factor": factor,
+            "recall": round(recall / len(queries), 4),
+            # The scan reads the f32 file only for float32; int8 touches it for the shortlist
+            "open_bytes": index.resident_bytes(),
+            "disk_bytes": disk[quantization],
+            "latency_ms": percentiles(samples),
+        }
+        results.append(row)
+        p = row["latency_ms"]
+        print(f"{name:>18} {row['recall']:>10.4f} {row['open_bytes'] / 2**20:>9.1f} {row['disk_bytes'] / 2**20:>9.1f}"
+              f" {p[50]:>8.2f} {p[95]:>8.2f} {p[99]:>8.2f}")
+    return results
+
+
+def bench_budget(args, rng: np.random.Generator, root: str) -> Dict[str, Any]:
+    store = VectorStore(os.path.join(root, "users"), quantization="int8",
+                        memory_budget_bytes=int(args.budget_mb * 2**20))
+    for user in range(args.users):
+        vectors = clustered_vectors(args.chunks_per_user, args.dim, rng)
+        store.add(f"user-{user}", vectors, [f"user {user} chunk {row}" for row in range(args.chunks_per_user)])
+    store = VectorStore(store.root, quantization="int8", memory_budget_bytes=store.memory_budget_bytes)
+
+    cold, warm = [], []
+    for _ in range(args.queries):
+        user_id = f"user-{int(rng.integers(args.users))}"
+        query = normalize_rows(rng.standard_normal((1, args.dim)))[0]
+        was_open = user_id in store._open and store._open[user_id]._codes is not None
+        t0 = time.perf_counter()
+        store.search(user_id, query, args.top_k)
+        (warm if was_open else cold).append(time.perf_counter() - t0)
+    stats = store.stats()
+    report = {
+        "users": args.users,
+        "chunks_per_user": args.chunks_per_user,
+        "budget_mb": args.budget_mb,
+        "resident_mb": round(stats["resident_bytes"] / 2**20, 1),
+        "open_users": stats["open_users"],
+        "evictions": stats["evictions"],
+        "cold_ms": percentiles(cold) if cold else None,
+        "warm_ms": percentiles(warm) if warm else None,
+    }
+    print(f"\n{args.users} users x {args.chunks_per_user} chunks, budget {args.budget_mb} MB: "
+          f"{stats['open_users']} open ({report['resident_mb']} MB), {stats['evictions']} evictions")
+    for label, samples in (("cold", cold), ("warm", warm)):
+        if samples:
+            p = percentiles(samples)
+            print(f"  {label:>5} queries: {len(samples):>4}  p50 {p[50]:.2f} ms  p95 {p[95]:.2f} ms")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ivf-threshold", type=int, default=20000, help="as VECTOR_IVF_THRESHOLD; larger = brute force")
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--users", type=int, default=40, help="users in the memory budget pass (0 skips it)")
+    parser.add_argument("--chunks-per-user", type=int, default=2000)
+    parser.add_argument("--budget-mb", type=float, default=16.0)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"), help="directory for the results JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    root = tempfile.mkdtemp(prefix="bench_quantized_")
+    try:
+        single = bench_single(args, rng, root)
+        budget = bench_budget(args, rng, root) if args.users else None
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "git_commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "single_user": single,
+        "memory_budget": budget,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"quantized-retrieval-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {path}")
+
+
+if __name__ == "__main__":
+    main()
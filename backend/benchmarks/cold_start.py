@@ -0,0 +1,197 @@
+"""
+Cold start benchmark: import time and time to first response.
+
+Measures, over several fresh processes:
+
+- import: seconds to ``import main`` in a new interpreter, plus the slowest
+  modules by cumulative import time (``python -X importtime``);
+- startup: seconds from spawning uvicorn until ``GET /`` answers, then how
+  long the first ``POST /api/v1/advice`` takes (Gemini is the local fake
+  server, see fake_gemini.py) and, for comparison, a second one.
+
+Runs are made with GEMINI_PREWARM on and off. ``--first-request-delay``
+waits between the port opening and the first advice request, as a platform
+health check does; prewarm only helps requests that arrive after it has
+finished. The fake server is plain HTTP on localhost, so the TLS handshake
+a pooled, prewarmed connection saves against the real API is not part of
+these numbers. Results are saved as JSON under benchmarks/results/ like
+load_test.py:
+
+    python backend/benchmarks/cold_start.py --runs 5 --first-request-delay 1
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import free_port, git_commit, wait_ready
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def app_env(fake_url: str, prewarm: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": "fake",
+        "GEMINI_BASE_URL": fake_url,
+        "JWT_SECRET_KEY": "cold-start",
+        "GEMINI_PREWARM": "true" if prewarm else "false",
+        "ADVICE_CACHE_DB_PATH": "",
+        "HISTORY_DB_PATH": "",
+        "ADVICE_JOBS_DB_PATH": "",
+        "PYTHONWARNINGS": "ignore",
+    })
+    return env
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict[str, Any]]:
+    """Top-level modules imported by main, by cumulative import time"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        # Name indented one level below main: imported directly by it
+        if match and len(match.group(3)) == 3:
+            modules.append({"module": match.group(4), "ms": round(int(match.group(2)) / 1000, 1)})
+    modules.sort(key=lambda m: m["ms"], reverse=True)
+    return modules[:top]
+
+
+def advice_body(run: int, attempt: int) -> Dict[str, Any]:
+    # Distinct messages so neither call is answered from the response cache
+    return {
+        "category": "buy",
+        "message": f"I want to buy a bike (cold start run {run}, call {attempt})",
+        "monthly_income_npr": 85000,
+        "monthly_expenses_npr": {"food": 14200, "rent": 18000},
+        "current_savings_npr": 120000,
+        "location": "kathmandu",
+    }
+
+
+def measure_startup(env: Dict[str, str], run: int, timeout: float, first_request_delay: float) -> Dict[str, float]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    app = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ], env=env)
+    try:
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            deadline = started + timeout
+            while True:
+                if app.poll() is not None:
+                    raise RuntimeError(f"app exited with code {app.returncode}")
+                try:
+                    client.get("/")
+                    break
+                except httpx.HTTPError:
+                    if time.perf_counter() > deadline:
+                        raise RuntimeError(f"app did not come up within {timeout}s")
+                    time.sleep(0.01)
+            ready = time.perf_counter()
+            timings = {"ready_seconds": ready - started}
+            time.sleep(first_request_delay)
+            for attempt, name in ((1, "first_advice_seconds"), (2, "second_advice_seconds")):
+                call_started = time.perf_counter()
+                response = client.post("/api/v1/advice", json=advice_body(run, attempt))
+                response.raise_for_status()
+                timings[name] = time.perf_counter() - call_started
+            timings["first_response_seconds"] = ready - started + first_request_delay + timings["first_advice_seconds"]
+            return timings
+    finally:
+        app.terminate()
+        try:
+            app.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app.kill()
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, float]:
+    return {
+        key: round(statistics.median(sample[key] for sample in samples), 3)
+        for key in samples[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--latency", default="fixed:0.3", help="fake Gemini latency spec")
+    parser.add_argument("--first-request-delay", type=float, default=0.0, help="seconds between ready and the first request")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"), help="directory for the results JSON")
+    args = parser.parse_args()
+
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_gemini.py"), "--port", str(fake_port), "--latency", args.latency,
+    ])
+    try:
+        wait_ready(f"{fake_url}/stats", fake)
+        env = app_env(fake_url, prewarm=False)
+        imports = [measure_import(env) for _ in range(args.runs)]
+        report_imports = slowest_imports(env, args.top)
+        print(f"import main: median {statistics.median(imports):.3f}s, min {min(imports):.3f}s over {args.runs} runs")
+        for module in report_imports:
+            print(f"  {module['ms']:>8.1f} ms  {module['module']}")
+
+        startup = {}
+        print(f"\n{'prewarm':>8} {'ready s':>9} {'1st advice s':>13} {'2nd advice s':>13} {'1st response s':>15}")
+        for prewarm in (False, True):
+            env = app_env(fake_url, prewarm)
+            samples = [measure_startup(env, run, args.timeout, args.first_request_delay) for run in range(args.runs)]
+            summary = summarize(samples)
+            startup["on" if prewarm else "off"] = {"median": summary, "runs": samples}
+            print(
+                f"{'on' if prewarm else 'off':>8} {summary['ready_seconds']:>9.3f} {summary['first_advice_seconds']:>13.3f}"
+                f" {summary['second_advice_seconds']:>13.3f} {summary['first_response_seconds']:>15.3f}"
+            )
+    finally:
+        fake.terminate()
+        fake.wait(timeout=10)
+
+    commit = git_commit()
+    report = {
+        "git_commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "import_seconds": {"median": round(statistics.median(imports), 3), "runs": imports},
+        "slowest_imports": report_imports,
+        "startup": startup,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"cold-start-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {path}")
+
+
+if __name__ == "__main__":
+    main()
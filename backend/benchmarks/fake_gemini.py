@@ -0,0 +1,298 @@
+"""
+Local stand-in for the Gemini REST API, for load tests.
+
+Serves the calls the backend makes (generateContent,
+streamGenerateContent?alt=sse, batchEmbedContents, the models.get used to
+prewarm the client, and cachedContents create/update/delete) with canned
+JSON for each advice category and for feedback, after a configurable
+latency. Calls that reference a cached content count its tokens as
+cachedContentTokenCount. A fraction
+of calls can fail (503 UNAVAILABLE) or return truncated JSON, to exercise
+the error and repair paths.
+
+Point the backend at it with GEMINI_BASE_URL:
+
+    python backend/benchmarks/fake_gemini.py --port 8931 --latency lognormal:0.8,0.4 --error-rate 0.01
+    GEMINI_BASE_URL=http://127.0.0.1:8931 GEMINI_API_KEY=fake uvicorn main:app --app-dir backend
+
+Latency specs: ``fixed:S``, ``uniform:LOW,HIGH``, ``lognormal:MEDIAN,SIGMA``
+(seconds). Streaming responses spread the same latency over their chunks,
+with the first chunk after ``--ttft-fraction`` of it.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_output import compact_advice
+from structured_output import close_truncated_json
+
+_CATEGORY_RE = re.compile(r"- Category: ([a-z-]+)")
+
+_TIPS = [
+    "Open a separate savings account at a bank with a 6%+ FD rate and auto-transfer on salary day",
+    "Cook at home four days a week instead of ordering from Foodmandu",
+    "Switch to a cheaper NTC or Ncell data pack that matches your real usage",
+    "Use Sajha Yatayat or a shared ride instead of Pathao for daily commutes",
+    "Put festival bonuses straight into savings before spending anything",
+]
+
+_PROSE = (
+    "Based on your income and expenses in {location}, this plan is realistic if you stay consistent. "
+    "Set aside your monthly savings on salary day, avoid new EMIs until the goal is reached, and "
+    "review your spending every month. Prices in Nepal move with the dollar rate and festival demand, "
+    "so compare at least two shops or dealers before paying, and keep a small emergency buffer."
+)
+
+_ADVICE_EXTRAS: Dict[str, Dict[str, Any]] = {
+    "buy": {"target_amount_npr": 385000, "alternatives": [
+        {"name": "Bajaj Pulsar N160", "price_npr": 320000}, {"name": "Honda Shine 125", "price_npr": 245000}]},
+    "loan": {"months_needed": 60, "target_amount_npr": 1500000, "alternatives": [
+        {"name": "Nabil Bank home loan", "price_npr": 31800, "months_needed": 60},
+        {"name": "Global IME personal loan", "price_npr": 34500, "months_needed": 48}]},
+    "tax": {"target_amount_npr": 300000, "alternatives": [
+        {"name": "SSF contribution", "price_npr": 25000}, {"name": "CIT deposit", "price_npr": 20000}]},
+    "big-goal": {"target_amount_npr": 2500000, "alternatives": [
+        {"name": "Smaller down payment (20%)", "price_npr": 1800000}, {"name": "Study in Australia (diploma)", "price_npr": 2200000}]},
+    "festival": {"months_needed": 4, "target_amount_npr": 90000, "alternatives": [
+        {"name": "Simpler Dashain shopping", "price_npr": 60000}, {"name": "Tihar only budget", "price_npr": 40000}]},
+    "reduce-expense": {"realistic_monthly_savings_npr": 12000, "target_amount_npr": 12000, "alternatives": [
+        {"name": "Shared flat", "price_npr": 8000}, {"name": "Monthly bus pass", "price_npr": 1500}]},
+    "invest": {"months_needed": 12, "target_amount_npr": 600000, "alternatives": [
+        {"name": "Fixed deposit", "price_npr": 20000, "months_needed": 12},
+        {"name": "NEPSE index fund", "price_npr": 15000, "months_needed": 24}]},
+    "side-income": {"months_needed": 3, "target_amount_npr": 25000, "alternatives": [
+        {"name": "Online tutoring", "price_npr": 20000, "months_needed": 1},
+        {"name": "Freelance design on Upwork", "price_npr": 35000, "months_needed": 3}]},
+}
+
+_FEEDBACK_TEXT = {
+    "rights": ("Good control here", "This is below what most households in your area spend.", "Keep the same habit next month."),
+    "wrongs": ("Spending to fix", "This is well above what most households in your area spend.", "Set a monthly cap and track it weekly."),
+}
+_FEEDBACK_SUGGESTIONS = ["Track daily expenses in a notebook or app", "Build a 3-month emergency fund", "Start a small SIP in a mutual fund"]
+_ITEM_ID_RE = re.compile(r"^- \[([a-z_]+)\]", re.MULTILINE)
+
+
+def feedback_reply(prompt: str) -> dict:
+    """Notes for every item id listed under RIGHTS / WRONGS in the feedback prompt"""
+    reply = {"suggestions": _FEEDBACK_SUGGESTIONS}
+    rights_part, _, wrongs_part = prompt.partition("WRONGS:")
+    for kind, part in (("rights", rights_part.partition("RIGHTS:")[2]), ("wrongs", wrongs_part)):
+        title, description, solution = _FEEDBACK_TEXT[kind]
+        reply[kind] = [
+            {"id": item_id, "title": title, "description": description, "solution": solution}
+            for item_id in _ITEM_ID_RE.findall(part)
+        ]
+    return reply
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """'fixed:0.5' | 'uniform:0.2,1.0' | 'lognormal:0.8,0.4' -> sampler in seconds"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(np.log(median), sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            parts.append(part.get("text", ""))
+    return "\n".join(parts)
+
+
+def canned_reply(prompt: str) -> str:
+    """JSON text the real model would plausibly return for this prompt"""
+    if "meant to be one JSON object" in prompt:
+        # Repair call: close the broken text the way a model would
+        repaired = close_truncated_json(prompt.rsplit("Text:\n", 1)[-1])
+        return json.dumps(repaired or {})
+    if "expense analyzer" in prompt:
+        return json.dumps(feedback_reply(prompt))
+    match = _CATEGORY_RE.search(prompt)
+    category = match.group(1) if match else "buy"
+    location = re.search(r"- Location: (\S+)", prompt)
+    prose = _PROSE.format(location=location.group(1) if location else "Kathmandu")
+    advice = {"response_np": prose, "response_en": prose, "tips": _TIPS}
+    advice.update(_ADVICE_EXTRAS.get(category, _ADVICE_EXTRAS["buy"]))
+    # Answered in the compact contract the backend's response schema asks for
+    return json.dumps(compact_advice(advice, category if category in _ADVICE_EXTRAS else None))
+
+
+def _instruction_text(body: Dict[str, Any]) -> str:
+    instruction = body.get("systemInstruction") or {}
+    return "\n".join(part.get("text", "") for part in instruction.get("parts", []))
+
+
+def _response(text: str, prompt: str, cached: str = "") -> Dict[str, Any]:
+    prompt_tokens = max(1, (len(prompt) + len(cached)) // 4)
+    output_tokens = max(1, len(text) // 4)
+    usage = {
+        "promptTokenCount": prompt_tokens,
+        "candidatesTokenCount": output_tokens,
+        "totalTokenCount": prompt_tokens + output_tokens,
+    }
+    if cached:
+        usage["cachedContentTokenCount"] = len(cached) // 4
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": usage,
+        "modelVersion": "fake-gemini",
+    }
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def create_app(
+    latency: Callable[[], float],
+    error_rate: float = 0.0,
+    malformed_rate: float = 0.0,
+    ttft_fraction: float = 0.3,
+    stream_chunks: int = 12,
+    embedding_dim: int = 768,
+) -> FastAPI:
+    app = FastAPI(title="Fake Gemini")
+    counters = {"generate": 0, "stream": 0, "embed": 0, "model_info": 0, "caches": 0, "errors": 0, "malformed": 0}
+    caches: Dict[str, str] = {}  # cachedContents/<id> -> system instruction text
+
+    def unavailable():
+        counters["errors"] += 1
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE"}},
+        )
+
+    def reply_text(prompt: str) -> str:
+        text = canned_reply(prompt)
+        if random.random() < malformed_rate:
+            counters["malformed"] += 1
+            text = text[: int(len(text) * 0.8)]
+        return text
+
+    @app.get("/stats")
+    def stats():
+        return counters
+
+    @app.get("/{api_version}/models/{model}")
+    async def model_info(api_version: str, model: str):
+        counters["model_info"] += 1
+        return {"name": f"models/{model}", "displayName": model, "inputTokenLimit": 1048576, "outputTokenLimit": 65536}
+
+    @app.post("/{api_version}/cachedContents")
+    async def create_cache(api_version: str, request: Request):
+        body = await request.json()
+        counters["caches"] += 1
+        name = f"cachedContents/{len(caches) + 1}"
+        caches[name] = _instruction_text(body)
+        return {"name": name, "model": body.get("model"), "displayName": body.get("displayName")}
+
+    @app.patch("/{api_version}/cachedContents/{cache_id}")
+    async def update_cache(api_version: str, cache_id: str):
+        name = f"cachedContents/{cache_id}"
+        if name not in caches:
+            return JSONResponse(status_code=403, content={"error": {"code": 403, "message": "CachedContent not found (or permission denied)"}})
+        return {"name": name}
+
+    @app.delete("/{api_version}/cachedContents/{cache_id}")
+    async def delete_cache(api_version: str, cache_id: str):
+        caches.pop(f"cachedContents/{cache_id}", None)
+        return {}
+
+    @app.post("/{api_version}/models/{model_action}")
+    async def models(api_version: str, model_action: str, request: Request):
+        model, _, action = model_action.partition(":")
+        body = await request.json()
+
+        if action == "batchEmbedContents":
+            counters["embed"] += 1
+            await asyncio.sleep(latency() * 0.1)
+            texts = [_prompt_text({"contents": [r.get("content", {})]}) for r in body.get("requests", [])]
+            return {"embeddings": [{"values": _embedding(text, embedding_dim)} for text in texts]}
+
+        prompt = _prompt_text(body)
+        cached = caches.get(body.get("cachedContent", ""), "")
+        prompt = f"{_instruction_text(body)}\n{prompt}" if body.get("systemInstruction") else prompt
+        if random.random() < error_rate:
+            await asyncio.sleep(latency() * 0.2)
+            return unavailable()
+
+        if action == "generateContent":
+            counters["generate"] += 1
+            await asyncio.sleep(latency())
+            return _response(reply_text(prompt), prompt, cached)
+
+        if action == "streamGenerateContent":
+            counters["stream"] += 1
+            total = latency()
+            text = reply_text(prompt)
+            size = max(1, len(text) // stream_chunks)
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+
+            async def events():
+                await asyncio.sleep(total * ttft_fraction)
+                gap = total * (1 - ttft_fraction) / max(len(pieces), 1)
+                for i, piece in enumerate(pieces):
+                    chunk = _response(piece, prompt, cached)
+                    if i < len(pieces) - 1:
+                        del chunk["usageMetadata"]
+                    else:
+                        chunk["usageMetadata"] = _response(text, prompt, cached)["usageMetadata"]  # totals on the last chunk
+                    yield f"data: {json.dumps(chunk)}\r\n\r\n"
+                    await asyncio.sleep(gap)
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"Unknown action {action}"}})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8931)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="fixed:S | uniform:LOW,HIGH | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of replies cut off mid-JSON")
+    parser.add_argument("--ttft-fraction", type=float, default=0.3)
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app = create_app(
+        parse_latency(args.latency),
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        ttft_fraction=args.ttft_fraction,
+        embedding_dim=args.embedding_dim,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Load test of the backend against a local fake Gemini (fake_gemini.py).
+
+Starts the fake Gemini server and the app (uvicorn) as subprocesses, seeds a
+document index for /api/v1/query, then drives /api/v1/advice,
+/api/v1/feedback and /api/v1/query at fixed concurrency levels. For each
+(scenario, concurrency) it reports req/s, p50/p95/p99 latency, errors, the
+app's RSS and the mean time per stage taken from /metrics. Results are
+saved as JSON under benchmarks/results/ (named by time and git commit) and
+can be compared against an earlier run:
+
+    python backend/benchmarks/load_test.py --levels 1,10,50 --requests 300
+    python backend/benchmarks/load_test.py --compare backend/benchmarks/results/<earlier>.json
+
+Any LLM_* / ADVICE_* / ADMISSION_* variables in the environment are passed
+to the app, so pool, cache and admission settings can be compared run
+against run. The per-user admission limit is lifted unless set, since the
+synthetic users send far more than a real one. Requests refused with 429/503
+are counted as "shed", not errors, and ``ok_p99_ms`` is the p99 of the
+requests that were served - under overload it should stay flat:
+
+    ADMISSION_GLOBAL_RATE=20 python backend/benchmarks/load_test.py --scenarios advice --levels 10,50,100 --latency fixed:0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from vector_index import VectorStore
+from fake_gemini import _embedding
+
+CATEGORIES = ["buy", "loan", "tax", "big-goal", "festival", "reduce-expense", "invest", "side-income"]
+LOCATIONS = ["kathmandu", "pokhara", "lalitpur", "biratnagar", "butwal"]
+QUERY_TERMS = ["SSF contribution", "Nabil bank statement", "CIT deposit", "EMI schedule", "salary credit", "Dashain bonus"]
+SCENARIOS = ("advice", "feedback", "query")
+
+_STAGE_LINE_RE = re.compile(r'^paisa_stage_seconds_(sum|count)\{endpoint="([^"]+)",stage="([^"]+)",[^}]*\} (\S+)$')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak RSS of a process (Linux /proc; None elsewhere)"""
+    values: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    values["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    values["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return values
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def seed_documents(index_dir: str, users: int, chunks_per_user: int, dim: int) -> None:
+    """Per-user indexes embedded the way the fake Gemini embeds queries"""
+    store = VectorStore(index_dir)
+    rng = random.Random(0)
+    for user in range(users):
+        texts = [
+            f"{rng.choice(QUERY_TERMS)} for account {rng.randrange(10**9, 10**10)} on page {i} "
+            f"amount NPR {rng.randrange(1000, 500000)}"
+            for i in range(chunks_per_user)
+        ]
+        vectors = np.array([_embedding(text, dim) for text in texts], dtype=np.float32)
+        store.add(f"load-user-{user}", vectors, texts, embedder_name="gemini-text-embedding-004")
+
+
+class RequestFactory:
+    """Request bodies per scenario; ``distinct`` > 0 cycles through that many to allow cache hits"""
+
+    def __init__(self, distinct: int, users: int, seed: int = 0):
+        self.distinct = distinct
+        self.users = users
+        self.rng = random.Random(seed)
+        self.counter = 0
+
+    def _rng(self) -> random.Random:
+        self.counter += 1
+        if self.distinct:
+            return random.Random(self.counter % self.distinct)
+        return self.rng
+
+    def advice(self) -> Dict[str, Any]:
+        rng = self._rng()
+        income = rng.randrange(30000, 250000, 1000)
+        return {
+            "category": rng.choice(CATEGORIES),
+            "message": f"Can I afford this plan? reference {rng.randrange(10**6)}",
+            "monthly_income_npr": income,
+            "monthly_expenses_npr": {
+                "food": rng.randrange(5000, 30000, 500),
+                "rent": rng.randrange(5000, 40000, 500),
+                "transport": rng.randrange(1000, 10000, 500),
+            },
+            "current_savings_npr": rng.randrange(0, 500000, 1000),
+            "location": rng.choice(LOCATIONS),
+            "mode": rng.choice(["simple", "indepth"]),
+        }
+
+    def feedback(self) -> Dict[str, Any]:
+        rng = self._rng()
+        return {
+            "user_id": f"load-user-{rng.randrange(max(self.users, 1))}",
+            "month": f"2025-{rng.randrange(1, 13):02d}",
+            "expenses": {k: rng.randrange(1000, 40000, 100) for k in ("food", "rent", "transport", "entertainment")},
+        }
+
+    def query(self) -> Dict[str, Any]:
+        rng = self._rng()
+        return {
+            "user_id": f"load-user-{rng.randrange(max(self.users, 1))}",
+            "query": f"{rng.choice(QUERY_TERMS)} {rng.randrange(10**9, 10**10)}",
+            "top_k": 5,
+            "mode": "hybrid",
+        }
+
+
+async def scrape_stages(client: httpx.AsyncClient) -> Dict[Tuple[str, str], List[float]]:
+    """(endpoint, stage) -> [sum seconds, count] summed over categories and modes"""
+    stages: Dict[Tuple[str, str], List[float]] = {}
+    response = await client.get("/metrics")
+    for line in response.text.splitlines():
+        match = _STAGE_LINE_RE.match(line)
+        if match:
+            kind, endpoint, stage, value = match.groups()
+            entry = stages.setdefault((endpoint, stage), [0.0, 0.0])
+            entry[0 if kind == "sum" else 1] += float(value)
+    return stages
+
+
+async def run_level(
+    client: httpx.AsyncClient, scenario: str, factory: RequestFactory, concurrency: int, total: int
+) -> Dict[str, Any]:
+    path = {"advice": "/api/v1/advice", "feedback": "/api/v1/feedback", "query": "/api/v1/query"}[scenario]
+    make_body = getattr(factory, scenario)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = [total]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            body = make_body()
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started, status))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ms = np.asarray([seconds for seconds, _ in latencies]) * 1000
+    ok_ms = np.asarray([seconds for seconds, status in latencies if status == "200"]) * 1000
+    ok = statuses.get("200", 0)
+    shed = statuses.get("429", 0) + statuses.get("503", 0)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "shed": shed,
+        "errors": total - ok - shed,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "ok_p99_ms": round(float(np.percentile(ok_ms, 99)), 2) if ok else None,
+    }
+
+
+def stage_means(before: Dict, after: Dict, endpoint: str) -> Dict[str, float]:
+    """Mean ms per stage for one endpoint between two /metrics scrapes"""
+    means = {}
+    for (name, stage), (total, count) in after.items():
+        if name != endpoint:
+            continue
+        prev_total, prev_count = before.get((name, stage), (0.0, 0.0))
+        if count > prev_count:
+            means[stage] = round((total - prev_total) / (count - prev_count) * 1000, 3)
+    return means
+
+
+async def drive(app_url: str, app_pid: int, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    factory = RequestFactory(args.distinct, args.users, seed=args.seed)
+    limits = httpx.Limits(max_connections=max(args.levels) + 10, max_keepalive_connections=max(args.levels) + 10)
+    results = []
+    async with httpx.AsyncClient(base_url=app_url, timeout=args.timeout, limits=limits) as client:
+        for scenario in args.scenarios:
+            await run_level(client, scenario, factory, min(4, max(args.levels)), args.warmup)
+            for concurrency in args.levels:
+                before = await scrape_stages(client)
+                result = await run_level(client, scenario, factory, concurrency, args.requests)
+                after = await scrape_stages(client)
+                result.update(rss_mb(app_pid))
+                result["stage_ms"] = stage_means(before, after, scenario)
+                results.append(result)
+                print(
+                    f"{scenario:>9} {concurrency:>5} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} "
+                    f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['ok_p99_ms'] or 0:>9.1f} "
+                    f"{result['shed']:>6} {result['errors']:>7} {result['rss_mb'] or 0:>8.1f}",
+                    flush=True,
+                )
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> List[str]:
+    """Print deltas against a saved run; returns the regressions found"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\ncompared with {os.path.basename(baseline_path)} (commit {baseline.get('git_commit')})")
+    print(f"{'scenario':>9} {'conc':>5} {'req/s':>16} {'p95 ms':>18}")
+    regressions = []
+    for result in results:
+        old = previous.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+        rps_delta = (result["rps"] - old["rps"]) / old["rps"] if old["rps"] else 0.0
+        p95_delta = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] if old["p95_ms"] else 0.0
+        flag = ""
+        if rps_delta < -threshold or p95_delta > threshold:
+            flag = "  REGRESSION"
+            regressions.append(f"{result['scenario']} x{result['concurrency']}")
+        print(
+            f"{result['scenario']:>9} {result['concurrency']:>5} "
+            f"{old['rps']:>7.1f}->{result['rps']:<7.1f} {old['p95_ms']:>8.1f}->{result['p95_ms']:<8.1f}"
+            f" ({rps_delta:+.0%} / {p95_delta:+.0%}){flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: advice,feedback,query")
+    parser.add_argument("--levels", default="1,10,50", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per (scenario, level)")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--distinct", type=int, default=0, help="cycle through N request bodies (0 = all unique, no cache hits)")
+    parser.add_argument("--users", type=int, default=20, help="users with seeded documents")
+    parser.add_argument("--chunks-per-user", type=int, default=2000)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="fake Gemini latency spec")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"), help="directory for the results JSON")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    args.levels = [int(level) for level in args.levels.split(",")]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    processes: List[subprocess.Popen] = []
+    try:
+        index_dir = os.path.join(workdir, "vector_index")
+        if "query" in args.scenarios:
+            started = time.perf_counter()
+            seed_documents(index_dir, args.users, args.chunks_per_user, dim=768)
+            print(f"seeded {args.users} users x {args.chunks_per_user} chunks in {time.perf_counter() - started:.1f}s")
+
+        fake_port, app_port = free_port(), free_port()
+        fake = subprocess.Popen([
+            sys.executable, os.path.join(BENCH_DIR, "fake_gemini.py"), "--port", str(fake_port),
+            "--latency", args.latency, "--error-rate", str(args.error_rate),
+            "--malformed-rate", str(args.malformed_rate), "--seed", str(args.seed),
+        ])
+        processes.append(fake)
+        wait_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+
+        env = dict(os.environ)
+        env.update({
+            "GEMINI_API_KEY": "fake",
+            "GEMINI_BASE_URL": f"http://127.0.0.1:{fake_port}",
+            "JWT_SECRET_KEY": "load-test",
+            "EMBEDDING_BACKEND": "gemini",
+            "VECTOR_INDEX_DIR": index_dir,
+            "ADVICE_CACHE_DB_PATH": "",
+            "HISTORY_DB_PATH": os.path.join(workdir, "history.db"),
+            "ADVICE_JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        })
+        env.setdefault("ADMISSION_USER_RATE", "1000000")
+        env.setdefault("ADMISSION_USER_BURST", "1000000")
+        app = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+            "--host", "127.0.0.1", "--port", str(app_port), "--workers", str(args.workers), "--log-level", "warning",
+        ], env=env)
+        processes.append(app)
+        app_url = f"http://127.0.0.1:{app_port}"
+        wait_ready(app_url + "/", app)
+
+        print(f"fake Gemini latency {args.latency}, error rate {args.error_rate}, malformed rate {args.malformed_rate}")
+        print(
+            f"{'scenario':>9} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ok p99':>9}"
+            f" {'shed':>6} {'errors':>7} {'rss MB':>8}"
+        )
+        results = asyncio.run(drive(app_url, app.pid, args))
+        fake_stats = httpx.get(f"http://127.0.0.1:{fake_port}/stats").json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "git_commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "app_env": {k: v for k, v in os.environ.items() if k.startswith(("LLM_", "ADVICE_", "ADMISSION_"))},
+        "fake_gemini": fake_stats,
+        "results": results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {path}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"FAIL: regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
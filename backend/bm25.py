@@ -0,0 +1,245 @@
+"""
+Compact BM25 inverted index, stored next to a user's vector index.
+
+Dense embeddings handle exact tokens (account numbers, SSF/CIT, bank names)
+poorly, so retrieval also scores chunks lexically. Postings are kept in
+array-backed CSR segments rather than dicts of lists:
+
+    terms    int32   sorted global term ids present in the segment
+    offsets  int64   len(terms) + 1 boundaries into docs / tfs
+    docs     int32   row ids (same ids as the vector index), ascending per term
+    tfs      uint16  term frequency per (term, row)
+
+Each ``add`` writes one segment; segments are merged once there are more than
+``max_segments``. Files:
+
+    bm25_vocab.txt      one term per line (term id = line number)
+    bm25_doclen.u32     raw uint32 token count per row
+    bm25_manifest.json  row count, total tokens, segment names
+    bm25_<seg>_*.npy    segment arrays (memory-mapped on load)
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_SEGMENT_ARRAYS = ("terms", "offsets", "docs", "tfs")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; digits are kept so account numbers match exactly"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over array-backed posting segments"""
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, max_segments: int = 8):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._read_manifest()
+        self._vocab: Dict[str, int] = self._read_vocab()
+        self._segments: List[Dict[str, np.ndarray]] = [self._load_segment(name) for name in self._manifest["segments"]]
+        self._df = np.zeros(len(self._vocab), dtype=np.int64)
+        for segment in self._segments:
+            np.add.at(self._df, segment["terms"], np.diff(segment["offsets"]))
+        self._doclen: Optional[np.ndarray] = None
+        self._norm: Optional[np.ndarray] = None
+
+    # -- files -----------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self._file("bm25_manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"count": 0, "total_tokens": 0, "segments": [], "next_segment": 0}
+
+    def _write_manifest(self) -> None:
+        tmp = self._file("bm25_manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp, self._file("bm25_manifest.json"))
+
+    def _read_vocab(self) -> Dict[str, int]:
+        try:
+            with open(self._file("bm25_vocab.txt"), "r", encoding="utf-8") as f:
+                return {line.rstrip("\n"): i for i, line in enumerate(f)}
+        except FileNotFoundError:
+            return {}
+
+    def _load_segment(self, name: str) -> Dict[str, np.ndarray]:
+        return {key: np.load(self._file(f"bm25_{name}_{key}.npy"), mmap_mode="r") for key in _SEGMENT_ARRAYS}
+
+    def _save_segment(self, segment: Dict[str, np.ndarray]) -> str:
+        name = f"seg{self._manifest['next_segment']}"
+        self._manifest["next_segment"] += 1
+        for key in _SEGMENT_ARRAYS:
+            np.save(self._file(f"bm25_{name}_{key}.npy"), segment[key])
+        return name
+
+    def _remove_segment_files(self, name: str) -> None:
+        for key in _SEGMENT_ARRAYS:
+            try:
+                os.remove(self._file(f"bm25_{name}_{key}.npy"))
+            except FileNotFoundError:
+                pass
+
+    @property
+    def count(self) -> int:
+        return self._manifest["count"]
+
+    def _doc_lengths(self) -> np.ndarray:
+        if self._doclen is None or len(self._doclen) != self.count:
+            self._doclen = np.fromfile(self._file("bm25_doclen.u32"), dtype=np.uint32, count=self.count)
+            self._norm = None
+        return self._doclen
+
+    def _length_norm(self) -> np.ndarray:
+        """k1 * (1 - b + b * dl / avgdl) per row, cached until rows are added"""
+        doclen = self._doc_lengths()
+        if self._norm is None:
+            avgdl = max(self._manifest["total_tokens"] / max(self.count, 1), 1e-9)
+            self._norm = (self.k1 * (1.0 - self.b + self.b * doclen / avgdl)).astype(np.float32)
+        return self._norm
+
+    # -- writes ----------------------------------------------------------------
+
+    @staticmethod
+    def _build_segment(terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray) -> Dict[str, np.ndarray]:
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        offsets = np.append(starts, len(terms)).astype(np.int64)
+        return {
+            "terms": unique_terms.astype(np.int32),
+            "offsets": offsets,
+            "docs": docs.astype(np.int32),
+            "tfs": np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16),
+        }
+
+    def add(self, start_row: int, texts: List[str]) -> None:
+        """Index ``texts`` as rows start_row, start_row + 1, ..."""
+        with self._lock:
+            if start_row != self.count:
+                raise ValueError(f"BM25 rows must be added in order (expected {self.count}, got {start_row})")
+            term_ids, doc_ids, freqs, lengths = [], [], [], []
+            new_terms = []
+            for offset, text in enumerate(texts):
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = len(self._vocab)
+                        self._vocab[term] = term_id
+                        new_terms.append(term)
+                    term_ids.append(term_id)
+                    doc_ids.append(start_row + offset)
+                    freqs.append(tf)
+                lengths.append(sum(counts.values()))
+
+            if new_terms:
+                with open(self._file("bm25_vocab.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(term + "\n" for term in new_terms))
+                self._df = np.concatenate([self._df, np.zeros(len(new_terms), dtype=np.int64)])
+            with open(self._file("bm25_doclen.u32"), "ab") as f:
+                f.write(np.asarray(lengths, dtype=np.uint32).tobytes())
+
+            if term_ids:
+                segment = self._build_segment(
+                    np.asarray(term_ids, dtype=np.int32),
+                    np.asarray(doc_ids, dtype=np.int32),
+                    np.asarray(freqs, dtype=np.int64),
+                )
+                np.add.at(self._df, segment["terms"], np.diff(segment["offsets"]))
+                self._manifest["segments"].append(self._save_segment(segment))
+                self._segments.append(segment)
+
+            self._manifest["count"] += len(texts)
+            self._manifest["total_tokens"] += int(sum(lengths))
+            if len(self._segments) > self.max_segments:
+                self._merge_segments()
+            self._write_manifest()
+
+    def _merge_segments(self) -> None:
+        """Collapse every segment into one"""
+        terms, docs, tfs = [], [], []
+        for segment in self._segments:
+            lengths = np.diff(segment["offsets"])
+            terms.append(np.repeat(segment["terms"], lengths))
+            docs.append(np.asarray(segment["docs"]))
+            tfs.append(np.asarray(segment["tfs"], dtype=np.int64))
+        merged = self._build_segment(np.concatenate(terms), np.concatenate(docs), np.concatenate(tfs))
+        old_names = self._manifest["segments"]
+        self._manifest["segments"] = [self._save_segment(merged)]
+        self._segments = [merged]
+        self._write_manifest()
+        for name in old_names:
+            self._remove_segment_files(name)
+
+    def resident_bytes(self) -> int:
+        """Estimated memory of the segments, per-row arrays and vocabulary"""
+        total = sum(array.nbytes for segment in self._segments for array in segment.values())
+        total += self._df.nbytes
+        total += sum(array.nbytes for array in (self._doclen, self._norm) if array is not None)
+        # dict entry plus a short str per term
+        return total + 100 * len(self._vocab)
+
+    # -- search ----------------------------------------------------------------
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """(row, bm25 score) pairs for the best ``top_k`` rows"""
+        with self._lock:
+            if self.count == 0:
+                return []
+            term_ids = sorted({self._vocab[t] for t in tokenize(query) if t in self._vocab})
+            if not term_ids:
+                return []
+            norm = self._length_norm()
+            scores = np.zeros(self.count, dtype=np.float32)
+            n = self.count
+            for term_id in term_ids:
+                df = self._df[term_id]
+                idf = np.float32(np.log(1.0 + (n - df + 0.5) / (df + 0.5)))
+                for segment in self._segments:
+                    pos = np.searchsorted(segment["terms"], term_id)
+                    if pos >= len(segment["terms"]) or segment["terms"][pos] != term_id:
+                        continue
+                    lo, hi = segment["offsets"][pos], segment["offsets"][pos + 1]
+                    docs = segment["docs"][lo:hi]
+                    tf = segment["tfs"][lo:hi].astype(np.float32)
+                    # Row ids are unique within one posting list, so a plain
+                    # fancy-index add is safe (no np.add.at needed)
+                    scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm[docs])
+            matched = np.flatnonzero(scores)
+            if len(matched) == 0:
+                return []
+            k = min(top_k, len(matched))
+            best = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            best = best[np.argsort(-scores[best])]
+            return [(int(row), float(scores[row])) for row in best]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuse ranked row lists: score(row) = sum over lists of 1 / (k + rank),
+    rank starting at 1. Returns (row, score) sorted best first.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,162 @@
+"""
+Server-side state for WebSocket chat sessions.
+
+A session holds what a stateless /api/v1/advice call has to resend every
+turn: the user's profile (every AdviceRequest field but the message), their
+history context, a rolling summary of earlier turns and the last structured
+answer. A chat's first turn in a category is sent as a full advice prompt;
+later turns in that category send a short fixed instruction, a one-line
+profile, the summary, the last answer and the new message, so a follow-up
+costs fewer input tokens than a stateless call.
+
+Sessions live in memory in the worker that created them. The store keeps
+at most ``max_sessions`` (least recently active evicted first) and drops
+sessions idle for ``idle_seconds``; a client may reconnect to its session
+until then. Idle sessions are dropped on every create and resume, and by a
+background sweep every ``sweep_seconds`` so a quiet worker frees them too.
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Optional, Set
+
+
+class ChatSession:
+    """Profile, history context, turn summary and last answer of one chat"""
+
+    def __init__(self, profile: Dict[str, Any], past_context: str, max_turns: int, now: float):
+        self.session_id = uuid.uuid4().hex
+        self.profile = profile
+        self.past_context = past_context
+        self.turns: deque = deque(maxlen=max_turns)
+        self.turn_count = 0
+        self.last_answer: Optional[Dict[str, Any]] = None
+        self.answered_categories: Set[str] = set()
+        self.created_at = now
+        self.last_active = now
+        # One turn at a time, also across reconnects
+        self.lock = asyncio.Lock()
+
+    def update_profile(self, changes: Dict[str, Any]) -> None:
+        self.profile = {**self.profile, **changes}
+
+    def record_turn(self, category: str, message: str, answer: Dict[str, Any]) -> None:
+        self.turn_count += 1
+        self.turns.append(
+            f"- [{category}] \"{message[:120]}\" -> target NPR {answer.get('target_amount_npr', 0):,},"
+            f" {answer.get('months_needed', 0)} months"
+        )
+        self.last_answer = answer
+        self.answered_categories.add(category)
+
+    def summary(self) -> str:
+        """Earlier turns, oldest first; turns beyond the window are only counted"""
+        if not self.turns:
+            return ""
+        dropped = self.turn_count - len(self.turns)
+        header = f"Earlier in this chat ({dropped} older turns omitted):" if dropped else "Earlier in this chat:"
+        return "\n".join([header, *self.turns])
+
+
+class SessionStore:
+    """Bounded, idle-expiring map of session_id -> ChatSession"""
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        idle_seconds: float = 900,
+        max_turns: int = 6,
+        sweep_seconds: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_turns = max_turns
+        self.sweep_seconds = sweep_seconds
+        self._clock = clock
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._counts = {"created": 0, "resumed": 0, "turns": 0, "evicted_idle": 0, "evicted_lru": 0, "closed": 0}
+
+    def _evict_idle(self, now: float) -> None:
+        # Least recently active first, so stop at the first live one
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_active < self.idle_seconds:
+                break
+            self._sessions.popitem(last=False)
+            self._counts["evicted_idle"] += 1
+
+    def sweep(self) -> None:
+        """Drop every session idle for ``idle_seconds``"""
+        self._evict_idle(self._clock())
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            self.sweep()
+
+    def start(self) -> None:
+        """Start the idle sweep on the running loop"""
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        """Stop the idle sweep"""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+
+    def create(self, profile: Dict[str, Any], past_context: str = "") -> ChatSession:
+        now = self._clock()
+        self._evict_idle(now)
+        session = ChatSession(profile, past_context, self.max_turns, now)
+        self._sessions[session.session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self._counts["evicted_lru"] += 1
+        self._counts["created"] += 1
+        return session
+
+    def resume(self, session_id: str) -> Optional[ChatSession]:
+        """A live session by id (marked active), or None if unknown or expired"""
+        now = self._clock()
+        self._evict_idle(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self.touch(session)
+            self._counts["resumed"] += 1
+        return session
+
+    def touch(self, session: ChatSession) -> None:
+        session.last_active = self._clock()
+        if session.session_id in self._sessions:
+            self._sessions.move_to_end(session.session_id)
+
+    def record_turn(self, session: ChatSession, category: str, message: str, answer: Dict[str, Any]) -> None:
+        session.record_turn(category, message, answer)
+        self.touch(session)
+        self._counts["turns"] += 1
+
+    def close(self, session_id: str) -> None:
+        if self._sessions.pop(session_id, None) is not None:
+            self._counts["closed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": len(self._sessions), "max_sessions": self.max_sessions, **self._counts}
+
+
+def sessions_from_env() -> SessionStore:
+    """CHAT_MAX_SESSIONS, CHAT_IDLE_SECONDS, CHAT_SUMMARY_TURNS, CHAT_SWEEP_SECONDS"""
+    return SessionStore(
+        max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "10000")),
+        idle_seconds=float(os.getenv("CHAT_IDLE_SECONDS", "900")),
+        max_turns=int(os.getenv("CHAT_SUMMARY_TURNS", "6")),
+        sweep_seconds=float(os.getenv("CHAT_SWEEP_SECONDS", "60")),
+    )
@@ -0,0 +1,130 @@
+"""
+Compact output contract for advice generation.
+
+AdviceResponse carries the answer text twice (``response_np`` and
+``response_en``, both English since the prompts went English-only, kept for
+existing clients) under long key names, and finance.py computes most of its
+numbers anyway. Gemini is instead asked for the smallest object the server
+cannot produce itself:
+
+    r       the answer text, written once (-> response_en and response_np)
+    t       target_amount_npr
+    m       months_needed                  (only where the model's number is kept)
+    s       realistic_monthly_savings_npr  (only where it is not computed)
+    tips    tips
+    alt     alternatives: [{"n": name, "p": price_npr, "m": months_needed}]
+
+Which of ``m``, ``s`` and ``alt.m`` a category's schema asks for follows
+CATEGORY_RULES. ``expand_advice`` turns a parsed reply into AdviceResponse
+field names right after parsing, and ``expand_event`` does the same for the
+streaming parser's events, so caching, number coercion, validation and
+clients only ever see the public shape.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from finance import CATEGORY_RULES
+from structured_output import gemini_schema
+
+# Compact key -> AdviceResponse field, for the top level and for alternatives
+ADVICE_KEYS = {
+    "t": "target_amount_npr",
+    "m": "months_needed",
+    "s": "realistic_monthly_savings_npr",
+    "tips": "tips",
+    "alt": "alternatives",
+}
+ALTERNATIVE_KEYS = {"n": "name", "p": "price_npr", "m": "months_needed"}
+TEXT_KEY = "r"
+TEXT_FIELDS = ("response_en", "response_np")
+
+
+class CompactAlternative(BaseModel):
+    n: str = Field(description="name")
+    p: int = Field(description="price in NPR")
+    m: int = Field(description="months")
+
+
+class CompactAdvice(BaseModel):
+    r: str = Field(description="the answer text, in English")
+    t: int = Field(description="target amount in NPR")
+    m: int = Field(description="months needed")
+    s: int = Field(description="realistic monthly savings in NPR")
+    tips: List[str]
+    alt: List[CompactAlternative] = Field(description="alternatives")
+
+
+def compact_schema(category: str) -> Dict[str, Any]:
+    """Response schema for one category: only the values the server does not compute"""
+    rules = CATEGORY_RULES[category]
+    exclude = []
+    if rules["months"] is not None:
+        exclude.append("m")
+    if rules["savings"] is not None:
+        exclude.append("s")
+    if rules["alternatives"] is not None:
+        exclude.append("alt.m")
+    return gemini_schema(CompactAdvice, exclude=exclude)
+
+
+def _expand_alternative(value: Any) -> Any:
+    if not isinstance(value, dict):
+        return value
+    return {ALTERNATIVE_KEYS.get(key, key): item for key, item in value.items()}
+
+
+def expand_advice(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    AdviceResponse-shaped dict from a compact reply. Keys that are already
+    public (a reply that ignored the schema) pass through unchanged.
+    """
+    expanded: Dict[str, Any] = {}
+    for key, value in data.items():
+        if key == TEXT_KEY:
+            for field in TEXT_FIELDS:
+                expanded[field] = value
+        elif key == "alt" and isinstance(value, list):
+            expanded["alternatives"] = [_expand_alternative(item) for item in value]
+        else:
+            expanded.setdefault(ADVICE_KEYS.get(key, key), value)
+    return expanded
+
+
+def expand_event(event: str, data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Streaming parser events under public field names (the answer text as response_en)"""
+    key = data.get("field")
+    if key == TEXT_KEY:
+        if event == "field":
+            return [(event, {**data, "field": field}) for field in TEXT_FIELDS]
+        return [(event, {**data, "field": TEXT_FIELDS[0]})]
+    renamed = {**data, "field": ADVICE_KEYS.get(key, key)}
+    if key == "alt":
+        if event == "item":
+            renamed["value"] = _expand_alternative(data.get("value"))
+        elif event == "field" and isinstance(data.get("value"), list):
+            renamed["value"] = [_expand_alternative(item) for item in data["value"]]
+    return [(event, renamed)]
+
+
+def compact_advice(advice: Dict[str, Any], category: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The compact reply for a public advice dict (inverse of expand_advice),
+    limited to what ``category``'s schema asks for when given
+    """
+    properties = compact_schema(category)["properties"] if category else None
+    compact: Dict[str, Any] = {TEXT_KEY: advice.get("response_en", advice.get("response_np", ""))}
+    alternative_keys = {field: key for key, field in ALTERNATIVE_KEYS.items()}
+    for key, field in ADVICE_KEYS.items():
+        if field not in advice or (properties is not None and key not in properties):
+            continue
+        value = advice[field]
+        if key == "alt":
+            allowed = properties["alt"]["items"]["properties"] if properties is not None else None
+            value = [
+                {alternative_keys[name]: item for name, item in alternative.items()
+                 if name in alternative_keys and (allowed is None or alternative_keys[name] in allowed)}
+                for alternative in value
+            ]
+        compact[key] = value
+    return compact
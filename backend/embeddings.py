@@ -0,0 +1,95 @@
+"""
+Pluggable text embedders for retrieval.
+
+Every embedder exposes ``async embed(texts) -> np.ndarray`` returning one
+L2-normalized float32 row per text, so callers can use a plain dot product
+as cosine similarity.
+
+- ``HashingEmbedder``: local and deterministic (feature hashing of word and
+  character n-grams). No network, used for tests and local development.
+- ``GeminiEmbedder``: Gemini embedding model, called through the LLM pool.
+"""
+import hashlib
+import os
+import re
+from typing import Any, List, Optional
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row (zero rows stay zero)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-n-grams embedder via the hashing trick"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN_RE.findall(text.lower())
+        features = list(tokens)
+        features += [a + " " + b for a, b in zip(tokens, tokens[1:])]
+        for token in tokens:
+            padded = f"#{token}#"
+            features += [padded[i:i + 3] for i in range(max(1, len(padded) - 2))]
+        return features
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                matrix[row, (value >> 1) % self.dim] += sign
+        return normalize_rows(matrix)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return self.embed_sync(texts)
+
+
+class GeminiEmbedder:
+    """Gemini embedding model; batches requests and respects the LLM pool"""
+
+    # Gemini accepts at most 100 texts per embedding request
+    batch_size = 100
+
+    def __init__(self, client: Any, model: str = "text-embedding-004", pool: Any = None):
+        self.client = client
+        self.model = model
+        self.pool = pool
+        self.name = f"gemini-{model}"
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        def call():
+            return self.client.aio.models.embed_content(model=self.model, contents=texts)
+
+        response = await (self.pool.run(call) if self.pool is not None else call())
+        return np.array([e.values for e in response.embeddings], dtype=np.float32)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        parts = [
+            await self._embed_batch(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return normalize_rows(np.vstack(parts))
+
+
+def embedder_from_env(client: Any = None, pool: Any = None, backend: Optional[str] = None):
+    """EMBEDDING_BACKEND=gemini (default) or hashing; EMBEDDING_MODEL / EMBEDDING_DIM tune them"""
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "gemini")).strip().lower()
+    if backend == "hashing" or client is None:
+        return HashingEmbedder(dim=int(os.getenv("EMBEDDING_DIM", "256")))
+    if backend == "gemini":
+        return GeminiEmbedder(client, model=os.getenv("EMBEDDING_MODEL", "text-embedding-004"), pool=pool)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
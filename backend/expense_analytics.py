@@ -0,0 +1,306 @@
+"""
+Local expense analytics for /api/v1/feedback.
+
+Free-form expense keys ("daraz_shopping", "emi", "room_rent") are mapped to
+a fixed set of spending groups, and every user is scored against reference
+budget shares for their location: group shares, NPR deviation from the
+reference, month-over-month change and the savings rate. The largest over-
+and under-spends become the feedback items, with amounts computed here, so
+the model only writes the wording for items it is given.
+
+``analyze_expenses_batch`` scores many users at once on a (users x groups)
+matrix; /api/v1/feedback/batch sends every request in one pass and
+``analyze_expenses`` is the one-user case.
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Spending groups and the keywords that put an expense key into them; first
+# match wins, unmatched keys go to "other"
+EXPENSE_GROUPS = [
+    ("housing", ("rent", "house", "room", "flat", "apartment", "home")),
+    ("debt", ("emi", "loan", "credit", "installment", "interest")),
+    ("savings", ("saving", "sip", "invest", "deposit", "fd", "share", "stock", "ssf", "cit", "gold")),
+    ("food", ("food", "grocer", "restaurant", "foodmandu", "dining", "meal", "eating", "lunch", "dinner", "snack", "tea", "coffee", "vegetable", "meat")),
+    ("transport", ("transport", "petrol", "fuel", "pathao", "indrive", "bus", "taxi", "bike", "car", "travel", "commute")),
+    ("utilities", ("electric", "water", "internet", "wifi", "phone", "mobile", "ntc", "ncell", "gas", "utility", "recharge")),
+    ("education", ("school", "tuition", "education", "college", "course", "book", "exam")),
+    ("health", ("health", "medical", "medicine", "hospital", "doctor", "clinic", "gym", "insurance")),
+    ("shopping", ("shop", "daraz", "cloth", "gadget", "electronic", "fashion", "amazon")),
+    ("entertainment", ("entertain", "movie", "netflix", "subscription", "party", "alcohol", "drink", "game", "outing", "trip")),
+    ("family", ("family", "remit", "gift", "festival", "dashain", "tihar", "donation", "puja", "wedding")),
+    ("other", ()),
+]
+# Words that only say how something is paid ("netflix_fee", "gym_fee",
+# "phone_bill"); they decide the group only when no other keyword matches
+GENERIC_KEYWORDS = {"fee": "education", "fees": "education", "bill": "utilities", "bills": "utilities"}
+GROUPS = [name for name, _ in EXPENSE_GROUPS]
+_GROUP_INDEX = {name: i for i, name in enumerate(GROUPS)}
+
+# Groups where spending more than the reference is a good sign
+POSITIVE_GROUPS = {"savings"}
+
+# Groups where spending below the reference counts as a "right"; spending
+# little on education or health is not something to praise
+DISCRETIONARY_GROUPS = {"food", "transport", "utilities", "shopping", "entertainment", "other"}
+
+# Typical share of monthly spending per group, by location tier. Shares are of
+# consumption (everything except "savings", which has no reference: any
+# amount there is a plus); each row sums to 1.
+REFERENCE_SHARES: Dict[str, Dict[str, float]] = {
+    "kathmandu_valley": {
+        "housing": 0.25, "debt": 0.10, "savings": 0.0, "food": 0.25, "transport": 0.08, "utilities": 0.06,
+        "education": 0.08, "health": 0.04, "shopping": 0.05, "entertainment": 0.03, "family": 0.03, "other": 0.03,
+    },
+    "city": {
+        "housing": 0.20, "debt": 0.10, "savings": 0.0, "food": 0.28, "transport": 0.07, "utilities": 0.06,
+        "education": 0.09, "health": 0.05, "shopping": 0.05, "entertainment": 0.03, "family": 0.04, "other": 0.03,
+    },
+    "other": {
+        "housing": 0.12, "debt": 0.10, "savings": 0.0, "food": 0.33, "transport": 0.06, "utilities": 0.05,
+        "education": 0.10, "health": 0.06, "shopping": 0.05, "entertainment": 0.03, "family": 0.06, "other": 0.04,
+    },
+}
+LOCATION_TIERS = {
+    "kathmandu": "kathmandu_valley", "lalitpur": "kathmandu_valley", "patan": "kathmandu_valley",
+    "bhaktapur": "kathmandu_valley", "kirtipur": "kathmandu_valley",
+    "pokhara": "city", "biratnagar": "city", "birgunj": "city", "butwal": "city", "bharatpur": "city",
+    "chitwan": "city", "dharan": "city", "hetauda": "city", "nepalgunj": "city", "dhangadhi": "city",
+    "janakpur": "city", "itahari": "city", "bhairahawa": "city",
+}
+_TIERS = list(REFERENCE_SHARES)
+_REFERENCE_MATRIX = np.array([[REFERENCE_SHARES[tier][group] for group in GROUPS] for tier in _TIERS])
+
+# Savings rate (of income) treated as healthy
+TARGET_SAVINGS_RATE = 0.20
+
+# Deviations smaller than this (NPR, or share of total spending) are noise
+MIN_DEVIATION_NPR = 500.0
+MIN_DEVIATION_SHARE = 0.02
+
+MAX_ITEMS = 4
+
+_SPLIT_RE = re.compile(r"[^a-z]+")
+
+
+@lru_cache(maxsize=4096)
+def expense_group(key: str) -> str:
+    """Spending group for a free-form expense key"""
+    text = key.strip().lower()
+    words = [w for w in _SPLIT_RE.split(text) if w]
+    for name, keywords in EXPENSE_GROUPS:
+        for keyword in keywords:
+            # Short keywords must match a whole word ("fd", "car", "eat"), longer ones a prefix
+            if any(w == keyword or (len(keyword) > 3 and w.startswith(keyword)) for w in words):
+                return name
+    for w in words:
+        if w in GENERIC_KEYWORDS:
+            return GENERIC_KEYWORDS[w]
+    return "other"
+
+
+def location_tier(location: Optional[str]) -> str:
+    return LOCATION_TIERS.get((location or "").strip().lower(), "other")
+
+
+def _group_matrix(expenses: Sequence[Optional[Dict[str, float]]]) -> np.ndarray:
+    """(users x groups) NPR totals; rows for missing dicts are NaN"""
+    rows, cols, values = [], [], []
+    for row, items in enumerate(expenses):
+        for key, value in (items or {}).items():
+            rows.append(row)
+            cols.append(_GROUP_INDEX[expense_group(key)])
+            values.append(float(value or 0.0))
+    matrix = np.zeros((len(expenses), len(GROUPS)))
+    np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), np.array(values))
+    missing = np.array([items is None for items in expenses], dtype=bool)
+    matrix[missing] = np.nan
+    return matrix
+
+
+def analyze_expenses_batch(
+    expenses: Sequence[Dict[str, float]],
+    locations: Sequence[Optional[str]],
+    previous_expenses: Optional[Sequence[Optional[Dict[str, float]]]] = None,
+    incomes: Optional[Sequence[Optional[float]]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Score many users at once. Returns (users x groups) arrays ``amount``,
+    ``share`` (of consumption), ``reference_share``, ``deviation`` (NPR above
+    the reference, negative when below) and ``mom_delta`` (NaN without a
+    previous month), plus per-user ``total``, ``previous_total``, ``income``
+    and ``savings`` (income - consumption, so money moved into savings counts
+    as saved; NaN when income is unknown).
+    """
+    n = len(expenses)
+    amount = _group_matrix(expenses)
+    total = amount.sum(axis=1)
+    spending = total - amount[:, _GROUP_INDEX["savings"]]
+    tiers = np.array([_TIERS.index(location_tier(loc)) for loc in locations], dtype=np.int64)
+    reference_share = _REFERENCE_MATRIX[tiers]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(spending[:, None] > 0, amount / spending[:, None], 0.0)
+    deviation = amount - reference_share * spending[:, None]
+
+    previous = _group_matrix(previous_expenses if previous_expenses is not None else [None] * n)
+    income = np.array(
+        [np.nan if value is None else float(value) for value in (incomes if incomes is not None else [None] * n)]
+    )
+    return {
+        "amount": amount,
+        "share": share,
+        "reference_share": reference_share,
+        "deviation": deviation,
+        "mom_delta": amount - previous,
+        "total": total,
+        "previous_total": previous.sum(axis=1),
+        "income": income,
+        "savings": income - spending,
+    }
+
+
+def user_row(batch: Dict[str, np.ndarray], row: int) -> Dict[str, Any]:
+    """One user's slice of an ``analyze_expenses_batch`` result"""
+    return {name: values[row] for name, values in batch.items()}
+
+
+def _pct(value: float) -> str:
+    return f"{value * 100:.0f}%"
+
+
+def select_items(analysis: Dict[str, Any], max_items: int = MAX_ITEMS) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Rights and wrongs for one user, largest first: {"rights": [...], "wrongs": [...]}.
+    Each item has an ``id``, the NPR ``amount``, a short ``note`` for the
+    prompt and a default ``title`` and ``description`` used when the model
+    does not write its own.
+    """
+    amount = analysis["amount"]
+    deviation = analysis["deviation"]
+    threshold = max(MIN_DEVIATION_NPR, MIN_DEVIATION_SHARE * float(analysis["total"]))
+    rights: List[Dict[str, Any]] = []
+    wrongs: List[Dict[str, Any]] = []
+
+    income = float(analysis["income"])
+    if not np.isnan(income) and income > 0:
+        savings = float(analysis["savings"])
+        target = TARGET_SAVINGS_RATE * income
+        if savings >= target:
+            rights.append({
+                "id": "savings_rate", "amount": round(savings), "note": f"saved, {_pct(savings / income)} of income",
+                "title": "Healthy savings rate",
+                "description": f"You saved NPR {savings:,.0f} ({_pct(savings / income)} of income) after living costs.",
+            })
+        else:
+            wrongs.append({
+                "id": "savings_rate", "amount": round(target - savings),
+                "note": f"short of saving 20% of income (saved {_pct(max(savings, 0) / income)})",
+                "title": "Savings below 20% of income",
+                "description": f"You saved NPR {max(savings, 0):,.0f} ({_pct(max(savings, 0) / income)} of income), "
+                               f"NPR {target - savings:,.0f} short of saving 20%.",
+            })
+
+    order = np.argsort(-np.abs(deviation))
+    for index in order:
+        group = GROUPS[index]
+        value = float(deviation[index])
+        if group in POSITIVE_GROUPS:
+            if amount[index] > 0:
+                rights.append({
+                    "id": group, "amount": round(float(amount[index])), "note": "put into savings/investments",
+                    "title": "Money set aside for savings and investment",
+                    "description": f"NPR {amount[index]:,.0f} went to savings or investments this month.",
+                })
+            continue
+        if abs(value) < threshold:
+            continue
+        typical = f"{_pct(analysis['reference_share'][index])} typical for your area"
+        change = float(analysis["mom_delta"][index])
+        trend = "" if np.isnan(change) else f" ({change:+,.0f} vs last month)"
+        if value > 0:
+            wrongs.append({
+                "id": group, "amount": round(value), "note": "above typical",
+                "title": f"High {group} spending",
+                "description": f"{group.capitalize()} took {_pct(analysis['share'][index])} of spending "
+                               f"vs {typical}: NPR {value:,.0f} above it{trend}.",
+            })
+        elif group in DISCRETIONARY_GROUPS and amount[index] > 0:
+            rights.append({
+                "id": group, "amount": round(-value), "note": "below typical",
+                "title": f"Low {group} spending",
+                "description": f"{group.capitalize()} took {_pct(analysis['share'][index])} of spending "
+                               f"vs {typical}: NPR {-value:,.0f} below it{trend}.",
+            })
+    rights.sort(key=lambda item: -item["amount"])
+    wrongs.sort(key=lambda item: -item["amount"])
+    return {"rights": rights[:max_items], "wrongs": wrongs[:max_items]}
+
+
+def summary_lines(
+    analysis: Dict[str, Any],
+    expenses: Dict[str, float],
+) -> List[str]:
+    """
+    Compact per-group prompt lines, largest first: "shopping 26,800 37%/5%
+    +21,800 [daraz_shopping]" (share of consumption / reference share,
+    change vs last month, expense keys)
+    """
+    keys_by_group: Dict[str, List[str]] = {}
+    for key in expenses:
+        keys_by_group.setdefault(expense_group(key), []).append(key)
+    has_previous = not np.isnan(analysis["previous_total"])
+    lines = []
+    for index in np.argsort(-analysis["amount"]):
+        group = GROUPS[index]
+        value = float(analysis["amount"][index])
+        if value <= 0 and not (has_previous and analysis["mom_delta"][index]):
+            continue
+        line = f"{group} {value:,.0f}"
+        if group not in POSITIVE_GROUPS:
+            line += f" {_pct(analysis['share'][index])}/{_pct(analysis['reference_share'][index])}"
+        if has_previous:
+            line += f" {analysis['mom_delta'][index]:+,.0f}"
+        keys = keys_by_group.get(group, [])
+        if keys and keys != [group]:
+            line += f" [{', '.join(keys)}]"
+        lines.append(line)
+    return lines
+
+
+def feedback_analysis(analysis: Dict[str, Any], expenses: Dict[str, float], location: Optional[str]) -> Dict[str, Any]:
+    """Totals, prompt summary lines and selected items from one user's row"""
+    previous_total = float(analysis["previous_total"])
+    return {
+        "total": float(analysis["total"]),
+        "previous_total": None if np.isnan(previous_total) else previous_total,
+        "tier": location_tier(location),
+        "lines": summary_lines(analysis, expenses),
+        **select_items(analysis),
+    }
+
+
+def analyze_expenses_many(
+    expenses: Sequence[Dict[str, float]],
+    locations: Sequence[Optional[str]],
+    previous_expenses: Optional[Sequence[Optional[Dict[str, float]]]] = None,
+    incomes: Optional[Sequence[Optional[float]]] = None,
+) -> List[Dict[str, Any]]:
+    """``analyze_expenses`` for many users, scored in one batch"""
+    batch = analyze_expenses_batch(expenses, locations, previous_expenses, incomes)
+    return [
+        feedback_analysis(user_row(batch, row), items, location)
+        for row, (items, location) in enumerate(zip(expenses, locations))
+    ]
+
+
+def analyze_expenses(
+    expenses: Dict[str, float],
+    location: Optional[str],
+    previous_expenses: Optional[Dict[str, float]] = None,
+    income: Optional[float] = None,
+) -> Dict[str, Any]:
+    """One user's analysis: totals, prompt summary lines and selected items"""
+    return analyze_expenses_many([expenses], [location], [previous_expenses], [income])[0]
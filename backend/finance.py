@@ -0,0 +1,133 @@
+"""
+Deterministic finance engine for the numeric fields of AdviceResponse.
+
+The LLM supplies prose, a target price and alternative prices; everything
+derived from them (monthly savings, months needed, progress) is computed here
+instead of trusting the model's arithmetic. The goal functions accept
+scalars or NumPy arrays and broadcast, so an answer's whole list of
+alternatives is scored in one call.
+"""
+from typing import Any, Dict, Union
+
+import numpy as np
+
+ArrayLike = Union[float, int, np.ndarray, list]
+
+# 15% Nepal buffer for inflation, festivals and emergencies
+SAVINGS_BUFFER = 0.85
+
+# months_needed reported when the goal cannot be reached at current savings
+UNREACHABLE_MONTHS = 999
+
+# How each category's numbers are produced:
+#   "goal"   -> computed from target / prices, current savings and monthly savings
+#   "local"  -> realistic monthly savings computed from income and expenses
+#   int      -> fixed value from the category's planning horizon
+#   None     -> the model's own number is kept (its meaning is not goal math,
+#               e.g. loan tenure, months until Dashain, side-income earnings)
+CATEGORY_RULES: Dict[str, Dict[str, Any]] = {
+    "buy": {"savings": "local", "months": "goal", "progress": "goal", "alternatives": "goal"},
+    "big-goal": {"savings": "local", "months": "goal", "progress": "goal", "alternatives": "goal"},
+    "festival": {"savings": "local", "months": None, "progress": "goal", "alternatives": "goal"},
+    "invest": {"savings": "local", "months": None, "progress": "goal", "alternatives": None},
+    "tax": {"savings": "local", "months": 12, "progress": "goal", "alternatives": 12},
+    "loan": {"savings": "local", "months": None, "progress": "goal", "alternatives": None},
+    "reduce-expense": {"savings": None, "months": 3, "progress": 0, "alternatives": 12},
+    "side-income": {"savings": "local", "months": None, "progress": 0, "alternatives": None},
+}
+
+
+def realistic_monthly_savings(income: ArrayLike, total_expenses: ArrayLike) -> np.ndarray:
+    """(income - expenses) x 0.85, floored at zero"""
+    income = np.asarray(income, dtype=np.float64)
+    total_expenses = np.asarray(total_expenses, dtype=np.float64)
+    return np.maximum(income - total_expenses, 0.0) * SAVINGS_BUFFER
+
+
+def months_needed(target: ArrayLike, current_savings: ArrayLike, monthly_savings: ArrayLike) -> np.ndarray:
+    """
+    Whole months until ``current_savings`` grows to ``target`` at
+    ``monthly_savings`` a month. 0 when already reached, UNREACHABLE_MONTHS
+    when nothing is being saved.
+    """
+    target = np.asarray(target, dtype=np.float64)
+    current_savings = np.asarray(current_savings, dtype=np.float64)
+    monthly_savings = np.asarray(monthly_savings, dtype=np.float64)
+    remaining = np.maximum(target - current_savings, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        months = np.ceil(remaining / monthly_savings)
+    months = np.where(remaining <= 0, 0, months)
+    months = np.where((remaining > 0) & (monthly_savings <= 0), UNREACHABLE_MONTHS, months)
+    return np.minimum(months, UNREACHABLE_MONTHS).astype(np.int64)
+
+
+def progress_percent(target: ArrayLike, current_savings: ArrayLike) -> np.ndarray:
+    """current / target as a whole percentage clipped to 0..100"""
+    target = np.asarray(target, dtype=np.float64)
+    current_savings = np.asarray(current_savings, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = np.where(target > 0, current_savings / target * 100.0, 100.0)
+    return np.clip(np.rint(percent), 0, 100).astype(np.int64)
+
+
+def _as_int(value: Any) -> int:
+    return int(np.rint(float(value))) if value is not None else 0
+
+
+def compute_advice_numbers(
+    category: str,
+    monthly_income_npr: float,
+    monthly_expenses_npr: Dict[str, float],
+    current_savings_npr: float,
+    advice_data: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Fill the numeric fields of an advice dict (and of its alternatives) from
+    the request and the model-supplied prices, following CATEGORY_RULES.
+    The dict is updated in place and returned.
+    """
+    rules = CATEGORY_RULES.get(category, CATEGORY_RULES["buy"])
+    total_expenses = sum(monthly_expenses_npr.values())
+    savings = float(realistic_monthly_savings(monthly_income_npr, total_expenses))
+
+    if rules["savings"] == "local":
+        advice_data["realistic_monthly_savings_npr"] = _as_int(savings)
+    else:
+        advice_data["realistic_monthly_savings_npr"] = _as_int(
+            advice_data.get("realistic_monthly_savings_npr", savings)
+        )
+    monthly = float(advice_data["realistic_monthly_savings_npr"])
+
+    target = _as_int(advice_data.get("target_amount_npr", 0))
+    advice_data["target_amount_npr"] = target
+
+    if rules["months"] == "goal":
+        advice_data["months_needed"] = int(months_needed(target, current_savings_npr, monthly))
+    elif isinstance(rules["months"], int):
+        advice_data["months_needed"] = rules["months"]
+    else:
+        advice_data["months_needed"] = _as_int(advice_data.get("months_needed", 0))
+
+    if rules["progress"] == "goal":
+        advice_data["progress_percent"] = int(progress_percent(target, current_savings_npr))
+    elif isinstance(rules["progress"], int):
+        advice_data["progress_percent"] = rules["progress"]
+    else:
+        advice_data["progress_percent"] = _as_int(advice_data.get("progress_percent", 0))
+
+    alternatives = advice_data.get("alternatives") or []
+    if alternatives:
+        prices = np.array([float(alt.get("price_npr") or 0) for alt in alternatives])
+        if rules["alternatives"] == "goal":
+            months = months_needed(prices, current_savings_npr, monthly)
+        elif isinstance(rules["alternatives"], int):
+            months = np.full(len(alternatives), rules["alternatives"], dtype=np.int64)
+        else:
+            months = np.array([_as_int(alt.get("months_needed", 0)) for alt in alternatives])
+        rounded_prices = np.rint(prices).astype(np.int64)
+        for alt, price, month in zip(alternatives, rounded_prices, months):
+            alt["price_npr"] = int(price)
+            alt["months_needed"] = int(month)
+    advice_data["alternatives"] = alternatives
+    return advice_data
+
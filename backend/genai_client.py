@@ -0,0 +1,148 @@
+"""
+Gemini client built on first use, with an optional background prewarm.
+
+Importing ``google.genai`` takes about half of the app's import time, so
+the client is only imported and constructed when something first touches it
+(``client.aio`` in the LLM pool, or ``prewarm()``). ``LazyGenaiClient``
+forwards attribute access to the real ``genai.Client``, so the pool and the
+embedder use it unchanged.
+
+google-genai 1.0.0 opens a new ``requests.Session`` for every call, so
+each call paid a TCP + TLS handshake (and loaded the CA bundle again). The
+built client is given one shared session instead, with a keep-alive
+connection pool of ``pool_size`` (the SDK's private API-key request path
+is replaced on that client only; Vertex AI auth is left alone). The
+replacement copies 1.0.0's code, so it is only installed on exactly that
+version; any other version keeps its own request path.
+
+``prewarm()`` is meant for a background thread at startup: it builds the
+client and makes one free metadata call (``models.get``), so the import,
+DNS lookup, TLS handshake and API key check are done before the first user
+request, which then reuses the open connection.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# The google-genai version whose private request path _use_pooled_session replaces
+POOLED_SESSION_SDK_VERSION = "1.0.0"
+
+
+class LazyGenaiClient:
+    """Proxy for ``genai.Client`` that imports and constructs it on first use"""
+
+    def __init__(self, api_key: str, base_url: str = "", pool_size: int = 32):
+        self._api_key = api_key
+        self._base_url = base_url
+        self._pool_size = pool_size
+        self._client: Any = None
+        self._lock = threading.Lock()
+        self._build_seconds: Optional[float] = None
+        self._pooled = False
+        self._prewarm: Dict[str, Any] = {"status": "not_started"}
+
+    def get(self) -> Any:
+        """The real client, built on the first call (thread-safe)"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    from google import genai
+
+                    client = genai.Client(
+                        api_key=self._api_key,
+                        http_options={"base_url": self._base_url} if self._base_url else None,
+                    )
+                    if self._pool_size > 0:
+                        self._pooled = _use_pooled_session(client, self._pool_size)
+                    self._client = client
+                    self._build_seconds = time.perf_counter() - started
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached for attributes not set in __init__ (aio, models, ...)
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def prewarm(self, model: str) -> Dict[str, Any]:
+        """Build the client and fetch ``model``'s metadata; never raises"""
+        self._prewarm = {"status": "running"}
+        started = time.perf_counter()
+        try:
+            self.get()
+            built = time.perf_counter()
+            self.get().models.get(model=model)
+            self._prewarm = {
+                "status": "done",
+                "build_seconds": round(built - started, 3),
+                "call_seconds": round(time.perf_counter() - built, 3),
+            }
+        except Exception as e:
+            self._prewarm = {"status": "failed", "error": str(e)[:200], "seconds": round(time.perf_counter() - started, 3)}
+            print(f"Gemini prewarm failed: {e}")
+        return self._prewarm
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "built": self._client is not None,
+            "build_seconds": round(self._build_seconds, 3) if self._build_seconds is not None else None,
+            "pooled_session": self._pooled,
+            "prewarm": self._prewarm,
+        }
+
+
+def _use_pooled_session(client: Any, pool_size: int) -> bool:
+    """
+    Send ``client``'s API-key requests through one keep-alive session;
+    False (client untouched) on any google-genai but POOLED_SESSION_SDK_VERSION
+    """
+    import requests
+    from google import genai
+    from google.genai import errors
+
+    version = getattr(genai, "__version__", None)
+    if version != POOLED_SESSION_SDK_VERSION:
+        print(f"google-genai {version}: keeping its own HTTP session (pooling is written for {POOLED_SESSION_SDK_VERSION})")
+        return False
+    from google.genai._api_client import HttpResponse
+
+    api_client = client._api_client
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def request_unauthorized(http_request: Any, stream: bool = False) -> Any:
+        # Same as the SDK's version, minus the new Session per call
+        data = http_request.data
+        if data and not isinstance(data, bytes):
+            data = json.dumps(data)
+        response = session.request(
+            method=http_request.method,
+            url=http_request.url,
+            headers=http_request.headers,
+            data=data or None,
+            timeout=http_request.timeout,
+            stream=stream,
+        )
+        errors.APIError.raise_for_response(response)
+        return HttpResponse(response.headers, response if stream else [response.text])
+
+    api_client._request_unauthorized = request_unauthorized
+    return True
+
+
+def client_from_env(api_key: str) -> LazyGenaiClient:
+    """
+    GEMINI_BASE_URL points the client at another endpoint, e.g.
+    benchmarks/fake_gemini.py; GEMINI_HTTP_POOL_SIZE keep-alive connections
+    (0 keeps the SDK's session per call)
+    """
+    return LazyGenaiClient(
+        api_key,
+        base_url=os.getenv("GEMINI_BASE_URL", "").strip(),
+        pool_size=int(os.getenv("GEMINI_HTTP_POOL_SIZE", "32")),
+    )
@@ -0,0 +1,293 @@
+"""
+Per-user history behind the "Past Month Data" part of the advice prompt.
+
+An embedded SQLite file (WAL mode, so reads never wait for the writer) holds
+each user's monthly expenses, recorded by /api/v1/feedback, and a short log
+of the advice they were given. Reads are indexed point lookups run off the
+event loop (well under a millisecond of SQLite time). Writes are queued in
+memory and flushed in one transaction every ``flush_seconds`` (or once
+``max_batch`` are queued); reads merge the queued writes, so a user sees
+their own data before it is flushed. Each flush trims the users it touched
+to their newest ``max_months`` months and ``max_advice`` advice entries.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS monthly_expenses ("
+    " user_id TEXT NOT NULL,"
+    " month TEXT NOT NULL,"
+    " expenses TEXT NOT NULL,"
+    " updated_at REAL NOT NULL,"
+    " PRIMARY KEY (user_id, month)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS advice_history ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " user_id TEXT NOT NULL,"
+    " created_at REAL NOT NULL,"
+    " category TEXT NOT NULL,"
+    " message TEXT NOT NULL,"
+    " target_amount_npr INTEGER NOT NULL,"
+    " months_needed INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_advice_history_user ON advice_history (user_id, created_at DESC)",
+)
+
+
+def previous_month(month: str) -> Optional[str]:
+    """'2025-01' -> '2024-12'; None if ``month`` is not YYYY-MM"""
+    try:
+        year, mon = (int(part) for part in month.split("-", 1))
+    except ValueError:
+        return None
+    if not 1 <= mon <= 12:
+        return None
+    return f"{year - 1}-12" if mon == 1 else f"{year}-{mon - 1:02d}"
+
+
+class HistoryStore:
+    """Monthly expenses and past advice per user_id, in one SQLite file"""
+
+    def __init__(
+        self,
+        path: str,
+        max_months: int = 24,
+        max_advice: int = 20,
+        flush_seconds: float = 0.5,
+        max_batch: int = 256,
+    ):
+        self.path = path
+        self.max_months = max_months
+        self.max_advice = max_advice
+        self.flush_seconds = flush_seconds
+        self.max_batch = max_batch
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One connection for the flusher, one for reads; WAL lets them overlap
+        self._write_conn = self._connect()
+        for statement in _SCHEMA:
+            self._write_conn.execute(statement)
+        self._write_conn.commit()
+        self._read_conn = self._connect()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        # Queued writes: latest expenses per (user, month), advice rows in order
+        self._pending_months: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._pending_advice: List[Tuple[str, float, str, str, int, int]] = []
+        # The batch being written, still visible to reads until it commits
+        self._flushing_months: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._flushing_advice: List[Tuple[str, float, str, str, int, int]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flushes = 0
+        self._rows_written = 0
+        self._lookups = 0
+        self._lookup_seconds = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # -- writes -------------------------------------------------------------
+
+    def _ensure_flusher(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def _queued(self) -> int:
+        return len(self._pending_months) + len(self._pending_advice)
+
+    def record_month(self, user_id: str, month: str, expenses: Dict[str, float]) -> None:
+        """Queue a user's expenses for a month (replaces an earlier record for that month)"""
+        self._pending_months[(user_id, month)] = dict(expenses)
+        self._ensure_flusher()
+        if self._queued() >= self.max_batch:
+            self._wakeup.set()
+
+    def record_advice(self, user_id: str, category: str, message: str, target_amount_npr: int, months_needed: int) -> None:
+        """Queue one advice answer for the user's history"""
+        self._pending_advice.append(
+            (user_id, time.time(), category, message[:500], int(target_amount_npr), int(months_needed))
+        )
+        self._ensure_flusher()
+        if self._queued() >= self.max_batch:
+            self._wakeup.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._queued():
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"History flush failed: {e}")
+
+    async def flush(self) -> None:
+        """Write all queued records in one transaction"""
+        months, self._pending_months = self._pending_months, {}
+        advice, self._pending_advice = self._pending_advice, []
+        if not (months or advice):
+            return
+        self._flushing_months, self._flushing_advice = months, advice
+        try:
+            await asyncio.to_thread(self._write, months, advice)
+        finally:
+            self._flushing_months, self._flushing_advice = {}, []
+
+    def _write(self, months: Dict[Tuple[str, str], Dict[str, float]], advice: List[tuple]) -> None:
+        now = time.time()
+        users = {user_id for user_id, _ in months} | {row[0] for row in advice}
+        with self._write_lock:
+            with self._write_conn:
+                self._write_conn.executemany(
+                    "INSERT OR REPLACE INTO monthly_expenses (user_id, month, expenses, updated_at) VALUES (?, ?, ?, ?)",
+                    [(user_id, month, json.dumps(expenses, separators=(",", ":")), now)
+                     for (user_id, month), expenses in months.items()],
+                )
+                self._write_conn.executemany(
+                    "INSERT INTO advice_history (user_id, created_at, category, message, target_amount_npr, months_needed)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    advice,
+                )
+                # Retention: keep each touched user's newest rows only
+                self._write_conn.executemany(
+                    "DELETE FROM monthly_expenses WHERE user_id = ? AND month NOT IN"
+                    " (SELECT month FROM monthly_expenses WHERE user_id = ? ORDER BY month DESC LIMIT ?)",
+                    [(user_id, user_id, self.max_months) for user_id in users],
+                )
+                self._write_conn.executemany(
+                    "DELETE FROM advice_history WHERE user_id = ? AND id NOT IN"
+                    " (SELECT id FROM advice_history WHERE user_id = ? ORDER BY created_at DESC LIMIT ?)",
+                    [(user_id, user_id, self.max_advice) for user_id in users],
+                )
+        self._flushes += 1
+        self._rows_written += len(months) + len(advice)
+
+    async def close(self) -> None:
+        """Flush what is queued and stop the flusher"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    # -- reads --------------------------------------------------------------
+
+    def _unflushed_months(self) -> List[Tuple[Tuple[str, str], Dict[str, float]]]:
+        # Queued records override the batch being written
+        return list(self._flushing_months.items()) + list(self._pending_months.items())
+
+    def _read(self, user_ids: List[str], months: int, advice: int) -> Dict[str, Dict[str, Any]]:
+        result: Dict[str, Dict[str, Any]] = {}
+        with self._read_lock:
+            for user_id in user_ids:
+                month_rows = self._read_conn.execute(
+                    "SELECT month, expenses FROM monthly_expenses WHERE user_id = ? ORDER BY month DESC LIMIT ?",
+                    (user_id, months),
+                ).fetchall()
+                advice_rows = self._read_conn.execute(
+                    "SELECT created_at, category, message, target_amount_npr, months_needed FROM advice_history"
+                    " WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                    (user_id, advice),
+                ).fetchall()
+                result[user_id] = {
+                    "months": [(month, json.loads(expenses)) for month, expenses in month_rows],
+                    "advice": advice_rows,
+                }
+        return result
+
+    async def past_data_many(self, user_ids: Iterable[str], months: int = 3, advice: int = 3) -> Dict[str, Dict[str, Any]]:
+        """
+        past_data per user: {"last_month_expenses": [{"month", "expenses"}, ...],
+        "recent_advice": [{"category", "message", "target_amount_npr",
+        "months_needed", "created_at"}, ...]}, newest first. Users without
+        history get {}.
+        """
+        wanted = sorted(set(user_ids))
+        if not wanted:
+            return {}
+        started = time.perf_counter()
+        stored = await asyncio.to_thread(self._read, wanted, months, advice)
+        self._lookups += 1
+        self._lookup_seconds += time.perf_counter() - started
+
+        result = {}
+        for user_id in wanted:
+            by_month = dict(stored[user_id]["months"])
+            for (pending_user, month), expenses in self._unflushed_months():
+                if pending_user == user_id:
+                    by_month[month] = expenses
+            advice_rows = list(stored[user_id]["advice"]) + [
+                row[1:] for row in self._flushing_advice + self._pending_advice if row[0] == user_id
+            ]
+            advice_rows.sort(key=lambda row: row[0], reverse=True)
+            past: Dict[str, Any] = {}
+            if by_month:
+                past["last_month_expenses"] = [
+                    {"month": month, "expenses": by_month[month]} for month in sorted(by_month, reverse=True)[:months]
+                ]
+            if advice_rows:
+                past["recent_advice"] = [
+                    {"created_at": created_at, "category": category, "message": message,
+                     "target_amount_npr": target, "months_needed": months_needed}
+                    for created_at, category, message, target, months_needed in advice_rows[:advice]
+                ]
+            result[user_id] = past
+        return result
+
+    async def past_data(self, user_id: Optional[str]) -> Dict[str, Any]:
+        """past_data for one user ({} without a user_id or history)"""
+        if not user_id:
+            return {}
+        return (await self.past_data_many([user_id]))[user_id]
+
+    async def month_expenses(self, user_id: str, month: str) -> Optional[Dict[str, float]]:
+        """A user's recorded expenses for one month, or None"""
+        pending = self._pending_months.get((user_id, month)) or self._flushing_months.get((user_id, month))
+        if pending is not None:
+            return pending
+
+        def read() -> Optional[Dict[str, float]]:
+            with self._read_lock:
+                row = self._read_conn.execute(
+                    "SELECT expenses FROM monthly_expenses WHERE user_id = ? AND month = ?", (user_id, month)
+                ).fetchone()
+            return json.loads(row[0]) if row else None
+
+        return await asyncio.to_thread(read)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "queued_writes": self._queued(),
+            "flushes": self._flushes,
+            "rows_written": self._rows_written,
+            "lookups": self._lookups,
+            "avg_lookup_ms": round(self._lookup_seconds / self._lookups * 1000, 3) if self._lookups else 0.0,
+        }
+
+
+def history_from_env() -> Optional[HistoryStore]:
+    """HISTORY_DB_PATH (empty disables), HISTORY_MAX_MONTHS, HISTORY_MAX_ADVICE, HISTORY_FLUSH_SECONDS"""
+    path = os.getenv(
+        "HISTORY_DB_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history.db"),
+    )
+    if not path:
+        return None
+    return HistoryStore(
+        path,
+        max_months=int(os.getenv("HISTORY_MAX_MONTHS", "24")),
+        max_advice=int(os.getenv("HISTORY_MAX_ADVICE", "20")),
+        flush_seconds=float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5")),
+    )
@@ -0,0 +1,196 @@
+"""
+Streaming PDF ingestion into the per-user vector index.
+
+The upload is spooled to a temp file (never held in memory whole), pages are
+parsed in a process pool a few at a time and in order, each page is cut into
+overlapping chunks, and new chunks are embedded in batches. Chunks are
+deduplicated by content hash against everything the user already has, so
+re-uploading an unchanged statement costs parsing only, with no embedding calls.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import resource
+import sys
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_executor: Optional["ProcessPoolExecutor"] = None
+
+
+class InvalidDocumentError(ValueError):
+    """Raised when the upload cannot be read as a PDF"""
+
+
+def get_executor() -> "ProcessPoolExecutor":
+    """Process pool for PDF parsing, created (and its module imported) on first upload"""
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _executor = ProcessPoolExecutor(max_workers=WORKERS)
+    return _executor
+
+
+def _count_pages(path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def _extract_pages(path: str, start: int, end: int) -> Tuple[List[Tuple[int, str]], float]:
+    """
+    Runs in a worker process: (1-based page number, text) for pages
+    [start, end), plus the worker's peak RSS in MB
+    """
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    pages = []
+    for index in range(start, end):
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception as e:
+            print(f"Failed to extract page {index + 1} of {path}: {e}")
+            text = ""
+        pages.append((index + 1, text))
+    return pages, _rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def content_hash(text: str) -> str:
+    """Hash of a chunk's whitespace-normalized text"""
+    normalized = _WHITESPACE_RE.sub(" ", text).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Tuple[int, int, str]]:
+    """
+    Split one page into (char_start, char_end, chunk) windows of about
+    ``chunk_size`` characters overlapping by ``overlap``, preferring to break
+    on whitespace.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            space = text.rfind(" ", start + chunk_size // 2, end)
+            if space != -1:
+                end = space
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append((start, end, piece))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def _rss_mb(max_rss: int) -> float:
+    """ru_maxrss is in KB on Linux and in bytes on macOS"""
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def _page_batches(path: str, page_count: int, executor: "ProcessPoolExecutor"):
+    """Yield parsed page batches in order, keeping a bounded number in flight"""
+    loop = asyncio.get_running_loop()
+    ranges = deque((start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK))
+    in_flight = deque()
+    max_in_flight = 2 * WORKERS
+    while ranges or in_flight:
+        while ranges and len(in_flight) < max_in_flight:
+            start, end = ranges.popleft()
+            in_flight.append(loop.run_in_executor(executor, _extract_pages, path, start, end))
+        yield await in_flight.popleft()
+
+
+async def ingest_pdf(
+    path: str,
+    user_id: str,
+    filename: str,
+    embedder: Any,
+    store: Any,
+    doc_hash: Optional[str] = None,
+    executor: Optional["ProcessPoolExecutor"] = None,
+) -> Dict[str, Any]:
+    """Parse, chunk, dedupe, embed and index one PDF; returns ingestion stats"""
+    started = time.perf_counter()
+    executor = executor or get_executor()
+    index = store.index(user_id)
+    loop = asyncio.get_running_loop()
+    stats = {
+        "doc_id": doc_hash,
+        "filename": filename,
+        "pages": 0,
+        "chunks_total": 0,
+        "chunks_new": 0,
+        "chunks_skipped": 0,
+        "unchanged": False,
+        "peak_worker_rss_mb": 0.0,
+    }
+
+    if doc_hash and index.has_hash("doc:" + doc_hash):
+        stats["unchanged"] = True
+    else:
+        try:
+            page_count = await loop.run_in_executor(executor, _count_pages, path)
+        except Exception as e:
+            raise InvalidDocumentError(f"Could not read PDF: {e}")
+        seen = set()
+        batch: List[Tuple[str, Dict[str, Any]]] = []
+
+        async def flush():
+            if not batch:
+                return
+            contents = [content for content, _ in batch]
+            metadatas = [metadata for _, metadata in batch]
+            vectors = await embedder.embed(contents)
+            await asyncio.to_thread(store.add, user_id, vectors, contents, metadatas, getattr(embedder, "name", None))
+            stats["chunks_new"] += len(batch)
+            batch.clear()
+
+        async for pages, worker_rss in _page_batches(path, page_count, executor):
+            stats["peak_worker_rss_mb"] = max(stats["peak_worker_rss_mb"], worker_rss)
+            for page_number, text in pages:
+                stats["pages"] += 1
+                for char_start, char_end, content in chunk_text(text):
+                    stats["chunks_total"] += 1
+                    digest = content_hash(content)
+                    if digest in seen or index.has_hash(digest):
+                        stats["chunks_skipped"] += 1
+                        continue
+                    seen.add(digest)
+                    batch.append((content, {
+                        "doc_id": doc_hash,
+                        "filename": filename,
+                        "page": page_number,
+                        "char_start": char_start,
+                        "char_end": char_end,
+                        "content_hash": digest,
+                    }))
+                    if len(batch) >= EMBED_BATCH_SIZE:
+                        await flush()
+        await flush()
+        if doc_hash:
+            await asyncio.to_thread(index.add_hashes, ["doc:" + doc_hash])
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["pages_per_sec"] = round(stats["pages"] / elapsed, 1) if elapsed > 0 else 0.0
+    stats["peak_rss_mb"] = _rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return stats
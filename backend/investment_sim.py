@@ -0,0 +1,365 @@
+"""
+Monte Carlo investment simulator for the invest category.
+
+Each of the six asset classes (FD, NEPSE shares, mutual funds, gold, company
+investment, startup) grows by an independent lognormal monthly return whose
+mean matches the asset's expected annual return and whose spread matches its
+annual volatility. A fixed monthly contribution, split by the allocation, is
+added at the start of every month. All paths are computed at once: with
+per-path growth factors ``G_t`` (cumulative product of monthly returns) the
+value after ``t`` months is ``G_t * (V_0 + c * sum(1 / G_k, k < t))``, two
+cumulative sums over an ``(assets, months, paths)`` array instead of a loop.
+
+Rows keep the fields of ``InvestmentSimulation``: each asset's value is its
+median across paths and ``total_value`` is the median portfolio (not the sum
+of asset medians), with the portfolio's percentile bands alongside.
+
+Paths are generated in fixed-size chunks, each from its own child of one
+``SeedSequence``, so a seed gives the same result whether the chunks run in
+this process or, for large runs, spread over a process pool.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+ASSETS = ("fd", "shares", "mutual_funds", "gold", "company_investment", "startup")
+
+# (expected annual return, annual volatility); returns match the rates the
+# invest prompt quotes for December 2025
+DEFAULT_ASSUMPTIONS: Dict[str, Tuple[float, float]] = {
+    "fd": (0.06, 0.0),
+    "shares": (0.12, 0.25),
+    "mutual_funds": (0.09, 0.12),
+    "gold": (0.08, 0.15),
+    "company_investment": (0.10, 0.20),
+    "startup": (0.15, 0.45),
+}
+
+DEFAULT_ALLOCATION: Dict[str, float] = {
+    "fd": 0.30,
+    "shares": 0.20,
+    "mutual_funds": 0.25,
+    "gold": 0.15,
+    "company_investment": 0.05,
+    "startup": 0.05,
+}
+
+PERCENTILES = (5, 25, 50, 75, 95)
+MAX_MONTHS = 60
+CHUNK_PATHS = 2500
+DEFAULT_SEED = 2025
+
+# Words in an invest answer's alternative names that point at an asset class
+_ASSET_WORDS = (
+    ("mutual_funds", re.compile(r"\b(mutual|sip|fund)", re.IGNORECASE)),
+    ("startup", re.compile(r"\bstart-?ups?\b", re.IGNORECASE)),
+    ("company_investment", re.compile(r"\b(company|business|private equity)\b", re.IGNORECASE)),
+    ("shares", re.compile(r"\b(shares?|nepse|stocks?|ipo|equity)\b", re.IGNORECASE)),
+    ("gold", re.compile(r"\b(gold|silver)\b", re.IGNORECASE)),
+    ("fd", re.compile(r"\b(fd|fds|fixed deposit|deposit)\b", re.IGNORECASE)),
+)
+
+
+def normalize_allocation(allocation: Optional[Dict[str, float]]) -> Dict[str, float]:
+    """Allocation over ASSETS summing to 1; missing assets get 0"""
+    if not allocation:
+        return dict(DEFAULT_ALLOCATION)
+    unknown = set(allocation) - set(ASSETS)
+    if unknown:
+        raise ValueError(f"Unknown asset classes {sorted(unknown)}; expected some of {list(ASSETS)}")
+    if any(weight < 0 for weight in allocation.values()):
+        raise ValueError("Allocation weights cannot be negative")
+    total = float(sum(allocation.values()))
+    if total <= 0:
+        raise ValueError("Allocation weights must add up to more than 0")
+    return {asset: float(allocation.get(asset, 0.0)) / total for asset in ASSETS}
+
+
+def merge_assumptions(
+    overrides: Optional[Dict[str, Tuple[float, float]]] = None,
+    base: Optional[Dict[str, Tuple[float, float]]] = None,
+) -> Dict[str, Tuple[float, float]]:
+    """``base`` (DEFAULT_ASSUMPTIONS) with per-asset (annual return, annual volatility) overrides"""
+    assumptions = dict(base or DEFAULT_ASSUMPTIONS)
+    for asset, (annual_return, volatility) in (overrides or {}).items():
+        if asset not in assumptions:
+            raise ValueError(f"Unknown asset class '{asset}'; expected one of {list(ASSETS)}")
+        if annual_return <= -1 or volatility < 0:
+            raise ValueError(f"Invalid assumptions for '{asset}': return must be above -100% and volatility at least 0")
+        assumptions[asset] = (float(annual_return), float(volatility))
+    return assumptions
+
+
+def allocation_from_alternatives(alternatives: Optional[List[Dict[str, Any]]]) -> Optional[Dict[str, float]]:
+    """
+    Allocation implied by an invest answer's alternatives ("FD at NIC Asia",
+    price_npr = monthly amount), or None when no name names an asset class
+    """
+    weights: Dict[str, float] = {}
+    for alternative in alternatives or []:
+        name = str(alternative.get("name", ""))
+        amount = float(alternative.get("price_npr") or 0)
+        if amount <= 0:
+            continue
+        for asset, pattern in _ASSET_WORDS:
+            if pattern.search(name):
+                weights[asset] = weights.get(asset, 0.0) + amount
+                break
+    return normalize_allocation(weights) if weights else None
+
+
+def _simulate_chunk(
+    seed: np.random.SeedSequence,
+    paths: int,
+    months: int,
+    monthly: np.ndarray,
+    initial: np.ndarray,
+    mu: np.ndarray,
+    sigma: np.ndarray,
+) -> np.ndarray:
+    """Asset values, shape (assets, months, paths), for one chunk of paths"""
+    rng = np.random.default_rng(seed)
+    # Paths on the last axis: the cumulative sums run down months with
+    # contiguous rows, and the percentiles later reduce over contiguous paths
+    log_growth = rng.standard_normal((len(ASSETS), months, paths))
+    log_growth *= sigma[:, None, None]
+    log_growth += mu[:, None, None]
+    np.cumsum(log_growth, axis=1, out=log_growth)
+    # 1 / G_k for k = 0 .. months-1, with G_0 = 1
+    discount = np.empty_like(log_growth)
+    discount[:, 0, :] = 1.0
+    np.exp(-log_growth[:, :-1, :], out=discount[:, 1:, :])
+    np.cumsum(discount, axis=1, out=discount)
+    discount *= monthly[:, None, None]
+    discount += initial[:, None, None]
+    np.exp(log_growth, out=log_growth)
+    log_growth *= discount
+    return log_growth.astype(np.float32)
+
+
+def _chunk_plan(paths: int, seed: Optional[int]) -> List[Tuple[np.random.SeedSequence, int]]:
+    count = -(-paths // CHUNK_PATHS)
+    seeds = np.random.SeedSequence(DEFAULT_SEED if seed is None else seed).spawn(count)
+    return [(child, min(CHUNK_PATHS, paths - index * CHUNK_PATHS)) for index, child in enumerate(seeds)]
+
+
+def _chunk_args(
+    monthly_investment: float,
+    initial_investment: float,
+    allocation: Dict[str, float],
+    assumptions: Dict[str, Tuple[float, float]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    weights = np.array([allocation[asset] for asset in ASSETS], dtype=np.float64)
+    annual = np.array([assumptions[asset] for asset in ASSETS], dtype=np.float64)
+    sigma = annual[:, 1] / np.sqrt(12.0)
+    # Lognormal drift whose mean monthly growth compounds to the annual return
+    mu = np.log1p(annual[:, 0]) / 12.0 - 0.5 * sigma ** 2
+    return monthly_investment * weights, initial_investment * weights, mu, sigma
+
+
+def summarize(
+    values: np.ndarray,
+    months: int,
+    monthly_investment: float,
+    initial_investment: float,
+    allocation: Dict[str, float],
+) -> Dict[str, Any]:
+    """Per-month InvestmentSimulation rows and horizon statistics from (assets, months, paths) values"""
+    # Middle order statistic rather than np.median: one partition instead of
+    # two, and with thousands of paths the two neighbours are indistinguishable
+    middle = values.shape[2] // 2
+    asset_medians = np.partition(values, middle, axis=2)[:, :, middle]
+    totals = values.sum(axis=0, dtype=np.float64)
+    bands = np.percentile(totals, PERCENTILES, axis=1)
+    contributed = initial_investment + monthly_investment * np.arange(1, months + 1)
+    rows = []
+    for month in range(months):
+        row: Dict[str, Any] = {"month": month + 1}
+        row["total_value"] = round(float(bands[PERCENTILES.index(50), month]), 2)
+        for index, asset in enumerate(ASSETS):
+            value = round(float(asset_medians[index, month]), 2)
+            # Optional assets are left out of the row when nothing goes into them
+            if asset in ("company_investment", "startup") and allocation[asset] == 0:
+                value = None
+            row[f"{asset}_value"] = value
+        row["contributed"] = round(float(contributed[month]), 2)
+        row["total_value_percentiles"] = {
+            f"p{pct}": round(float(bands[i, month]), 2) for i, pct in enumerate(PERCENTILES)
+        }
+        rows.append(row)
+    final = totals[-1]
+    return {
+        "simulation": rows,
+        "expected_final_value": round(float(final.mean()), 2),
+        "probability_of_loss": round(float((final < contributed[-1]).mean()), 4),
+    }
+
+
+def simulate(
+    monthly_investment: float,
+    months: int = 12,
+    paths: int = 2000,
+    initial_investment: float = 0.0,
+    allocation: Optional[Dict[str, float]] = None,
+    assumptions: Optional[Dict[str, Tuple[float, float]]] = None,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Run the whole simulation in this process (see InvestmentSimulator.run for large runs)"""
+    if not 1 <= months <= MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {MAX_MONTHS}")
+    allocation = normalize_allocation(allocation)
+    assumptions = assumptions or DEFAULT_ASSUMPTIONS
+    args = _chunk_args(monthly_investment, initial_investment, allocation, assumptions)
+    values = np.concatenate(
+        [_simulate_chunk(child, size, months, *args) for child, size in _chunk_plan(paths, seed)], axis=2
+    )
+    return summarize(values, months, monthly_investment, initial_investment, allocation)
+
+
+class InvestmentSimulator:
+    """Runs simulations off the event loop, over a process pool once a run is large enough"""
+
+    def __init__(
+        self,
+        assumptions: Optional[Dict[str, Tuple[float, float]]] = None,
+        default_paths: int = 5000,
+        max_paths: int = 50000,
+        advice_paths: int = 2000,
+        workers: int = 1,
+        parallel_min_paths: int = 20000,
+    ):
+        self.assumptions = merge_assumptions(assumptions)
+        self.default_paths = default_paths
+        self.max_paths = max_paths
+        self.advice_paths = advice_paths
+        self.workers = workers
+        self.parallel_min_paths = parallel_min_paths
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._counts = {"serial": 0, "parallel": 0}
+        self._paths = 0
+        self._seconds = 0.0
+
+    def _get_executor(self) -> "ProcessPoolExecutor":
+        # Created (and its module imported) on the first large run
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _record(self, mode: str, paths: int, started: float) -> None:
+        self._counts[mode] += 1
+        self._paths += paths
+        self._seconds += time.perf_counter() - started
+
+    def for_advice(self, monthly_investment: float, alternatives: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """12-month rows for an invest answer, allocated like its alternatives; runs inline"""
+        started = time.perf_counter()
+        result = simulate(
+            monthly_investment,
+            months=12,
+            paths=self.advice_paths,
+            allocation=allocation_from_alternatives(alternatives),
+            assumptions=self.assumptions,
+        )
+        self._record("serial", self.advice_paths, started)
+        return result["simulation"]
+
+    async def run(
+        self,
+        monthly_investment: float,
+        months: int = 12,
+        paths: Optional[int] = None,
+        initial_investment: float = 0.0,
+        allocation: Optional[Dict[str, float]] = None,
+        assumptions: Optional[Dict[str, Tuple[float, float]]] = None,
+        seed: Optional[int] = None,
+        parallel: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """
+        Simulate with this simulator's assumptions (overridden per asset by
+        ``assumptions``). ``parallel`` None picks the process pool for runs of
+        at least ``parallel_min_paths`` when more than one worker is configured.
+        """
+        paths = paths or self.default_paths
+        if paths > self.max_paths:
+            raise ValueError(f"paths must be at most {self.max_paths}")
+        if not 1 <= months <= MAX_MONTHS:
+            raise ValueError(f"months must be between 1 and {MAX_MONTHS}")
+        allocation = normalize_allocation(allocation)
+        assumptions = merge_assumptions(assumptions, self.assumptions)
+        if parallel is None:
+            parallel = self.workers > 1 and paths >= self.parallel_min_paths
+        started = time.perf_counter()
+        if not parallel:
+            result = await asyncio.to_thread(
+                simulate, monthly_investment, months, paths, initial_investment, allocation, assumptions, seed
+            )
+            self._record("serial", paths, started)
+        else:
+            args = _chunk_args(monthly_investment, initial_investment, allocation, assumptions)
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            chunks = await asyncio.gather(*[
+                loop.run_in_executor(executor, _simulate_chunk, child, size, months, *args)
+                for child, size in _chunk_plan(paths, seed)
+            ])
+            result = await asyncio.to_thread(
+                summarize, np.concatenate(chunks, axis=2), months, monthly_investment, initial_investment, allocation
+            )
+            self._record("parallel", paths, started)
+        return {
+            **result,
+            "months": months,
+            "paths": paths,
+            "parallel": parallel,
+            "allocation": {asset: round(weight, 4) for asset, weight in allocation.items()},
+            "assumptions": {
+                asset: {"annual_return": annual_return, "annual_volatility": volatility}
+                for asset, (annual_return, volatility) in assumptions.items()
+            },
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        runs = self._counts["serial"] + self._counts["parallel"]
+        return {
+            "runs": dict(self._counts),
+            "paths": self._paths,
+            "avg_ms": round(self._seconds / runs * 1000, 2) if runs else 0.0,
+            "workers": self.workers,
+            "parallel_min_paths": self.parallel_min_paths,
+        }
+
+
+def simulator_from_env() -> InvestmentSimulator:
+    """
+    INVEST_SIM_ASSUMPTIONS (JSON of {"asset": [annual return, annual
+    volatility]}, merged over DEFAULT_ASSUMPTIONS), INVEST_SIM_PATHS,
+    INVEST_SIM_MAX_PATHS, INVEST_SIM_ADVICE_PATHS, INVEST_SIM_WORKERS,
+    INVEST_SIM_PARALLEL_MIN_PATHS
+    """
+    assumptions = {
+        asset: tuple(values) for asset, values in json.loads(os.getenv("INVEST_SIM_ASSUMPTIONS", "") or "{}").items()
+    }
+    return InvestmentSimulator(
+        assumptions,
+        default_paths=int(os.getenv("INVEST_SIM_PATHS", "5000")),
+        max_paths=int(os.getenv("INVEST_SIM_MAX_PATHS", "50000")),
+        advice_paths=int(os.getenv("INVEST_SIM_ADVICE_PATHS", "2000")),
+        workers=int(os.getenv("INVEST_SIM_WORKERS", str(min(4, os.cpu_count() or 1)))),
+        parallel_min_paths=int(os.getenv("INVEST_SIM_PARALLEL_MIN_PATHS", "20000")),
+    )
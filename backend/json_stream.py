@@ -0,0 +1,218 @@
+"""
+Incremental parser for the JSON object Gemini returns.
+
+Text is fed in as it streams from the model. The parser skips any preamble
+(markdown fences, chatter) up to the first ``{`` and emits events while the
+top-level object is still being generated:
+
+- ``("delta", {"field", "text"})``  new characters of a top-level string value
+- ``("item", {"field", "index", "value"})``  a completed element of a top-level array
+- ``("field", {"field", "value"})``  a completed top-level value of any type
+
+Once the closing brace arrives ``done`` is set and ``result()`` returns the
+whole object. Everything after the closing brace is ignored.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+Event = Tuple[str, Dict[str, Any]]
+
+_WHITESPACE = " \t\r\n"
+_HIGH_SURROGATE_PREFIXES = {"d8", "d9", "da", "db"}
+
+
+class IncrementalJSONParser:
+    """Character-level scanner over a single streamed JSON object"""
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+        self._streamed_upto = 0
+
+    @property
+    def started(self) -> bool:
+        return self._start is not None
+
+    @property
+    def done(self) -> bool:
+        return self._end is not None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._text
+
+    def result(self) -> Dict[str, Any]:
+        """The complete object; raises ValueError if it has not closed yet"""
+        if self._end is None:
+            raise ValueError("JSON object is incomplete")
+        return json.loads(self._text[self._start:self._end])
+
+    def feed(self, chunk: str) -> List[Event]:
+        """Consume the next piece of text and return the events it completes"""
+        if self.done or not chunk:
+            return []
+        self._text += chunk
+        events: List[Event] = []
+        text = self._text
+        i = self._pos
+        while i < len(text) and not self.done:
+            ch = text[i]
+            if self._start is None:
+                if ch == "{":
+                    self._start = i
+                    self._stack.append("{")
+                    self._expect_key = True
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                i += 1
+                continue
+
+            depth = len(self._stack)
+            if ch == '"':
+                self._open_string(i, depth)
+            elif ch in "{[":
+                self._mark_value_start(i, depth)
+                self._stack.append(ch)
+            elif ch in "}]":
+                if depth == 1 and self._value_start is not None:
+                    self._emit_field(self._value_start, i, events)
+                if depth == 2 and self._in_top_array() and self._item_start is not None:
+                    self._emit_item(self._item_start, i, events)
+                self._stack.pop()
+                depth -= 1
+                if depth == 0:
+                    self._end = i + 1
+                elif depth == 1 and self._value_start is not None:
+                    self._emit_field(self._value_start, i + 1, events)
+                elif depth == 2 and self._in_top_array() and self._item_start is not None:
+                    self._emit_item(self._item_start, i + 1, events)
+            elif ch == ",":
+                if depth == 1:
+                    if self._value_start is not None:
+                        self._emit_field(self._value_start, i, events)
+                    self._expect_key = True
+                elif depth == 2 and self._in_top_array() and self._item_start is not None:
+                    self._emit_item(self._item_start, i, events)
+            elif ch == ":":
+                if depth == 1:
+                    self._expect_key = False
+            elif ch not in _WHITESPACE:
+                # Start of a number / true / false / null
+                self._mark_value_start(i, depth)
+            i += 1
+        self._pos = i
+
+        if self._in_string and self._is_streamed_string():
+            self._stream_delta(events)
+        return events
+
+    def _in_top_array(self) -> bool:
+        return len(self._stack) >= 2 and self._stack[1] == "["
+
+    def _is_streamed_string(self) -> bool:
+        return len(self._stack) == 1 and not self._string_is_key
+
+    def _mark_value_start(self, i: int, depth: int) -> None:
+        if depth == 1 and not self._expect_key and self._value_start is None:
+            self._value_start = i
+            self._item_index = 0
+        elif depth == 2 and self._in_top_array() and self._item_start is None:
+            self._item_start = i
+
+    def _open_string(self, i: int, depth: int) -> None:
+        self._in_string = True
+        self._string_start = i
+        self._string_is_key = depth == 1 and self._expect_key
+        if not self._string_is_key:
+            self._mark_value_start(i, depth)
+            self._streamed_upto = i + 1
+
+    def _close_string(self, i: int, events: List[Event]) -> None:
+        if self._string_is_key:
+            self._key = json.loads(self._text[self._string_start:i + 1])
+            return
+        depth = len(self._stack)
+        if depth == 1:
+            self._stream_delta(events, end=i)
+            self._emit_field(self._value_start, i + 1, events)
+        elif depth == 2 and self._in_top_array():
+            self._emit_item(self._item_start, i + 1, events)
+
+    def _stream_delta(self, events: List[Event], end: Optional[int] = None) -> None:
+        raw = self._text[self._streamed_upto:self._pos if end is None else end]
+        if end is None:
+            # Never split an escape sequence across two deltas
+            raw = raw[:_safe_prefix_length(raw)]
+        if not raw:
+            return
+        self._streamed_upto += len(raw)
+        events.append(("delta", {"field": self._key, "text": json.loads('"' + raw + '"')}))
+
+    def _emit_field(self, start: int, end: int, events: List[Event]) -> None:
+        value = json.loads(self._text[start:end])
+        events.append(("field", {"field": self._key, "value": value}))
+        self._value_start = None
+
+    def _emit_item(self, start: int, end: int, events: List[Event]) -> None:
+        value = json.loads(self._text[start:end])
+        events.append(("item", {"field": self._key, "index": self._item_index, "value": value}))
+        self._item_index += 1
+        self._item_start = None
+
+
+def _safe_prefix_length(raw: str) -> int:
+    """Length of the part of a raw JSON string body that ends outside an escape"""
+    idx = raw.rfind("\\")
+    if idx == -1:
+        return len(raw)
+    run = 0
+    j = idx
+    while j >= 0 and raw[j] == "\\":
+        run += 1
+        j -= 1
+    if run % 2 == 0:
+        # The last backslash is itself escaped
+        return len(raw)
+    tail = raw[idx + 1:]
+    if not tail or (tail[0] == "u" and len(tail) < 5):
+        # What precedes a cut escape may be the high half of a surrogate pair
+        return _safe_prefix_length(raw[:idx])
+    if tail[0] == "u" and len(tail) == 5 and tail[1:3].lower() in _HIGH_SURROGATE_PREFIXES:
+        # Wait for the low half of a surrogate pair
+        return idx
+    return len(raw)
+
+
+def extract_json_object(content: str) -> Dict[str, Any]:
+    """
+    Parse the first JSON object in an LLM reply, ignoring markdown fences
+    and any text around it. Raises json.JSONDecodeError when there is none.
+    """
+    parser = IncrementalJSONParser()
+    parser.feed(content)
+    if not parser.done:
+        # Fall back to json.loads for its error message and position
+        return json.loads(content[content.find("{"):] if "{" in content else content)
+    return parser.result()
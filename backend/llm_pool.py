@@ -0,0 +1,380 @@
+"""
+Bounded, non-blocking access to the Gemini API.
+
+All upstream calls go through the genai async client (``client.aio``) so the
+uvicorn event loop keeps serving other requests while Gemini is generating.
+A semaphore caps how many calls are in flight at once, callers beyond the cap
+wait in a bounded FIFO queue, and every call has its own timeout.
+
+google-genai 1.0.0 implements ``client.aio`` by running the blocking HTTP
+call in the event loop's default thread pool, whose size (min(32, CPUs + 4))
+would silently cap concurrent calls below ``max_concurrency`` on small
+machines, so the app installs a larger one at startup (``install_executor``). Identical
+non-streaming calls that overlap in time share one upstream request
+(see ``single_flight``).
+
+Non-streaming calls are also guarded (see ``resilience``): each attempt gets
+a timeout adapted to the observed p99 latency of its model, a slow attempt
+is hedged with a second one once it passes the observed p95 (only while the
+pool has a free slot), transient failures are retried with jittered backoff
+within the overall timeout, and a circuit breaker makes calls fail fast with
+``LLMUnavailableError`` while Gemini keeps failing. Streams share the breaker.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from resilience import CircuitBreaker, LatencyTracker, backoff_delay, hedged, is_retryable
+from single_flight import SingleFlight, prompt_fingerprint
+
+
+class LLMPoolError(Exception):
+    """Base class for errors raised by the LLM pool"""
+
+
+class LLMQueueFullError(LLMPoolError):
+    """Raised when the wait queue is full or a caller waited too long for a slot"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMTimeoutError(LLMPoolError):
+    """Raised when a single upstream call exceeds its timeout"""
+
+
+class LLMUnavailableError(LLMPoolError):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    return isinstance(exc, LLMTimeoutError) or is_retryable(exc)
+
+
+class LLMPool:
+    """Caps concurrent upstream calls and queues the rest"""
+
+    def __init__(
+        self,
+        client: Any,
+        max_concurrency: int = 16,
+        max_queue: int = 256,
+        timeout_seconds: float = 30.0,
+        queue_timeout_seconds: float = 10.0,
+        coalesce: bool = True,
+        max_retries: int = 2,
+        retry_base_seconds: float = 0.5,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_max_ratio: float = 0.1,
+        timeout_multiplier: float = 2.0,
+        min_timeout_seconds: float = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout_seconds = timeout_seconds
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.coalesce = coalesce
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_max_ratio = hedge_max_ratio
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout_seconds = min_timeout_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._single_flight = SingleFlight()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._total_wait_seconds = 0.0
+        self._calls = 0
+        self._retries = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def install_executor(self) -> None:
+        """Give the running loop's default executor a thread per slot, plus headroom for asyncio.to_thread users"""
+        loop = asyncio.get_running_loop()
+        # asyncio keeps no public handle on the current default executor; the
+        # replaced one is shut down so its idle threads exit once work drains
+        previous = getattr(loop, "_default_executor", None)
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_concurrency + 8, thread_name_prefix="llm-pool")
+        )
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    async def _acquire(self) -> None:
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise LLMQueueFullError(
+                f"LLM queue is full ({self._waiting} waiting, {self._in_flight} in flight)"
+            )
+        self._waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            raise LLMQueueFullError(
+                f"Timed out after {self.queue_timeout_seconds}s waiting for a free LLM slot",
+                retry_after=max(1, int(self.queue_timeout_seconds)),
+            )
+        finally:
+            self._waiting -= 1
+            self._total_wait_seconds += time.perf_counter() - started
+
+    async def run(self, factory, timeout_seconds: Optional[float] = None):
+        """
+        Run ``factory()`` (a zero-argument callable returning an awaitable)
+        inside a pool slot with a timeout.
+        """
+        await self._acquire()
+        self._in_flight += 1
+        timeout = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        try:
+            return await asyncio.wait_for(factory(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise LLMTimeoutError(f"Gemini did not respond within {timeout:.1f}s")
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            self._semaphore.release()
+
+    def _check_breaker(self) -> None:
+        if not self.breaker.allow():
+            retry_after = self.breaker.retry_after()
+            raise LLMUnavailableError(
+                f"Gemini is failing, not calling it for another {retry_after:.0f}s",
+                retry_after=max(1, int(retry_after + 0.999)),
+            )
+
+    def _tracker(self, model: str) -> LatencyTracker:
+        tracker = self._latency.get(model)
+        if tracker is None:
+            tracker = self._latency[model] = LatencyTracker()
+        return tracker
+
+    def attempt_timeout(self, model: str) -> float:
+        """Per-attempt timeout: a multiple of the model's observed p99, within [min, configured]"""
+        p99 = self._tracker(model).quantile(0.99)
+        if p99 is None:
+            return self.timeout_seconds
+        return min(self.timeout_seconds, max(self.min_timeout_seconds, p99 * self.timeout_multiplier))
+
+    def _may_hedge(self) -> bool:
+        # Only spare capacity, and at most hedge_max_ratio extra calls; under
+        # load a hedge would just add queueing
+        return (
+            not self._semaphore.locked()
+            and self._waiting == 0
+            and self._hedges < self.hedge_max_ratio * self._calls
+        )
+
+    async def _resilient_call(self, model: str, upstream, timeout_seconds: Optional[float]):
+        """
+        Run ``upstream()`` through the breaker, adaptive timeouts, hedging and
+        retries. ``timeout_seconds`` (default: the pool timeout) bounds the
+        whole call including retries.
+        """
+        self._check_breaker()
+        self._calls += 1
+        tracker = self._tracker(model)
+        loop = asyncio.get_running_loop()
+        budget = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        deadline = loop.time() + budget
+
+        async def timed():
+            started = time.perf_counter()
+            response = await upstream()
+            tracker.observe(time.perf_counter() - started)
+            return response
+
+        attempt = 0
+        while True:
+            timeout = self.attempt_timeout(model)
+            hedge_delay = tracker.quantile(self.hedge_quantile) if self.hedge else None
+
+            def should_hedge():
+                if self._may_hedge():
+                    self._hedges += 1
+                    return True
+                return False
+
+            try:
+                response, winner = await hedged(
+                    # A hedge gets what is left of the budget, not a fresh timeout
+                    lambda: self.run(timed, timeout_seconds=max(0.0, min(timeout, deadline - loop.time()))),
+                    hedge_delay,
+                    should_hedge,
+                )
+            except Exception as e:
+                if not _is_upstream_failure(e):
+                    if not isinstance(e, LLMPoolError):
+                        # Gemini answered (e.g. 400 for a bad request), so it is up
+                        self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                delay = backoff_delay(attempt, self.retry_base_seconds)
+                if (
+                    attempt >= self.max_retries
+                    or loop.time() + delay >= deadline - self.min_timeout_seconds / 2
+                    or not self.breaker.allow()
+                ):
+                    raise
+                attempt += 1
+                self._retries += 1
+                print(f"Retrying Gemini call ({attempt}/{self.max_retries}) after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                continue
+            self._hedge_wins += winner
+            self.breaker.record_success()
+            return response
+
+    async def generate_content(
+        self,
+        *,
+        model: str,
+        contents: Any,
+        config: Any = None,
+        timeout_seconds: Optional[float] = None,
+    ):
+        """
+        Async drop-in for ``client.models.generate_content`` with adaptive
+        timeouts, hedging, retries and a circuit breaker. Concurrent calls
+        with the same model, contents and config share one upstream call.
+        """
+        def call():
+            return self._resilient_call(
+                model,
+                lambda: self.client.aio.models.generate_content(
+                    model=model, contents=contents, config=config
+                ),
+                timeout_seconds,
+            )
+
+        if not self.coalesce:
+            return await call()
+        return await self._single_flight.do(prompt_fingerprint(model, contents, config), call)
+
+    async def generate_content_stream(
+        self,
+        *,
+        model: str,
+        contents: Any,
+        config: Any = None,
+        timeout_seconds: Optional[float] = None,
+    ):
+        """
+        Async iterator over streamed response chunks. The pool slot is held
+        until the stream ends, and the timeout covers the whole stream.
+        Streams are not retried or hedged, but their outcome feeds the
+        circuit breaker and they fail fast while it is open.
+        """
+        self._check_breaker()
+        await self._acquire()
+        self._in_flight += 1
+        timeout = self.timeout_seconds if timeout_seconds is None else timeout_seconds
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            try:
+                stream = await asyncio.wait_for(
+                    self.client.aio.models.generate_content_stream(
+                        model=model, contents=contents, config=config
+                    ),
+                    timeout=timeout,
+                )
+                iterator = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(
+                            iterator.__anext__(), timeout=max(0.0, deadline - loop.time())
+                        )
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                self.breaker.record_failure()
+                raise LLMTimeoutError(f"Gemini stream did not finish within {timeout}s")
+            except Exception as e:
+                if is_retryable(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool counters"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+            "rejected": self._rejected,
+            "total_wait_seconds": round(self._total_wait_seconds, 3),
+            "coalescing": self._single_flight.stats() if self.coalesce else None,
+            "resilience": {
+                "calls": self._calls,
+                "retries": self._retries,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "breaker": self.breaker.stats(),
+                "latency": {model: tracker.stats() for model, tracker in self._latency.items()},
+                "attempt_timeout_seconds": {
+                    model: round(self.attempt_timeout(model), 2) for model in self._latency
+                },
+            },
+        }
+
+
+def _env_flag(name: str, default: str = "true") -> bool:
+    return os.getenv(name, default).strip().lower() not in ("0", "false", "no")
+
+
+def pool_from_env(client: Any) -> LLMPool:
+    """Build an LLMPool configured from LLM_* environment variables"""
+    return LLMPool(
+        client,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+        max_queue=int(os.getenv("LLM_MAX_QUEUE", "256")),
+        timeout_seconds=float(os.getenv("LLM_TIMEOUT_SECONDS", "30")),
+        queue_timeout_seconds=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10")),
+        coalesce=_env_flag("LLM_COALESCE"),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        retry_base_seconds=float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5")),
+        hedge=_env_flag("LLM_HEDGE"),
+        hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+        hedge_max_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1")),
+        timeout_multiplier=float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2.0")),
+        min_timeout_seconds=float(os.getenv("LLM_MIN_TIMEOUT_SECONDS", "10")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_seconds=float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30")),
+        ),
+    )
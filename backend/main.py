@@ -1,23 +1,66 @@
-from fastapi import FastAPI, HTTPException, Request, status, Depends, Query, Header
+from fastapi import FastAPI, HTTPException, Request, status, Depends, Query, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, Dict, List, Literal, Any
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import Optional, Dict, List, Literal, Any, Tuple, get_args
 import os
-from google import genai
+import sys
+import copy
+import asyncio
+import hashlib
+import tempfile
+import time
 import json
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
 from collections import defaultdict
+from contextlib import contextmanager
+
+# Sibling modules are imported by bare name so the app works both as
+# `backend.main` (root main.py) and as `main` (uvicorn --app-dir backend)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_pool import pool_from_env, LLMQueueFullError, LLMTimeoutError, LLMUnavailableError
+from resilience import is_retryable
+from advice_cache import cache_from_env, advice_fingerprint, feedback_fingerprint
+from json_stream import IncrementalJSONParser
+from structured_output import structured_from_env, gemini_schema
+from finance import CATEGORY_RULES, compute_advice_numbers, realistic_monthly_savings
+from expense_analytics import analyze_expenses, analyze_expenses_many
+from history_store import history_from_env, previous_month
+from embeddings import embedder_from_env
+from vector_index import store_from_env, IndexMismatchError
+from ingest import ingest_pdf, InvalidDocumentError
+from metrics import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from admission import AdmissionMiddleware, AdmissionRejected, admission_from_env, request_priority, PRIORITY_HIGH
+from genai_client import client_from_env
+from semantic_cache import semantic_cache_from_env
+from model_routing import router_from_env
+from advice_jobs import jobs_from_env, JobFailed, JobQueueFull, IdempotencyConflict, on_code_filesystem
+from chat_sessions import ChatSession, sessions_from_env
+from investment_sim import MAX_MONTHS, simulator_from_env
+from compact_output import compact_schema, expand_advice, expand_event
+from prompt_cache import prompt_cache_from_env
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = FastAPI(title="Paisa Ko Sahayogi API", version="1.0.0")
 
+# Admission control for the endpoints that call Gemini: per-user and global
+# token buckets, a priority wait queue (simple before indepth) and fast
+# 429/503 with Retry-After when over the limits (ADMISSION_*). Added before
+# CORS so rejections still carry CORS headers.
+admission = admission_from_env()
+if admission is not None:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission,
+        paths=["/api/v1/advice", "/api/v1/advice/stream", "/api/v1/advice/batch", "/api/v1/advice/jobs", "/api/v1/feedback", "/api/v1/feedback/batch"],
+    )
+
 # CORS configuration - allows all origins by default for easy deployment
 # To restrict in production, set ALLOWED_ORIGINS environment variable (comma-separated)
 cors_origins_env = os.getenv("ALLOWED_ORIGINS", "*")
@@ -83,8 +126,199 @@ if not gemini_api_key:
         "Please set it before running the application."
     )
 
-# Initialize Gemini client (will use GEMINI_API_KEY from environment)
-client = genai.Client(api_key=gemini_api_key)
+# Gemini client (GEMINI_API_KEY). Imported and constructed on first use so
+# the app starts faster; GEMINI_PREWARM builds it in the background at
+# startup. GEMINI_BASE_URL points it at another endpoint, e.g.
+# benchmarks/fake_gemini.py
+client = client_from_env(gemini_api_key)
+GEMINI_PREWARM = os.getenv("GEMINI_PREWARM", "true").strip().lower() not in ("0", "false", "no")
+
+# All Gemini calls go through the async client with a cap on concurrent calls
+# (LLM_MAX_CONCURRENCY), a bounded wait queue (LLM_MAX_QUEUE) and a per-call
+# timeout (LLM_TIMEOUT_SECONDS), so one worker can keep many requests in flight.
+# Calls are hedged and retried, and a circuit breaker fails fast while Gemini
+# is down (LLM_HEDGE*, LLM_MAX_RETRIES, LLM_BREAKER_*)
+llm_pool = pool_from_env(client)
+
+# The per-category system instructions (ADVICE_INSTRUCTIONS) registered with
+# Gemini's context cache and kept alive, or sent inline while no cache is
+# live (PROMPT_CACHE_*)
+prompt_cache = prompt_cache_from_env(client)
+
+# Model, max_output_tokens and prompt token budget per category/mode, plus
+# per-route latency and cost (LLM_ROUTES, LLM_MAX_PROMPT_TOKENS, LLM_MODEL_PRICES)
+router = router_from_env()
+
+# Cache of parsed LLM answers keyed on a normalized request fingerprint
+# (ADVICE_CACHE_MAX_ENTRIES, ADVICE_CACHE_TTL_*, ADVICE_CACHE_DB_PATH)
+response_cache = cache_from_env()
+
+# Per-user monthly expenses (recorded by /api/v1/feedback) and past advice
+# behind the "Past Month Data" prompt section (HISTORY_DB_PATH, HISTORY_MAX_*,
+# HISTORY_FLUSH_SECONDS); None when HISTORY_DB_PATH is empty
+history = history_from_env()
+
+# Schema-constrained JSON generation plus the shared parse/repair path
+# (LLM_REPAIR_MODEL, LLM_REPAIR_ENABLED, LLM_REPAIR_MAX_OUTPUT_TOKENS)
+structured = structured_from_env(llm_pool)
+
+# Monte Carlo projections for invest answers and /api/v1/invest/simulate
+# (INVEST_SIM_ASSUMPTIONS, INVEST_SIM_PATHS, INVEST_SIM_WORKERS, ...)
+investment_simulator = simulator_from_env()
+
+# Prometheus metrics served on GET /metrics. Stage latencies are labelled by
+# category and mode so a p99 regression can be pinned on Gemini ("llm",
+# "first_token") or on our own code (prompt_build, json_extraction, ...).
+# Feedback requests use category="feedback", mode="none".
+STAGE_SECONDS = registry.histogram(
+    "paisa_stage_seconds", "Time spent in each request stage",
+    ["endpoint", "stage", "category", "mode"],
+)
+REQUEST_SECONDS = registry.histogram(
+    "paisa_request_seconds", "End-to-end handler time",
+    ["endpoint", "category", "mode", "status"],
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "paisa_requests_in_flight", "Requests currently being handled", ["endpoint"],
+)
+LLM_TOKENS = registry.counter(
+    "paisa_llm_tokens_total", "Gemini tokens for answers served (input, output, cached input)",
+    ["endpoint", "category", "mode", "direction"],
+)
+CACHE_LOOKUPS = registry.counter(
+    "paisa_response_cache_lookups_total", "Response cache lookups by result",
+    ["endpoint", "category", "result"],
+)
+LLM_ROUTE_SECONDS = registry.histogram(
+    "paisa_llm_route_seconds", "Gemini call latency per routing table entry",
+    ["route", "model"],
+)
+DEGRADED_RESPONSES = registry.counter(
+    "paisa_degraded_responses_total", "Expired cached answers served because Gemini was unavailable",
+    ["endpoint", "category"],
+)
+registry.callback("paisa_llm_pool_in_flight", "Gemini calls in flight", lambda: llm_pool.stats()["in_flight"])
+registry.callback("paisa_llm_pool_waiting", "Requests waiting for a Gemini slot", lambda: llm_pool.stats()["waiting"])
+registry.callback(
+    "paisa_llm_pool_calls_total", "Gemini calls by outcome",
+    lambda: {(outcome,): llm_pool.stats()[outcome] for outcome in ("completed", "timeouts", "rejected")},
+    ["outcome"], kind="counter",
+)
+registry.callback(
+    "paisa_llm_coalesced_calls_total", "Calls that joined an identical in-flight Gemini call",
+    lambda: (llm_pool.stats()["coalescing"] or {}).get("coalesced_calls", 0), kind="counter",
+)
+registry.callback(
+    "paisa_llm_resilience_events_total", "Gemini call retries, hedged attempts and hedges that won",
+    lambda: {(event,): llm_pool.stats()["resilience"][event] for event in ("retries", "hedges", "hedge_wins")},
+    ["event"], kind="counter",
+)
+registry.callback(
+    "paisa_llm_breaker_open", "1 while the Gemini circuit breaker is open or half-open",
+    lambda: int(llm_pool.breaker.state != "closed"),
+)
+registry.callback(
+    "paisa_llm_attempt_timeout_seconds", "Current adaptive per-attempt Gemini timeout",
+    lambda: {(model,): seconds for model, seconds in llm_pool.stats()["resilience"]["attempt_timeout_seconds"].items()},
+    ["model"],
+)
+registry.callback(
+    "paisa_llm_route_calls_total", "Gemini calls per route by outcome (truncated = stopped at max_output_tokens)",
+    lambda: {
+        (name, usage["model"], outcome): usage[key]
+        for name, usage in router.stats()["usage"].items()
+        for outcome, key in (("all", "calls"), ("failed", "failures"), ("truncated", "truncated"))
+    },
+    ["route", "model", "outcome"], kind="counter",
+)
+registry.callback(
+    "paisa_llm_route_cost_usd_total", "Estimated Gemini cost per route (coalesced requests each count the shared call)",
+    lambda: {(name, usage["model"]): usage["cost_usd"] for name, usage in router.stats()["usage"].items()},
+    ["route", "model"], kind="counter",
+)
+registry.callback(
+    "paisa_llm_cached_input_ratio", "Share of Gemini input tokens read from the context cache (explicit or implicit), per route",
+    lambda: {(name, usage["model"]): usage["cached_input_ratio"] for name, usage in router.stats()["usage"].items()},
+    ["route", "model"],
+)
+registry.callback(
+    "paisa_prompt_cache_events_total", "System instruction calls by cache use, and context caches created, extended, expired, failed and discarded",
+    lambda: {
+        (event,): prompt_cache.stats()[event]
+        for event in ("cached_calls", "inline_calls", "created", "extended", "expired", "failed", "discarded")
+    },
+    ["event"], kind="counter",
+)
+registry.callback(
+    "paisa_admission_total", "Requests by admission outcome (enqueued ones also end up admitted, shed or timed out)",
+    lambda: {
+        (result,): admission.stats()[result]
+        for result in ("admitted", "enqueued", "rejected_user", "rejected_overload", "shed", "timed_out")
+    } if admission is not None else {},
+    ["result"], kind="counter",
+)
+registry.callback("paisa_admission_queue_depth", "Requests waiting for admission", lambda: admission.stats()["queued"] if admission is not None else 0)
+registry.callback(
+    "paisa_admission_wait_seconds_total", "Time admitted requests spent in the admission queue, by priority",
+    lambda: {(priority,): seconds for priority, seconds in admission.stats()["wait_seconds_total"].items()} if admission is not None else {},
+    ["priority"], kind="counter",
+)
+registry.callback(
+    "paisa_response_cache_events_total", "Response cache hits, misses and evictions",
+    lambda: {(event,): response_cache.stats()[event] for event in ("hits", "disk_hits", "misses", "evictions", "expirations", "stale_hits")},
+    ["event"], kind="counter",
+)
+registry.callback("paisa_response_cache_entries", "Entries in the in-memory response cache", lambda: response_cache.stats()["entries"])
+registry.callback(
+    "paisa_llm_parse_total", "Parsed model replies by the step that produced the object",
+    lambda: {(stage,): count for stage, count in structured.stats()["stages"].items()},
+    ["stage"], kind="counter",
+)
+registry.callback(
+    "paisa_llm_repair_tokens_total", "Tokens spent on JSON repair calls",
+    lambda: {("input",): structured.stats()["repair_prompt_tokens"], ("output",): structured.stats()["repair_output_tokens"]},
+    ["direction"], kind="counter",
+)
+
+# Per-user document index behind /api/v1/query
+# (EMBEDDING_BACKEND, VECTOR_INDEX_DIR, VECTOR_IVF_THRESHOLD, VECTOR_IVF_NPROBE,
+# VECTOR_QUANTIZATION, VECTOR_RERANK_FACTOR, VECTOR_MEMORY_BUDGET_MB)
+embedder = embedder_from_env(client, llm_pool)
+vector_store = store_from_env()
+registry.callback(
+    "paisa_vector_index_resident_bytes", "Estimated memory of the open per-user document indexes",
+    lambda: vector_store.stats()["resident_bytes"],
+)
+registry.callback(
+    "paisa_vector_index_events_total", "Per-user document indexes opened and closed under the memory budget",
+    lambda: {(event,): vector_store.stats()[event] for event in ("loads", "evictions")},
+    ["event"], kind="counter",
+)
+
+# Answers reused for paraphrased advice questions with the same profile bucket
+# (SEMANTIC_CACHE_*); uses the document embedder unless SEMANTIC_CACHE_EMBEDDER
+# is set, and None when SEMANTIC_CACHE_ENABLED=false
+semantic_cache = semantic_cache_from_env(
+    embedder_from_env(client, llm_pool, backend=os.getenv("SEMANTIC_CACHE_EMBEDDER")) if os.getenv("SEMANTIC_CACHE_EMBEDDER") else embedder,
+    response_cache.ttl_for,
+)
+registry.callback(
+    "paisa_semantic_cache_events_total", "Semantic cache lookups, hits, evictions, audits and false hits",
+    lambda: {
+        (event,): semantic_cache.stats()[event]
+        for event in ("lookups", "hits", "evictions", "expirations", "audits", "false_hits")
+    } if semantic_cache is not None else {},
+    ["event"], kind="counter",
+)
+
+# /api/v1/advice/batch and /api/v1/feedback/batch: most requests per call, and
+# how many distinct requests one batch may have waiting on the LLM pool at
+# once (kept below the pool size so interactive traffic is not starved)
+ADVICE_BATCH_MAX_ITEMS = int(os.getenv("ADVICE_BATCH_MAX_ITEMS", "1000"))
+ADVICE_BATCH_CONCURRENCY = int(os.getenv("ADVICE_BATCH_CONCURRENCY", "8"))
+
+# Largest PDF accepted by /api/v1/documents
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(50 * 1024 * 1024)))
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
@@ -141,11 +375,17 @@ class InvestmentSimulation(BaseModel):
     gold_value: float
     company_investment_value: Optional[float] = None
     startup_value: Optional[float] = None
+    # Filled in by the Monte Carlo simulator (asset values above are medians)
+    contributed: Optional[float] = None
+    total_value_percentiles: Optional[Dict[str, float]] = None
 
 class FeedbackRequest(BaseModel):
     user_id: str
     month: str  # Format: "YYYY-MM"
     expenses: Dict[str, float]
+    location: str = "kathmandu"  # picks the reference budget
+    monthly_income_npr: Optional[float] = None  # enables the savings-rate item
+    previous_expenses: Optional[Dict[str, float]] = None  # last month, for month-over-month changes
 
 class RightWrongItem(BaseModel):
     title: str
@@ -153,6 +393,19 @@ class RightWrongItem(BaseModel):
     description: str
     solution: Optional[str] = None  # Blurred for free users
 
+class FeedbackNote(BaseModel):
+    # Model-written text for one locally computed feedback item
+    id: str
+    title: str
+    description: str
+    solution: str
+
+class FeedbackNotes(BaseModel):
+    # What Gemini returns for /api/v1/feedback; amounts are filled in locally
+    rights: List[FeedbackNote]
+    wrongs: List[FeedbackNote]
+    suggestions: List[str]
+
 class FeedbackResponse(BaseModel):
     month: str
     total_expenses: float
@@ -161,6 +414,18 @@ class FeedbackResponse(BaseModel):
     suggestions: List[str]
     is_premium: bool
 
+class BatchFeedbackItem(BaseModel):
+    index: int  # position in the submitted list
+    status: int  # HTTP status this request would get from /api/v1/feedback
+    result: Optional[FeedbackResponse] = None
+    error: Optional[str] = None
+
+class BatchFeedbackResponse(BaseModel):
+    results: List[BatchFeedbackItem]  # in request order
+    total: int
+    succeeded: int
+    failed: int
+
 class VisualizationInfo(BaseModel):
     chart_type: str  # "bar", "pie", "line"
     description: str
@@ -180,10 +445,70 @@ class AdviceResponse(BaseModel):
     simulation: Optional[List[InvestmentSimulation]] = None
     is_premium: bool = False
 
+class BatchAdviceItem(BaseModel):
+    index: int  # position in the submitted list
+    status: int  # HTTP status this request would get from /api/v1/advice
+    result: Optional[AdviceResponse] = None
+    error: Optional[str] = None
+
+class BatchAdviceResponse(BaseModel):
+    results: List[BatchAdviceItem]  # in request order
+    total: int
+    succeeded: int
+    failed: int
+    unique_requests: int
+
+class AdviceJob(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    priority: Literal["high", "low"]
+    attempts: int  # runs started so far (busy/down Gemini is retried)
+    created_at: float  # Unix time
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    status_code: Optional[int] = None  # HTTP status /api/v1/advice would have returned
+    result: Optional[AdviceResponse] = None
+    error: Optional[str] = None
+
+AssetClass = Literal["fd", "shares", "mutual_funds", "gold", "company_investment", "startup"]
+
+class AssetAssumption(BaseModel):
+    annual_return: float = Field(..., gt=-1, description="Expected annual return, 0.12 = 12%")
+    annual_volatility: float = Field(..., ge=0, description="Standard deviation of annual returns, 0.25 = 25%")
+
+class InvestSimulationRequest(BaseModel):
+    monthly_investment_npr: float = Field(..., ge=0)
+    initial_investment_npr: float = Field(default=0.0, ge=0)
+    months: int = Field(default=12, ge=1, le=MAX_MONTHS)
+    paths: Optional[int] = Field(default=None, ge=100, description="Monte Carlo paths (default INVEST_SIM_PATHS, at most INVEST_SIM_MAX_PATHS)")
+    allocation: Optional[Dict[AssetClass, float]] = Field(
+        default=None,
+        description="Share of each contribution per asset class, normalized to sum to 1",
+        examples=[{"fd": 0.4, "shares": 0.3, "mutual_funds": 0.2, "gold": 0.1}]
+    )
+    assumptions: Optional[Dict[AssetClass, AssetAssumption]] = None  # overrides the server's per asset
+    seed: Optional[int] = None  # same seed, same paths
+    parallel: Optional[bool] = None  # None: process pool only for large runs
+
+class InvestSimulationResponse(BaseModel):
+    months: int
+    paths: int
+    parallel: bool
+    allocation: Dict[str, float]
+    assumptions: Dict[str, AssetAssumption]
+    simulation: List[InvestmentSimulation]
+    expected_final_value: float  # mean portfolio value at the horizon
+    probability_of_loss: float  # share of paths ending below the money put in
+    elapsed_ms: float
+
 class QueryRequest(BaseModel):
     user_id: str
     query: str
     top_k: int = Field(default=5, ge=1, le=20, description="Number of results to return (1-20)")
+    mode: Literal["hybrid", "vector", "keyword"] = Field(
+        default="hybrid",
+        description="hybrid = BM25 + vector fused with reciprocal-rank fusion"
+    )
 
 class QueryResult(BaseModel):
     content: str
@@ -196,9 +521,35 @@ class QueryResponse(BaseModel):
     results: List[QueryResult]
     total_results: int
 
+class IngestResponse(BaseModel):
+    user_id: str
+    doc_id: str
+    filename: str
+    unchanged: bool
+    pages: int
+    chunks_total: int
+    chunks_new: int
+    chunks_skipped: int
+    seconds: float
+    pages_per_sec: float
+    peak_rss_mb: float
+    peak_worker_rss_mb: float
+
+def compact_json(value: Any) -> str:
+    """JSON without the spaces json.dumps adds by default"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+# Gemini writes the compact contract (compact_output.py): the answer text once,
+# short keys, and none of the numbers finance.py or the simulator compute
+ADVICE_SCHEMAS = {category: compact_schema(category) for category in CATEGORY_RULES}
+FEEDBACK_SCHEMA = gemini_schema(FeedbackNotes)
+
 # Helper functions
 def get_user_from_token(token: str) -> Optional[Dict]:
     """Decode JWT token and return user info"""
+    # Imported on first use: most requests never carry a token
+    from jose import JWTError, jwt
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -210,6 +561,137 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     token = credentials.credentials
     return get_user_from_token(token)
 
+def llm_busy_error(exc: Exception) -> HTTPException:
+    """503 telling the client to back off while the LLM pool is saturated or Gemini is down"""
+    state = "temporarily unavailable" if isinstance(exc, LLMUnavailableError) else "busy"
+    return HTTPException(
+        status_code=503,
+        detail=f"AI service is {state}, please retry shortly: {exc}",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+def is_upstream_outage(exc: Exception) -> bool:
+    """Gemini itself failed: breaker open, timed out, or 5xx/429 after retries"""
+    return isinstance(exc, (LLMUnavailableError, LLMTimeoutError)) or is_retryable(exc)
+
+async def stale_answer(endpoint: str, category: str, cache_key: str, exc: Exception) -> Optional[Dict[str, Any]]:
+    """Expired cached answer to serve instead of an error while Gemini is down"""
+    if not is_upstream_outage(exc):
+        return None
+    data = await response_cache.get_stale(cache_key)
+    if data is not None:
+        DEGRADED_RESPONSES.inc(endpoint=endpoint, category=category)
+        print(f"Serving a stale {endpoint} answer while Gemini is unavailable: {exc}")
+    return data
+
+def stage_timer(endpoint: str, stage: str, category: str, mode: str):
+    """Context manager recording one stage in paisa_stage_seconds"""
+    return STAGE_SECONDS.time(endpoint=endpoint, stage=stage, category=category, mode=mode)
+
+def record_tokens(endpoint: str, category: str, mode: str, usage: Any) -> None:
+    """Add a response's usage_metadata to paisa_llm_tokens_total"""
+    if usage is None:
+        return
+    for direction, count in (
+        ("input", usage.prompt_token_count),
+        ("output", usage.candidates_token_count),
+        ("cached", usage.cached_content_token_count),
+    ):
+        if count:
+            LLM_TOKENS.inc(count, endpoint=endpoint, category=category, mode=mode, direction=direction)
+
+@contextmanager
+def observe_request(endpoint: str, category: str, mode: str):
+    """In-flight count and end-to-end latency (labelled with the HTTP status) for a handler"""
+    started = time.perf_counter()
+    status_code = 200
+    REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        yield
+    except HTTPException as e:
+        status_code = e.status_code
+        raise
+    except Exception:
+        status_code = 500
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=endpoint, category=category, mode=mode, status=str(status_code),
+        )
+
+def json_response(model: BaseModel, endpoint: str, category: str, mode: str, degraded: bool = False) -> Response:
+    """Serialize an already validated response model once (FastAPI would validate it again)"""
+    # Clients can tell a stale fallback answer from a fresh one
+    headers = {"X-Paisa-Degraded": "stale-cache"} if degraded else None
+    with stage_timer(endpoint, "serialization", category, mode):
+        return Response(content=model.model_dump_json(), media_type="application/json", headers=headers)
+
+def check_prompt_budget(route: Any, prompt: str) -> None:
+    """Refuse (413) a prompt over its route's token budget before it is sent"""
+    tokens = router.over_budget(route, prompt)
+    if tokens is not None:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request is too long: about {tokens} prompt tokens, the limit is {route.max_prompt_tokens}. Please shorten the message.",
+        )
+
+def is_truncated(response: Any) -> bool:
+    """Gemini stopped because it reached max_output_tokens"""
+    candidates = getattr(response, "candidates", None)
+    return bool(candidates) and "MAX_TOKENS" in str(getattr(candidates[0], "finish_reason", ""))
+
+def record_route(route: Any, started: float, usage: Any = None, truncated: bool = False, failed: bool = False) -> None:
+    """Latency, tokens and cost of one Gemini call, per route"""
+    seconds = time.perf_counter() - started
+    router.record(route, seconds, usage, truncated=truncated, failed=failed)
+    LLM_ROUTE_SECONDS.observe(seconds, route=route.name, model=route.model)
+
+def system_prompt_config(route: Any, category: str, system_instruction: Optional[str]) -> Dict[str, Any]:
+    """Config arguments for a call's system instruction: its context cache when registered (see prompt_cache)"""
+    if not system_instruction:
+        return {}
+    return prompt_cache.config_kwargs(route.model, category, system_instruction)
+
+async def generate_json(
+    endpoint: str, category: str, mode: str, contents: str, schema: Dict[str, Any], system_instruction: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Schema-constrained Gemini call on the route for category/mode, timed as
+    the llm and json_extraction stages
+    """
+    route = router.route(category, mode)
+    check_prompt_budget(route, (system_instruction or "") + contents)
+    started = time.perf_counter()
+    try:
+        with stage_timer(endpoint, "llm", category, mode):
+            response = await llm_pool.generate_content(
+                model=route.model,
+                contents=contents,
+                config=structured.config(
+                    schema, **system_prompt_config(route, category, system_instruction), **route.config_kwargs()
+                )
+            )
+    except Exception as e:
+        record_route(route, started, failed=True)
+        prompt_cache.discard(route.model, category, e)
+        raise
+    usage = getattr(response, "usage_metadata", None)
+    record_route(route, started, usage, truncated=is_truncated(response))
+    record_tokens(endpoint, category, mode, usage)
+    with stage_timer(endpoint, "json_extraction", category, mode):
+        return await structured.parse(response.text, schema)
+
+async def generate_advice(endpoint: str, category: str, mode: str, contents: str) -> Dict[str, Any]:
+    """
+    generate_json with the category's system instruction and compact schema,
+    expanded to AdviceResponse field names
+    """
+    return expand_advice(await generate_json(
+        endpoint, category, mode, contents, ADVICE_SCHEMAS[category], system_instruction=ADVICE_INSTRUCTIONS[category]
+    ))
+
 # Premium and user tracking features removed (previously required Supabase)
 # All users now have unlimited access to all features
 
@@ -221,23 +703,19 @@ IMPORTANT: All your responses must be in English only. Do not use Nepali languag
 Today is December 2025. You have live web search to get current Nepal prices.
 
 When user wants to buy something:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85 (15% Nepal buffer for inflation/festivals/emergencies)
+1. Use the realistic monthly savings given in the user profile (already includes the 15% Nepal buffer)
 2. Search current 2025 Nepal market prices for the item
-3. Calculate months_needed = target_price / realistic_monthly_savings
-4. Calculate progress_percent = (current_savings / target_price) × 100
-5. Give 3-5 practical tips for saving faster (specific to Nepal context)
-6. Suggest 2-3 alternatives with different price points
+3. Give 3-5 practical tips for saving faster (specific to Nepal context)
+4. Suggest 2-3 alternatives with different price points
+
+Months needed and progress are calculated by the server from your prices, so do not calculate them.
 
 Always respond ONLY with valid JSON using this exact structure. All responses must be in English:
 {
-  "response_np": "English answer explaining the buying plan, timeline, and advice",
-  "response_en": "English answer with the same content",
-  "months_needed": calculated integer,
-  "target_amount_npr": item price in NPR,
-  "realistic_monthly_savings_npr": calculated amount,
-  "progress_percent": calculated percentage,
+  "r": "English answer explaining the buying plan, timeline, and advice",
+  "t": item price in NPR,
   "tips": ["tip 1 specific to Nepal", "tip 2", "tip 3"],
-  "alternatives": [{"name": "alternative item name", "price_npr": price, "months_needed": calculated}]
+  "alt": [{"n": "alternative item name", "p": price}]
 }
 
 Be encouraging, realistic, and specific to Nepal's economy and culture.""",
@@ -249,7 +727,7 @@ IMPORTANT: All your responses must be in English only. Do not use Nepali languag
 Today is December 2025. You help with home loans, personal loans, vehicle loans, EMI optimization.
 
 When user asks about loans:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85
+1. Use the realistic monthly savings given in the user profile
 2. Analyze their EMI capacity (typically 40-50% of monthly savings)
 3. Search current Nepal bank interest rates (2025)
 4. Calculate total interest, EMI amounts, loan tenure options
@@ -258,14 +736,11 @@ When user asks about loans:
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English loan advice",
-  "response_en": "English loan guidance",
-  "months_needed": loan tenure in months,
-  "target_amount_npr": loan amount,
-  "realistic_monthly_savings_npr": available for EMI,
-  "progress_percent": down-payment progress if applicable,
+  "r": "English loan advice",
+  "m": loan tenure in months,
+  "t": loan amount,
   "tips": ["Nepal-specific loan tips"],
-  "alternatives": [{"name": "bank/option name", "price_npr": EMI amount, "months_needed": tenure}]
+  "alt": [{"n": "bank/option name", "p": EMI amount, "m": tenure}]
 }""",
 
     "tax": """You are "Paisa Ko Sahayogi" - Nepal's smartest tax saving advisor.
@@ -275,7 +750,7 @@ IMPORTANT: All your responses must be in English only. Do not use Nepali languag
 Today is December 2025. You help save tax through SSF, CIT, 1% SST, education deductions, green deductions.
 
 When user asks about tax:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85
+1. Use the realistic monthly savings given in the user profile
 2. Analyze their tax bracket based on Nepal's 2025 tax slabs
 3. Calculate potential tax savings from SSF (up to NPR 500,000), CIT, 1% SST
 4. Recommend optimal investment mix for tax benefits
@@ -284,14 +759,10 @@ When user asks about tax:
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English tax advice",
-  "response_en": "English tax guidance",
-  "months_needed": 12 (annual planning),
-  "target_amount_npr": total tax-saving investment recommended,
-  "realistic_monthly_savings_npr": amount available,
-  "progress_percent": current progress toward tax-saving goal,
+  "r": "English tax advice",
+  "t": total tax-saving investment recommended,
   "tips": ["Nepal tax tips for 2025"],
-  "alternatives": [{"name": "SSF/CIT/other option", "price_npr": investment amount, "months_needed": 12}]
+  "alt": [{"n": "SSF/CIT/other option", "p": investment amount}]
 }""",
 
     "big-goal": """You are "Paisa Ko Sahayogi" - Nepal's smartest advisor for big life goals (house down-payment, foreign study/work, wedding).
@@ -301,23 +772,20 @@ IMPORTANT: All your responses must be in English only. Do not use Nepali languag
 Today is December 2025. You help plan major financial milestones.
 
 When user has a big goal:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85
+1. Use the realistic monthly savings given in the user profile
 2. Search current 2025 costs in Nepal (e.g., USA study visa, Australia PR, average wedding, house down-payment in their location)
-3. Calculate timeline to reach goal
-4. Break down goal into smaller milestones
-5. Suggest investment strategies (FD, mutual funds, shares) to grow money faster
-6. Give motivation and practical tips
+3. Break down goal into smaller milestones
+4. Suggest investment strategies (FD, mutual funds, shares) to grow money faster
+5. Give motivation and practical tips
+
+The timeline and progress are calculated by the server from your costs, so do not calculate them.
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English big goal planning",
-  "response_en": "English goal guidance",
-  "months_needed": timeline to achieve,
-  "target_amount_npr": total goal amount,
-  "realistic_monthly_savings_npr": monthly saving capacity,
-  "progress_percent": current progress,
+  "r": "English big goal planning",
+  "t": total goal amount,
   "tips": ["Nepal-specific tips for this goal"],
-  "alternatives": [{"name": "alternative approach/destination", "price_npr": cost, "months_needed": timeline}]
+  "alt": [{"n": "alternative approach/destination", "p": cost}]
 }""",
 
     "festival": """You are "Paisa Ko Sahayogi" - Nepal's smartest advisor for festival and emergency budgeting.
@@ -327,7 +795,7 @@ IMPORTANT: All your responses must be in English only. Do not use Nepali languag
 Today is December 2025. You help plan for Dashain, Tihar, medical emergencies, family events.
 
 When user needs festival/emergency budget:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85
+1. Use the realistic monthly savings given in the user profile
 2. Estimate typical costs for upcoming festivals in Nepal (Dashain expenses, Tihar, weddings, medical buffer)
 3. Create savings timeline before next major festival
 4. Build emergency fund (3-6 months expenses recommended)
@@ -336,14 +804,11 @@ When user needs festival/emergency budget:
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English festival/emergency budget advice",
-  "response_en": "English guidance",
-  "months_needed": months until festival/goal,
-  "target_amount_npr": festival/emergency fund target,
-  "realistic_monthly_savings_npr": monthly saving capacity,
-  "progress_percent": current fund progress,
+  "r": "English festival/emergency budget advice",
+  "m": months until festival/goal,
+  "t": festival/emergency fund target,
   "tips": ["Nepal festival budgeting tips"],
-  "alternatives": [{"name": "different budget approach", "price_npr": amount, "months_needed": timeline}]
+  "alt": [{"n": "different budget approach", "p": amount}]
 }""",
 
     "reduce-expense": """You are "Paisa Ko Sahayogi" - Nepal's smartest expense reduction advisor.
@@ -362,14 +827,11 @@ When user wants to reduce expenses:
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English expense reduction advice",
-  "response_en": "English cost-cutting guidance",
-  "months_needed": 3 (habit building period),
-  "target_amount_npr": total potential annual savings,
-  "realistic_monthly_savings_npr": new monthly savings after cuts,
-  "progress_percent": 0 (starting point),
+  "r": "English expense reduction advice",
+  "t": total potential annual savings,
+  "s": new monthly savings after cuts,
   "tips": ["Nepal-specific expense reduction tips"],
-  "alternatives": [{"name": "expense category to reduce", "price_npr": potential monthly saving, "months_needed": 12}]
+  "alt": [{"n": "expense category to reduce", "p": potential monthly saving}]
 }""",
 
     "invest": """You are "Paisa Ko Sahayogi" - Nepal's smartest investment advisor.
@@ -387,34 +849,20 @@ Current Nepal Market Rates (December 2025):
 - Startup Investment: ~15% annual return (high risk)
 
 When user wants to invest:
-1. Calculate realistic monthly savings = (income - total_expenses) × 0.85
+1. Use the realistic monthly savings given in the user profile as the monthly investment capacity
 2. Recommend portfolio mix based on risk tolerance and timeline
 3. Calculate expected returns for different investment options
 4. Give Nepal-specific investment tips (NEPSE trends, best banks, gold buying timing)
 5. Warn about risks and diversification
-6. If user provides salary, insurance cost, share holdings, create a 12-month investment simulation with monthly projections
-
-For investment simulation (premium feature):
-- Calculate monthly contributions to each asset class
-- Project growth using compound interest: A = P(1 + r/n)^(nt)
-- FD: 6% annual (0.5% monthly)
-- Shares (NEPSE): 12% annual (1% monthly, with volatility)
-- Mutual Funds: 9% annual (0.75% monthly)
-- Gold: 8% annual (0.67% monthly)
-- Company Investment: 10% annual (0.83% monthly)
-- Startup: 15% annual (1.25% monthly, high risk)
+6. List each recommended asset class as an alternative with its monthly amount; the 12-month projection is simulated from them
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English investment advice",
-  "response_en": "English investment guidance",
-  "months_needed": investment timeline (12-60 months typical),
-  "target_amount_npr": investment goal,
-  "realistic_monthly_savings_npr": monthly investment capacity,
-  "progress_percent": current portfolio progress,
+  "r": "English investment advice",
+  "m": investment timeline (12-60 months typical),
+  "t": investment goal,
   "tips": ["Nepal investment tips for 2025"],
-  "alternatives": [{"name": "FD/shares/gold/mutual fund option", "price_npr": monthly investment, "months_needed": timeline}],
-  "simulation": [{"month": 1, "total_value": amount, "fd_value": amount, "shares_value": amount, "mutual_funds_value": amount, "gold_value": amount, "company_investment_value": amount, "startup_value": amount}, ...] (12 months if simulation requested)
+  "alt": [{"n": "FD/shares/gold/mutual fund option", "p": monthly investment, "m": timeline}]
 }""",
 
     "side-income": """You are "Paisa Ko Sahayogi" - Nepal's smartest side income advisor.
@@ -433,258 +881,1195 @@ When user wants side income:
 
 Respond ONLY with valid JSON. All responses must be in English:
 {
-  "response_np": "English side income advice",
-  "response_en": "English extra cash guidance",
-  "months_needed": time to establish income stream,
-  "target_amount_npr": monthly side income goal,
-  "realistic_monthly_savings_npr": current savings capacity,
-  "progress_percent": 0 (starting point),
+  "r": "English side income advice",
+  "m": time to establish income stream,
+  "t": monthly side income goal,
   "tips": ["Nepal-specific side income tips"],
-  "alternatives": [{"name": "side income idea", "price_npr": potential monthly earnings, "months_needed": timeline to start}]
+  "alt": [{"n": "side income idea", "p": potential monthly earnings, "m": timeline to start}]
 }"""
 }
 
+# Instructions shared by every advice category. Together with the category
+# prompt and its compact response schema they form the category's system
+# instruction (ADVICE_INSTRUCTIONS), which is the same for every request, so
+# it is what prompt_cache registers; it has to clear Gemini's 1,024-token
+# minimum for cached content.
+ADVISOR_GUIDELINES = """Guidelines for every answer:
+
+Using the user profile
+- The User Profile comes from the user: Monthly Income, Monthly Expenses with their Breakdown (compact JSON of expense name to NPR), Current Savings, Location and Realistic Monthly Savings. Treat these numbers as correct and do not ask for them again.
+- Realistic Monthly Savings already keeps back a 15% buffer for irregular Nepal expenses. Plan with it, not with income minus expenses.
+- "Past Month Data" and "Earlier advice", when present, are the user's own history. Stay consistent with earlier targets unless the new message changes the goal, and mention progress when it matters for the answer.
+- "Additional Profile" is free-form JSON from the user (age, family, risk appetite, skills, employer and so on). Use what is relevant and ignore the rest.
+- If the message asks about something outside the category, answer the part that fits the category and keep the answer about money.
+
+Nepal context
+- All amounts are Nepali rupees (NPR). 1 lakh = 100,000 and 1 crore = 10,000,000; use lakh or crore for large amounts in the answer text.
+- The Kathmandu valley (Kathmandu, Lalitpur, Bhaktapur) costs more than other cities for rent, land, schooling and transport; smaller towns and villages cost less but offer fewer jobs.
+- Common savings and investment options: fixed and recurring deposits at commercial and development banks, SSF (Social Security Fund), CIT (Citizen Investment Trust), EPF, mutual funds and SIPs, NEPSE shares and IPOs, gold and silver. Cooperatives pay higher rates but carry more risk; say so when you mention them.
+- Large recurring costs: Dashain and Tihar in autumn, weddings, school and college fees at the start of the academic year, foreign study or employment processing, vehicles (prices are high because of import duty) and medical emergencies.
+- Digital wallets (eSewa, Khalti) and mobile banking make small automatic transfers easy; remittance is a large share of income for many families.
+- When a price, rate or cost is uncertain, use a typical current Nepal value and say in the answer text that it is approximate.
+
+Answer content
+- The answer text leads with the direct answer, then the plan with amounts and time, then one risk or caveat. Address the user as "you". Be encouraging but honest, and never promise returns, loan approval or prices.
+- Tips: 3 to 5 short, actionable tips, one sentence each, specific to Nepal and to this user. No numbering, no emoji.
+- Alternatives: 2 or 3 options at different price points or approaches, each with its NPR amount (and months where the schema has them).
+- Numbers are whole NPR amounts and whole months: no currency signs, commas, ranges or units inside numeric fields; give a single best estimate.
+- Months needed and progress are calculated by the server from your numbers; only give months where the schema asks for them.
+
+Format rules
+- Reply with one JSON object that matches the response schema below, and nothing else: no markdown fences, comments or text before or after it.
+- Use only the keys in the schema, with the types it gives; every required key must be present. The short keys are: r = answer text, t = target amount in NPR, m = months, s = monthly savings in NPR, tips = tips, alt = alternatives (n = name, p = NPR amount, m = months).
+- Strings are plain text without markdown or line breaks.
+- Write in English only. Do not use Nepali words, greetings or phrases.
+- Keep the answer text within the word limit given in the Response Requirements of each request."""
+
+ADVICE_INSTRUCTIONS = {
+    category: f"{prompt}\n\n{ADVISOR_GUIDELINES}\n\nResponse schema: {compact_json(ADVICE_SCHEMAS[category])}"
+    for category, prompt in SYSTEM_PROMPTS.items()
+}
+
+# Keeps a reference so the background prewarm is not garbage collected
+prewarm_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def size_llm_executor():
+    """Size the loop's default executor for the LLM pool before any request uses it"""
+    llm_pool.install_executor()
+
+@app.on_event("startup")
+async def prewarm_gemini():
+    """Build the Gemini client and make one metadata call in the background"""
+    global prewarm_task
+    if GEMINI_PREWARM:
+        prewarm_task = asyncio.create_task(asyncio.to_thread(client.prewarm, router.route("*", "simple").model))
+
+# Keeps a reference to the background refresh of the context caches
+prompt_cache_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_prompt_cache():
+    """Register the category system instructions for every routed model and keep them from expiring"""
+    global prompt_cache_task
+    if prompt_cache.enabled:
+        if GEMINI_PREWARM:
+            prompt_cache.warm(
+                (router.route(category, mode).model, category, instruction)
+                for category, instruction in ADVICE_INSTRUCTIONS.items()
+                for mode in get_args(ResponseMode)
+            )
+        prompt_cache_task = asyncio.create_task(prompt_cache.run())
+
+@app.on_event("shutdown")
+async def flush_history():
+    """Write out queued history records before the worker exits"""
+    if history is not None:
+        await history.close()
+
+@app.on_event("shutdown")
+async def stop_prompt_cache():
+    """Stop refreshing the context caches and delete them"""
+    if prompt_cache_task is not None:
+        prompt_cache_task.cancel()
+    await prompt_cache.close()
+
 @app.get("/")
 def read_root():
     return {"message": "Paisa Ko Sahayogi API - Nepal's Smartest Finance Advisor", "version": "1.0.0"}
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of request, stage, token, cache and pool metrics"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/v1/stats")
+def get_stats():
+    """Gemini client, admission, LLM pool and routes, prompt cache, response and semantic cache, structured output, history, document index, job, chat and simulation counters"""
+    return {
+        "gemini_client": client.stats(),
+        "admission": admission.stats() if admission is not None else None,
+        "llm_pool": llm_pool.stats(),
+        "model_routes": router.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "structured_output": structured.stats(),
+        "history": history.stats() if history is not None else None,
+        "vector_store": vector_store.stats(),
+        "advice_jobs": jobs.stats() if jobs is not None else None,
+        "chat": chat_sessions.stats(),
+        "investment_simulator": investment_simulator.stats(),
+    }
+
+def format_past_context(past_data: Dict[str, Any], category: str) -> str:
+    """
+    "Past Month Data" prompt lines from a user's history: last month's
+    expenses and their latest advice in other categories. Advice in the
+    requested category is left out so repeating a question does not change
+    the prompt (and miss the response cache) every time.
+    """
+    past_context = ""
+    if past_data.get("last_month_expenses"):
+        expenses = past_data["last_month_expenses"]
+        if isinstance(expenses, list) and len(expenses) > 0:
+            expenses_dict = expenses[0].get("expenses", {})
+            if expenses_dict:
+                total_past = sum(expenses_dict.values())
+                past_context = f"\nPast Month Data:\n- Last month total expenses: NPR {total_past:,.2f}\n"
+                # Add specific savings highlights
+                if "food" in expenses_dict:
+                    past_context += f"- Last month food expenses: NPR {expenses_dict.get('food', 0):,.2f}\n"
+    
+    earlier = {}
+    for advice in past_data.get("recent_advice", []):
+        if advice["category"] != category and advice["category"] not in earlier:
+            earlier[advice["category"]] = advice
+    if earlier:
+        past_context += "Earlier advice:\n" if past_context else "\nEarlier advice:\n"
+        for advice in list(earlier.values())[:2]:
+            past_context += (
+                f"- {advice['category']}: \"{advice['message'][:80]}\" -> target NPR {advice['target_amount_npr']:,}"
+                f", {advice['months_needed']} months\n"
+            )
+    return past_context
+
+async def load_past_contexts(requests: List[Any], endpoint: str) -> List[str]:
+    """past_context per advice request, from one history lookup; "" without a user_id or history"""
+    if history is None or not any(request.user_id for request in requests):
+        return [""] * len(requests)
+    try:
+        with stage_timer(endpoint, "history_lookup", requests[0].category, requests[0].mode):
+            past = await history.past_data_many(request.user_id for request in requests if request.user_id)
+    except Exception as e:
+        # History only personalises the prompt; answer without it
+        print(f"History lookup failed: {e}")
+        return [""] * len(requests)
+    return [
+        format_past_context(past[request.user_id], request.category) if request.user_id else ""
+        for request in requests
+    ]
+
+def record_advice_history(request: AdviceRequest, advice_data: Dict[str, Any]) -> None:
+    """Log a fresh answer in the user's history (skipped without a user_id)"""
+    if history is not None and request.user_id:
+        history.record_advice(
+            request.user_id,
+            request.category,
+            request.message,
+            advice_data.get("target_amount_npr", 0),
+            advice_data.get("months_needed", 0),
+        )
+
+# Per-request prompt templates, built once; requests only fill them in.
+# Expense breakdowns and extra profiles go in as compact JSON.
+PROFILE_TEMPLATE = (
+    "User Profile:\n"
+    "- Category: {category}\n"
+    "- Monthly Income: NPR {income:,.2f}\n"
+    "- Monthly Expenses: NPR {expenses:,.2f}\n"
+    "  Breakdown: {breakdown}\n"
+    "- Current Savings: NPR {savings:,.2f}\n"
+    "- Location: {location}\n"
+    "- Realistic Monthly Savings (after 15% Nepal buffer): NPR {realistic:,.2f}"
+).format
+USER_CONTEXT_TEMPLATE = "{profile}\n{past_context}\nUser Message: {message}\n{extra}\n{requirements}".format
+RESPONSE_REQUIREMENTS = {
+    (mode, is_premium): f"""Response Requirements:
+- Mode: {mode} ({100 if mode == "simple" else 300} words maximum for simple, 300 words for in-depth)
+- Premium User: {is_premium}"""
+    for mode in get_args(ResponseMode)
+    for is_premium in (True, False)
+}
+
+def expense_breakdown(request: AdviceRequest) -> str:
+    """Expenses as compact JSON; whole amounts are written without a decimal point"""
+    return compact_json({
+        name: int(amount) if float(amount).is_integer() else amount
+        for name, amount in request.monthly_expenses_npr.items()
+    })
+
+def profile_context(request: AdviceRequest) -> str:
+    """The "User Profile" lines of an advice prompt"""
+    total_expenses = sum(request.monthly_expenses_npr.values())
+    return PROFILE_TEMPLATE(
+        category=request.category,
+        income=request.monthly_income_npr,
+        expenses=total_expenses,
+        breakdown=expense_breakdown(request),
+        savings=request.current_savings_npr,
+        location=request.location,
+        realistic=float(realistic_monthly_savings(request.monthly_income_npr, total_expenses)),
+    )
+
+def extra_profile_line(request: AdviceRequest) -> str:
+    return f"Additional Profile: {compact_json(request.extra_profile)}\n" if request.extra_profile else ""
+
+def response_requirements(mode: str, is_premium: bool) -> str:
+    """Length, format and language instructions closing an advice prompt"""
+    return RESPONSE_REQUIREMENTS[(mode, is_premium)]
+
+def build_advice_prompt(request: AdviceRequest, is_premium: bool, past_context: str = "") -> str:
+    """
+    Per-request part of an advice prompt: the user context, with the user's
+    history from format_past_context if any. The category's system
+    instruction goes with it (see generate_advice). History is dropped if
+    the two are over the route's token budget; without it, an oversized
+    prompt is refused with 413.
+    """
+    system_prompt = ADVICE_INSTRUCTIONS.get(request.category)
+    if not system_prompt:
+        raise HTTPException(status_code=400, detail="Invalid category")
+    
+    user_context = USER_CONTEXT_TEMPLATE(
+        profile=profile_context(request),
+        past_context=past_context,
+        message=request.message,
+        extra=extra_profile_line(request),
+        requirements=response_requirements(request.mode, is_premium),
+    )
+    route = router.route(request.category, request.mode)
+    if past_context and router.over_budget(route, system_prompt + user_context) is not None:
+        return build_advice_prompt(request, is_premium, "")
+    check_prompt_budget(route, system_prompt + user_context)
+    return user_context
+
+def coerce_advice_numbers(request: AdviceRequest, advice_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute savings, months_needed, progress and alternative months locally"""
+    return compute_advice_numbers(
+        request.category,
+        request.monthly_income_npr,
+        request.monthly_expenses_npr,
+        request.current_savings_npr,
+        advice_data,
+    )
+
+def finalize_advice(request: AdviceRequest, advice_data: Dict[str, Any], is_premium: bool) -> AdviceResponse:
+    """Add visualization, premium gating and simulation, then validate"""
+    # Add visualization for simple mode
+    visualization = None
+    if request.mode == "simple":
+        chart_data = {
+            "progress": advice_data.get("progress_percent", 0),
+            "target": advice_data.get("target_amount_npr", 0),
+            "current": request.current_savings_npr,
+            "monthly_savings": advice_data.get("realistic_monthly_savings_npr", 0)
+        }
+        visualization = {
+            "chart_type": "bar",
+            "description": f"Progress: {advice_data.get('progress_percent', 0)}% towards goal of NPR {advice_data.get('target_amount_npr', 0):,}",
+            "data": chart_data
+        }
+    
+    # Handle premium blurring for tips
+    if not is_premium and len(advice_data.get("tips", [])) > 3:
+        # Keep only first 3 tips, blur the rest
+        advice_data["tips"] = advice_data["tips"][:3]
+        advice_data["tips"].append("🔒 Upgrade to premium to see more tips and solutions!")
+    
+    # Handle simulation for invest category: simulated here from the
+    # recommended alternatives, never taken from the model (or old cache entries)
+    simulation = None
+    advice_data.pop("simulation", None)
+    if request.category == "invest" and is_premium:
+        simulation = investment_simulator.for_advice(
+            advice_data.get("realistic_monthly_savings_npr", 0), advice_data.get("alternatives")
+        )
+    elif request.category == "invest" and not is_premium:
+        # Add blurred simulation teaser
+        advice_data["tips"].append("🔒 Upgrade to premium to see 12-month investment simulation!")
+    
+    # Add premium flag
+    advice_data["is_premium"] = is_premium
+    if visualization:
+        advice_data["visualization"] = visualization
+    
+    # Kept out of advice_data, which is what gets cached
+    return AdviceResponse(**advice_data, simulation=simulation)
+
+# Sampled semantic cache audits run after the response; the set keeps them alive
+audit_tasks: set = set()
+
+async def audit_semantic_hit(request: AdviceRequest, hit: Any, full_prompt: str) -> None:
+    """Answer a sampled semantic hit with Gemini as well and record whether the two agree"""
+    try:
+        fresh = await generate_advice("semantic_audit", request.category, request.mode, full_prompt)
+    except Exception as e:
+        print(f"Semantic cache audit failed: {e}")
+        return
+    if not semantic_cache.record_audit(hit, request.message, fresh):
+        print(f"Semantic cache false hit: {request.message[:80]!r} matched {hit.matched_message[:80]!r}")
+
+async def semantic_lookup(
+    request: AdviceRequest, endpoint: str, past_context: str, full_prompt: str
+) -> Optional[Dict[str, Any]]:
+    """Cached answer to a paraphrase of this request with the same profile, or None"""
+    if semantic_cache is None:
+        return None
+    try:
+        with stage_timer(endpoint, "semantic_lookup", request.category, request.mode):
+            hit = await semantic_cache.lookup(request, past_context)
+    except Exception as e:
+        # A failed embedding only costs the shortcut
+        print(f"Semantic cache lookup failed: {e}")
+        return None
+    if hit is None:
+        return None
+    CACHE_LOOKUPS.inc(endpoint=endpoint, category=request.category, result="semantic_hit")
+    if semantic_cache.should_audit():
+        task = asyncio.create_task(audit_semantic_hit(request, hit, full_prompt))
+        audit_tasks.add(task)
+        task.add_done_callback(audit_tasks.discard)
+    return hit.value
+
+async def cache_advice(request: AdviceRequest, cache_key: str, advice_data: Dict[str, Any], past_context: str) -> None:
+    """Store a fresh, validated answer in the response cache and the semantic cache"""
+    await response_cache.set(cache_key, advice_data, request.category)
+    if semantic_cache is not None:
+        try:
+            await semantic_cache.add(request, advice_data, past_context)
+        except Exception as e:
+            print(f"Semantic cache add failed: {e}")
+
+async def fetch_advice_data(
+    request: AdviceRequest, is_premium: bool, endpoint: str = "advice", past_context: Optional[str] = None
+) -> Tuple[Dict[str, Any], str, str]:
+    """
+    Raw advice JSON for a request; returns (data, source, cache_key) where
+    source is "cache", "semantic" (the answer to a paraphrased question),
+    "llm", or "stale" (an expired answer served while Gemini is down).
+    ``past_context`` is looked up unless given.
+    """
+    category, mode = request.category, request.mode
+    if past_context is None:
+        past_context = (await load_past_contexts([request], endpoint))[0]
+    with stage_timer(endpoint, "prompt_build", category, mode):
+        full_prompt = build_advice_prompt(request, is_premium, past_context)
+    
+    # Near-identical requests (with the same history) share one cached answer
+    cache_key = advice_fingerprint(request, past_context)
+    with stage_timer(endpoint, "cache_lookup", category, mode):
+        advice_data = await response_cache.get(cache_key)
+    CACHE_LOOKUPS.inc(endpoint=endpoint, category=category, result="hit" if advice_data is not None else "miss")
+    if advice_data is not None:
+        return advice_data, "cache", cache_key
+    advice_data = await semantic_lookup(request, endpoint, past_context, full_prompt)
+    if advice_data is not None:
+        return advice_data, "semantic", cache_key
+    
+    # Use Gemini API to generate content
+    try:
+        advice_data = await generate_advice(endpoint, category, mode, full_prompt)
+    except Exception as e:
+        advice_data = await stale_answer(endpoint, category, cache_key, e)
+        if advice_data is None:
+            raise
+        return advice_data, "stale", cache_key
+    return advice_data, "llm", cache_key
+
+def complete_advice(request: AdviceRequest, advice_data: Dict[str, Any], is_premium: bool) -> AdviceResponse:
+    """Recompute the numbers for this request and build the validated response"""
+    # Numbers are recomputed for this request even on a cache hit, since
+    # the cache key only buckets the money fields
+    coerce_advice_numbers(request, advice_data)
+    return finalize_advice(request, advice_data, is_premium)
+
+def advice_http_error(exc: Exception) -> HTTPException:
+    """Map an advice generation failure to the HTTP error /api/v1/advice returns"""
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, (LLMQueueFullError, LLMUnavailableError)):
+        return llm_busy_error(exc)
+    if isinstance(exc, LLMTimeoutError):
+        return HTTPException(status_code=504, detail=str(exc))
+    if isinstance(exc, json.JSONDecodeError):
+        print(f"JSON Decode Error: {exc}")
+        return HTTPException(status_code=500, detail=f"Invalid JSON response from AI: {str(exc)}")
+    
+    error_msg = str(exc)
+    print(f"General Error: {exc}")
+    import traceback
+    traceback.print_exc()
+    
+    # Check for API key related errors
+    if "API key" in error_msg or "authentication" in error_msg.lower() or "unauthorized" in error_msg.lower():
+        return HTTPException(
+            status_code=500, 
+            detail="GEMINI_API_KEY environment variable is not set or is invalid. Please set it before making requests."
+        )
+    
+    return HTTPException(status_code=500, detail=f"Error generating advice: {error_msg}")
+
+async def answer_advice(request: AdviceRequest, endpoint: str) -> Tuple[AdviceResponse, str]:
+    """Validated advice for one request and where it came from (see fetch_advice_data)"""
+    # Premium status - all users have full access
+    is_premium = True  # All features available to all users
+    
+    past_context = (await load_past_contexts([request], endpoint))[0]
+    advice_data, source, cache_key = await fetch_advice_data(request, is_premium, endpoint, past_context)
+    with stage_timer(endpoint, "validation", request.category, request.mode):
+        advice_response = complete_advice(request, advice_data, is_premium)
+    # Only answers that validated are worth caching
+    if source == "llm":
+        await cache_advice(request, cache_key, advice_data, past_context)
+        record_advice_history(request, advice_data)
+    return advice_response, source
+
 @app.post("/api/v1/advice", response_model=AdviceResponse)
 async def get_advice(request: AdviceRequest):
+    with observe_request("advice", request.category, request.mode):
+        try:
+            # Validate request was parsed correctly
+            if not request:
+                raise HTTPException(status_code=422, detail="Invalid request body")
+            
+            advice_response, source = await answer_advice(request, "advice")
+            return json_response(
+                advice_response, "advice", request.category, request.mode, degraded=source == "stale"
+            )
+            
+        except Exception as e:
+            raise advice_http_error(e)
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def advice_event_stream(request: AdviceRequest):
+    """
+    Yield SSE messages for an advice request as Gemini generates it:
+    `delta` for response text, `item` for each tip/alternative, `field` for
+    every completed top-level value, then the validated `result` (or `error`).
+    """
+    is_premium = True
+    category, mode = request.category, request.mode
+    started_request = time.perf_counter()
+    status_code = 200
+    REQUESTS_IN_FLIGHT.inc(endpoint="advice_stream")
     try:
-        # Validate request was parsed correctly
-        if not request:
-            raise HTTPException(status_code=422, detail="Invalid request body")
-        
-        # Premium status - all users have full access
-        is_premium = True  # All features available to all users
-        
-        system_prompt = SYSTEM_PROMPTS.get(request.category)
-        if not system_prompt:
-            raise HTTPException(status_code=400, detail="Invalid category")
-        
-        total_expenses = sum(request.monthly_expenses_npr.values())
-        realistic_savings = (request.monthly_income_npr - total_expenses) * 0.85
-        
-        # Past data feature removed (previously required Supabase)
-        past_data = {}
+        past_context = (await load_past_contexts([request], "advice_stream"))[0]
+        with stage_timer("advice_stream", "prompt_build", category, mode):
+            full_prompt = build_advice_prompt(request, is_premium, past_context)
+        cache_key = advice_fingerprint(request, past_context)
+        with stage_timer("advice_stream", "cache_lookup", category, mode):
+            advice_data = await response_cache.get(cache_key)
+        from_cache = advice_data is not None
+        CACHE_LOOKUPS.inc(endpoint="advice_stream", category=category, result="hit" if from_cache else "miss")
+        if not from_cache:
+            advice_data = await semantic_lookup(request, "advice_stream", past_context, full_prompt)
+            from_cache = advice_data is not None
+        if not from_cache:
+            schema = ADVICE_SCHEMAS[category]
+            route = router.route(category, mode)
+            parser = IncrementalJSONParser()
+            usage = None
+            truncated = False
+            started_llm = time.perf_counter()
+            first_token = True
+            try:
+                async for chunk in llm_pool.generate_content_stream(
+                    model=route.model,
+                    contents=full_prompt,
+                    config=structured.config(
+                        schema, **system_prompt_config(route, category, ADVICE_INSTRUCTIONS[category]), **route.config_kwargs()
+                    )
+                ):
+                    if first_token:
+                        STAGE_SECONDS.observe(time.perf_counter() - started_llm, endpoint="advice_stream", stage="first_token", category=category, mode=mode)
+                        first_token = False
+                    # Totals and the finish reason arrive on the last chunk
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    truncated = truncated or is_truncated(chunk)
+                    for event, data in parser.feed(chunk.text or ""):
+                        for event, data in expand_event(event, data):
+                            yield sse_event(event, data)
+            except Exception as e:
+                record_route(route, started_llm, usage, failed=True)
+                prompt_cache.discard(route.model, category, e)
+                # A stale answer can only stand in if nothing was streamed yet
+                advice_data = None if parser.text else await stale_answer("advice_stream", category, cache_key, e)
+                if advice_data is None:
+                    raise
+                from_cache = True  # do not store it again as a fresh answer
+            else:
+                STAGE_SECONDS.observe(time.perf_counter() - started_llm, endpoint="advice_stream", stage="llm", category=category, mode=mode)
+                record_route(route, started_llm, usage, truncated=truncated)
+                record_tokens("advice_stream", category, mode, usage)
+                # Same parse/coerce (and repair) path as the non-streaming endpoint
+                with stage_timer("advice_stream", "json_extraction", category, mode):
+                    advice_data = expand_advice(await structured.parse(parser.text, schema))
         
-        # Determine response length based on mode
-        word_limit = 100 if request.mode == "simple" else 300
-        
-        # Build personalized context
-        past_context = ""
-        if past_data.get("last_month_expenses"):
-            expenses = past_data["last_month_expenses"]
-            if isinstance(expenses, list) and len(expenses) > 0:
-                expenses_dict = expenses[0].get("expenses", {})
-                if expenses_dict:
-                    total_past = sum(expenses_dict.values())
-                    past_context = f"\nPast Month Data:\n- Last month total expenses: NPR {total_past:,.2f}\n"
-                    # Add specific savings highlights
-                    if "food" in expenses_dict:
-                        past_context += f"- Last month food expenses: NPR {expenses_dict.get('food', 0):,.2f}\n"
-        
-        user_context = f"""
-User Profile:
-- Category: {request.category}
-- Monthly Income: NPR {request.monthly_income_npr:,.2f}
-- Monthly Expenses: NPR {total_expenses:,.2f}
-  Breakdown: {json.dumps(request.monthly_expenses_npr, indent=2)}
-- Current Savings: NPR {request.current_savings_npr:,.2f}
-- Location: {request.location}
-- Realistic Monthly Savings (after 15% Nepal buffer): NPR {realistic_savings:,.2f}
-{past_context}
-User Message: {request.message}
-
-{f"Additional Profile: {json.dumps(request.extra_profile)}" if request.extra_profile else ""}
-
-Response Requirements:
-- Mode: {request.mode} ({word_limit} words maximum for simple, 300 words for in-depth)
-- Premium User: {is_premium}
-
-Provide complete financial advice in valid JSON format only. No markdown, no extra text.
-
-CRITICAL: All text must be in English only. Do not use any Nepali words, greetings, or phrases. Use English throughout.
-"""
-        
-        full_prompt = f"{system_prompt}\n\n{user_context}"
-        
-        # Use Gemini API to generate content
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=full_prompt
+        with stage_timer("advice_stream", "validation", category, mode):
+            advice_response = complete_advice(request, advice_data, is_premium)
+        if not from_cache:
+            await cache_advice(request, cache_key, advice_data, past_context)
+            record_advice_history(request, advice_data)
+        with stage_timer("advice_stream", "serialization", category, mode):
+            result_event = sse_event("result", advice_response.model_dump())
+        yield result_event
+    except HTTPException as e:
+        status_code = e.status_code
+        yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+    except (LLMQueueFullError, LLMUnavailableError) as e:
+        status_code = 503
+        yield sse_event("error", {"status": 503, "detail": llm_busy_error(e).detail, "retry_after": e.retry_after})
+    except LLMTimeoutError as e:
+        status_code = 504
+        yield sse_event("error", {"status": 504, "detail": str(e)})
+    except Exception as e:
+        status_code = 500
+        print(f"Streaming Advice Error: {e}")
+        import traceback
+        traceback.print_exc()
+        yield sse_event("error", {"status": 500, "detail": f"Error generating advice: {str(e)}"})
+    finally:
+        REQUESTS_IN_FLIGHT.dec(endpoint="advice_stream")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started_request,
+            endpoint="advice_stream", category=category, mode=mode, status=str(status_code),
         )
-        
-        content = response.text
-        
-        # Extract JSON from markdown code blocks if present
-        if "```json" in content:
-            start = content.find("```json") + 7
-            end = content.find("```", start)
-            content = content[start:end].strip()
-        elif "```" in content:
-            start = content.find("```") + 3
-            end = content.find("```", start)
-            content = content[start:end].strip()
-        
-        # Extract JSON object if surrounded by other text
-        if '{' in content and '}' in content:
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            content = content[start_idx:end_idx]
-        
-        advice_data = json.loads(content)
-        
-        # Ensure integer fields are integers (handle float values from AI)
-        if "progress_percent" in advice_data:
-            advice_data["progress_percent"] = int(round(advice_data["progress_percent"]))
-        if "months_needed" in advice_data:
-            advice_data["months_needed"] = int(round(advice_data["months_needed"]))
-        if "target_amount_npr" in advice_data:
-            advice_data["target_amount_npr"] = int(round(advice_data["target_amount_npr"]))
-        if "realistic_monthly_savings_npr" in advice_data:
-            advice_data["realistic_monthly_savings_npr"] = int(round(advice_data["realistic_monthly_savings_npr"]))
-        
-        # Ensure alternatives have integer fields
-        if "alternatives" in advice_data:
-            for alt in advice_data["alternatives"]:
-                if "price_npr" in alt:
-                    alt["price_npr"] = int(round(alt["price_npr"]))
-                if "months_needed" in alt:
-                    alt["months_needed"] = int(round(alt["months_needed"]))
-        
-        # Add visualization for simple mode
-        visualization = None
-        if request.mode == "simple":
-            chart_data = {
-                "progress": advice_data.get("progress_percent", 0),
-                "target": advice_data.get("target_amount_npr", 0),
-                "current": request.current_savings_npr,
-                "monthly_savings": advice_data.get("realistic_monthly_savings_npr", 0)
-            }
-            visualization = {
-                "chart_type": "bar",
-                "description": f"Progress: {advice_data.get('progress_percent', 0)}% towards goal of NPR {advice_data.get('target_amount_npr', 0):,}",
-                "data": chart_data
-            }
-        
-        # Handle premium blurring for tips
-        if not is_premium and len(advice_data.get("tips", [])) > 3:
-            # Keep only first 3 tips, blur the rest
-            advice_data["tips"] = advice_data["tips"][:3]
-            advice_data["tips"].append("🔒 Upgrade to premium to see more tips and solutions!")
-        
-        # Handle simulation for invest category
-        simulation = None
-        if request.category == "invest" and is_premium and "simulation" in advice_data:
-            simulation = advice_data["simulation"]
-        elif request.category == "invest" and not is_premium:
-            # Add blurred simulation teaser
-            advice_data["tips"].append("🔒 Upgrade to premium to see 12-month investment simulation!")
-        
-        # Add premium flag
-        advice_data["is_premium"] = is_premium
-        if visualization:
-            advice_data["visualization"] = visualization
-        if simulation:
-            advice_data["simulation"] = simulation
-        
-        return AdviceResponse(**advice_data)
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-        print(f"Response content: {content if 'content' in locals() else 'No content'}")
-        raise HTTPException(status_code=500, detail=f"Invalid JSON response from AI: {str(e)}")
+
+@app.post("/api/v1/advice/stream")
+async def stream_advice(request: AdviceRequest):
+    """Server-Sent Events variant of /api/v1/advice"""
+    return StreamingResponse(
+        advice_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Server-side state of WebSocket chats (CHAT_MAX_SESSIONS, CHAT_IDLE_SECONDS,
+# CHAT_SUMMARY_TURNS, CHAT_SWEEP_SECONDS)
+chat_sessions = sessions_from_env()
+
+@app.on_event("startup")
+async def start_chat_sweep():
+    """Drop idle chat sessions in the background, not only when another chat starts"""
+    chat_sessions.start()
+
+@app.on_event("shutdown")
+async def stop_chat_sweep():
+    """Stop the idle chat session sweep"""
+    await chat_sessions.stop()
+registry.callback("paisa_chat_sessions_active", "Chat sessions held in memory", lambda: chat_sessions.stats()["active"])
+registry.callback(
+    "paisa_chat_session_events_total", "Chat sessions created, resumed, evicted and closed, and chat turns",
+    lambda: {
+        (event,): chat_sessions.stats()[event]
+        for event in ("created", "resumed", "turns", "evicted_idle", "evicted_lru", "closed")
+    },
+    ["event"], kind="counter",
+)
+
+# System instruction for chat follow-ups, the same for every session and
+# category: the category prompt went with the chat's first turn in that
+# category, and the response schema carries the field descriptions
+CHAT_FOLLOWUP_INSTRUCTION = (
+    'You are "Paisa Ko Sahayogi", Nepal\'s personal finance advisor, continuing a chat. '
+    "Answer the user's new message as a follow-up to the earlier turns, for their profile and in NPR. "
+    "Reply only with JSON filling every field of the response schema; months and progress are calculated by the server. "
+    "Use English only: no Nepali words or greetings."
+)
+CHAT_REPLY_LENGTH = {"simple": "Answer in at most 100 words.", "indepth": "Answer in at most 300 words."}
+
+def chat_profile_line(request: AdviceRequest) -> str:
+    """One-line profile for chat follow-ups"""
+    total_expenses = sum(request.monthly_expenses_npr.values())
+    realistic = float(realistic_monthly_savings(request.monthly_income_npr, total_expenses))
+    return (
+        f"Profile: income {request.monthly_income_npr:,.0f}, expenses {total_expenses:,.0f}"
+        f" {expense_breakdown(request)}, savings {request.current_savings_npr:,.0f},"
+        f" {request.location}, realistic savings {realistic:,.0f}/month"
+    )
+
+def chat_prompt(session: ChatSession, request: AdviceRequest, is_premium: bool) -> Tuple[str, str]:
+    """
+    (system instruction, contents) for a chat turn. The chat's first turn in
+    a category is a full advice prompt (the category's system instruction,
+    profile and history) plus the earlier turns; later turns in that
+    category send CHAT_FOLLOWUP_INSTRUCTION, a one-line profile, the turn
+    summary, the last answer and the new message.
+    """
+    parts = []
+    follow_up = request.category in session.answered_categories
+    if follow_up:
+        instruction = CHAT_FOLLOWUP_INSTRUCTION
+        parts.append(chat_profile_line(request) + (f"\n{extra_profile_line(request)}" if request.extra_profile else ""))
+    else:
+        instruction = ADVICE_INSTRUCTIONS[request.category]
+        parts.append(
+            f"{profile_context(request)}\n{extra_profile_line(request)}{session.past_context}"
+            "\nThis is a chat: every user message is a follow-up in the same conversation."
+        )
+    summary = session.summary()
+    if summary:
+        parts.append(summary)
+    last = session.last_answer
+    if last:
+        parts.append(
+            f"Last answer: {str(last.get('response_en', ''))[:400]}"
+            f" (target NPR {last.get('target_amount_npr', 0):,}, {last.get('months_needed', 0)} months,"
+            f" saving NPR {last.get('realistic_monthly_savings_npr', 0):,}/month)"
+        )
+    parts.append(f"User Message: {request.message}")
+    parts.append(CHAT_REPLY_LENGTH[request.mode] if follow_up else response_requirements(request.mode, is_premium))
+    return instruction, "\n\n".join(parts)
+
+async def chat_error(websocket: WebSocket, status_code: int, detail: str, retry_after: Optional[float] = None) -> None:
+    event = {"type": "error", "status": status_code, "detail": detail}
+    if retry_after is not None:
+        event["retry_after"] = retry_after
+    await websocket.send_json(event)
+
+async def chat_turn(websocket: WebSocket, session: ChatSession, data: Dict[str, Any]) -> None:
+    """
+    Answer one chat message, sending the same delta/item/field events as
+    the SSE stream and then the validated `result`
+    """
+    overrides = {key: data[key] for key in ("category", "mode") if data.get(key)}
+    try:
+        request = AdviceRequest(**{**session.profile, **overrides, "message": str(data.get("message") or "")})
+    except ValidationError as e:
+        await chat_error(websocket, 422, str(e))
+        return
+    if not request.message.strip():
+        await chat_error(websocket, 422, "message is required")
+        return
+    session.profile.update(overrides)
+    
+    is_premium = True
+    category, mode = request.category, request.mode
+    started_request = time.perf_counter()
+    status_code = 200
+    admitted_at = None
+    REQUESTS_IN_FLIGHT.inc(endpoint="chat")
+    try:
+        # The admission middleware only sees HTTP requests; each turn is admitted here
+        if admission is not None:
+            key = f"user:{request.user_id}" if request.user_id else f"chat:{session.session_id}"
+            admitted_at = await admission.acquire(key, request_priority({"mode": mode}))
+        with stage_timer("chat", "prompt_build", category, mode):
+            instruction, contents = chat_prompt(session, request, is_premium)
+            route = router.route(category, mode)
+            check_prompt_budget(route, instruction + contents)
+            # A first turn in a category uses its registered system instruction
+            if instruction == ADVICE_INSTRUCTIONS[category]:
+                system = system_prompt_config(route, category, instruction)
+            else:
+                system = {"system_instruction": instruction}
+        schema = ADVICE_SCHEMAS[category]
+        parser = IncrementalJSONParser()
+        usage = None
+        truncated = False
+        started_llm = time.perf_counter()
+        first_token = True
+        try:
+            async for chunk in llm_pool.generate_content_stream(
+                model=route.model,
+                contents=contents,
+                config=structured.config(schema, **system, **route.config_kwargs())
+            ):
+                if first_token:
+                    STAGE_SECONDS.observe(time.perf_counter() - started_llm, endpoint="chat", stage="first_token", category=category, mode=mode)
+                    first_token = False
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                truncated = truncated or is_truncated(chunk)
+                for event, payload in parser.feed(chunk.text or ""):
+                    for event, payload in expand_event(event, payload):
+                        await websocket.send_json({"type": event, **payload})
+        except Exception as e:
+            record_route(route, started_llm, usage, failed=True)
+            prompt_cache.discard(route.model, category, e)
+            raise
+        STAGE_SECONDS.observe(time.perf_counter() - started_llm, endpoint="chat", stage="llm", category=category, mode=mode)
+        record_route(route, started_llm, usage, truncated=truncated)
+        record_tokens("chat", category, mode, usage)
+        with stage_timer("chat", "json_extraction", category, mode):
+            advice_data = expand_advice(await structured.parse(parser.text, schema))
+        with stage_timer("chat", "validation", category, mode):
+            advice_response = complete_advice(request, advice_data, is_premium)
+        chat_sessions.record_turn(session, category, request.message, advice_data)
+        record_advice_history(request, advice_data)
+        await websocket.send_json({"type": "result", "turn": session.turn_count, "data": advice_response.model_dump()})
+    except WebSocketDisconnect:
+        status_code = 499
+        raise
+    except AdmissionRejected as e:
+        status_code = e.status
+        await chat_error(websocket, e.status, e.detail, e.retry_after)
+    except HTTPException as e:
+        status_code = e.status_code
+        await chat_error(websocket, e.status_code, str(e.detail))
+    except (LLMQueueFullError, LLMUnavailableError) as e:
+        status_code = 503
+        await chat_error(websocket, 503, llm_busy_error(e).detail, e.retry_after)
+    except LLMTimeoutError as e:
+        status_code = 504
+        await chat_error(websocket, 504, str(e))
     except Exception as e:
-        error_msg = str(e)
-        print(f"General Error: {e}")
+        status_code = 500
+        print(f"Chat Error: {e}")
         import traceback
         traceback.print_exc()
-        
-        # Check for API key related errors
-        if "API key" in error_msg or "authentication" in error_msg.lower() or "unauthorized" in error_msg.lower():
-            raise HTTPException(
-                status_code=500, 
-                detail="GEMINI_API_KEY environment variable is not set or is invalid. Please set it before making requests."
+        await chat_error(websocket, 500, f"Error generating advice: {str(e)}")
+    finally:
+        if admitted_at is not None:
+            admission.release(admitted_at)
+        REQUESTS_IN_FLIGHT.dec(endpoint="chat")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started_request,
+            endpoint="chat", category=category, mode=mode, status=str(status_code),
+        )
+
+@app.websocket("/api/v1/chat")
+async def chat(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Advice chat over a WebSocket. Send {"type": "start", "profile": {...}}
+    (an /api/v1/advice body without `message`), or connect with
+    ?session_id= to resume; then {"type": "message", "message": "..."} per
+    turn. {"type": "profile", "profile": {...}} updates profile fields and
+    {"type": "end"} closes the session.
+    """
+    await websocket.accept()
+    session = None
+    if session_id:
+        session = chat_sessions.resume(session_id)
+        if session is None:
+            await chat_error(websocket, 404, "Chat session expired; send a start message to begin a new one")
+        else:
+            await websocket.send_json({"type": "session", "session_id": session.session_id, "resumed": True, "turns": session.turn_count})
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(websocket.receive_json(), timeout=chat_sessions.idle_seconds)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1000, reason="idle")
+                return
+            except ValueError:
+                await chat_error(websocket, 400, "Messages must be JSON objects")
+                continue
+            kind = data.get("type") if isinstance(data, dict) else None
+            
+            if kind == "start":
+                profile = {**(data.get("profile") or {}), "message": ""}
+                try:
+                    request = AdviceRequest(**profile)
+                except (ValidationError, TypeError) as e:
+                    await chat_error(websocket, 422, str(e))
+                    continue
+                past_context = (await load_past_contexts([request], "chat"))[0]
+                session = chat_sessions.create(request.model_dump(exclude={"message"}), past_context)
+                await websocket.send_json({"type": "session", "session_id": session.session_id, "resumed": False, "turns": 0})
+            elif session is None:
+                await chat_error(websocket, 409, "Send a start message (or connect with a live session_id) first")
+            elif kind == "message":
+                async with session.lock:
+                    await chat_turn(websocket, session, data)
+            elif kind == "profile":
+                changes = {key: value for key, value in (data.get("profile") or {}).items() if key != "message"}
+                try:
+                    AdviceRequest(**{**session.profile, **changes, "message": ""})
+                except (ValidationError, TypeError) as e:
+                    await chat_error(websocket, 422, str(e))
+                    continue
+                session.update_profile(changes)
+                chat_sessions.touch(session)
+                await websocket.send_json({"type": "profile_updated"})
+            elif kind == "end":
+                chat_sessions.close(session.session_id)
+                await websocket.close(code=1000)
+                return
+            else:
+                await chat_error(websocket, 400, f"Unknown message type: {kind!r}")
+    except WebSocketDisconnect:
+        pass  # the session stays resumable until it is idle for CHAT_IDLE_SECONDS
+
+async def advice_group_items(
+    requests: List[AdviceRequest], indices: List[int], past_context: str, semaphore: asyncio.Semaphore
+) -> List[BatchAdviceItem]:
+    """
+    Answer every request in a group of identical fingerprints with one
+    cache/LLM lookup; numbers are still computed per request
+    """
+    is_premium = True
+    try:
+        async with semaphore:
+            raw_data, source, cache_key = await fetch_advice_data(
+                requests[indices[0]], is_premium, endpoint="batch", past_context=past_context
             )
+    except Exception as e:
+        error = advice_http_error(e)
+        return [BatchAdviceItem(index=i, status=error.status_code, error=str(error.detail)) for i in indices]
+    
+    items = []
+    fresh = source == "llm"
+    for i in indices:
+        request = requests[i]
+        try:
+            advice_data = copy.deepcopy(raw_data)
+            with stage_timer("batch", "validation", request.category, request.mode):
+                advice_response = complete_advice(request, advice_data, is_premium)
+            if source == "llm":
+                await cache_advice(request, cache_key, advice_data, past_context)
+                source = "cache"
+            if fresh:
+                record_advice_history(request, advice_data)
+            items.append(BatchAdviceItem(index=i, status=200, result=advice_response))
+        except Exception as e:
+            error = advice_http_error(e)
+            items.append(BatchAdviceItem(index=i, status=error.status_code, error=str(error.detail)))
+    return items
+
+async def batch_advice_items(requests: List[AdviceRequest], groups: Dict[Tuple[str, str], List[int]]):
+    """Yield per-request items as each (fingerprint, past_context) group completes"""
+    semaphore = asyncio.Semaphore(ADVICE_BATCH_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(advice_group_items(requests, indices, past_context, semaphore))
+        for (_, past_context), indices in groups.items()
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                yield item
+    finally:
+        # Client went away mid-stream: stop spending LLM calls on it
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/v1/advice/batch", response_model=BatchAdviceResponse)
+async def batch_advice(
+    requests: List[AdviceRequest],
+    stream: bool = Query(False, description="Stream one NDJSON line per request as results complete")
+):
+    """
+    Advice for many requests in one call. Requests with the same fingerprint
+    share one LLM call, distinct ones run ADVICE_BATCH_CONCURRENCY at a time,
+    and a failed request is reported in its own item instead of failing the batch.
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+    if len(requests) > ADVICE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has {len(requests)} requests; the limit is {ADVICE_BATCH_MAX_ITEMS}"
+        )
+    
+    # One history lookup for the whole batch; the fingerprint covers it
+    past_contexts = await load_past_contexts(requests, "batch")
+    groups: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+    for i, (request, past_context) in enumerate(zip(requests, past_contexts)):
+        groups[(advice_fingerprint(request, past_context), past_context)].append(i)
+    
+    if stream:
+        async def ndjson_lines():
+            succeeded = 0
+            async for item in batch_advice_items(requests, groups):
+                succeeded += item.status == 200
+                yield item.model_dump_json() + "\n"
+            summary = {
+                "total": len(requests),
+                "succeeded": succeeded,
+                "failed": len(requests) - succeeded,
+                "unique_requests": len(groups),
+            }
+            yield json.dumps({"summary": summary}) + "\n"
         
-        raise HTTPException(status_code=500, detail=f"Error generating advice: {error_msg}")
+        return StreamingResponse(
+            ndjson_lines(),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    
+    results = [item async for item in batch_advice_items(requests, groups)]
+    results.sort(key=lambda item: item.index)
+    succeeded = sum(1 for item in results if item.status == 200)
+    return BatchAdviceResponse(
+        results=results,
+        total=len(requests),
+        succeeded=succeeded,
+        failed=len(requests) - succeeded,
+        unique_requests=len(groups),
+    )
 
-@app.post("/api/v1/feedback", response_model=FeedbackResponse)
-async def get_feedback(request: FeedbackRequest):
-    """Monthly feedback on past expenditures"""
+async def run_advice_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job worker: the /api/v1/advice path; failures Gemini may recover from are retried"""
+    request = AdviceRequest(**payload)
+    with observe_request("jobs", request.category, request.mode):
+        try:
+            advice_response, _ = await answer_advice(request, "jobs")
+        except Exception as e:
+            error = advice_http_error(e)
+            retry_after = None
+            if isinstance(e, (LLMQueueFullError, LLMUnavailableError)):
+                retry_after = e.retry_after
+            elif is_upstream_outage(e):
+                retry_after = 5
+            raise JobFailed(error.status_code, str(error.detail), retry_after)
+    return advice_response.model_dump()
+
+# Persistent queue behind /api/v1/advice/jobs (ADVICE_JOBS_*); None when
+# ADVICE_JOBS_DB_PATH is empty
+jobs = jobs_from_env(run_advice_job)
+registry.callback(
+    "paisa_advice_jobs_total", "Advice jobs by event",
+    lambda: {
+        (event,): jobs.stats()[event]
+        for event in ("submitted", "deduplicated", "recovered", "completed", "failed", "retried")
+    } if jobs is not None else {},
+    ["event"], kind="counter",
+)
+registry.callback("paisa_advice_jobs_queued", "Advice jobs waiting for a worker", lambda: jobs.stats()["queued"] if jobs is not None else 0)
+
+@app.on_event("startup")
+async def start_jobs():
+    """Requeue stored advice jobs and start the job workers"""
+    if jobs is not None:
+        # Render sets RENDER; its service disk does not survive a deploy
+        if os.getenv("RENDER") and on_code_filesystem(jobs.path):
+            print(
+                f"WARNING: ADVICE_JOBS_DB_PATH ({jobs.path}) is on the service's ephemeral disk; queued and "
+                "finished jobs are lost on every deploy. Point it at a persistent disk (see ENV_VARIABLES_GUIDE.md)."
+            )
+        await jobs.start()
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    """Stop the job workers; interrupted jobs run again after the restart"""
+    if jobs is not None:
+        await jobs.stop()
+
+def job_view(job: Dict[str, Any]) -> AdviceJob:
+    return AdviceJob(**{
+        **{key: value for key, value in job.items() if key != "request"},
+        "priority": "high" if job["priority"] == PRIORITY_HIGH else "low",
+    })
+
+def require_jobs():
+    if jobs is None:
+        raise HTTPException(status_code=503, detail="Advice jobs are disabled on this server (ADVICE_JOBS_DB_PATH)")
+    return jobs
+
+@app.post("/api/v1/advice/jobs", response_model=AdviceJob, status_code=202)
+async def submit_advice_job(
+    request: AdviceRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Queue an advice request and return its job at once. Poll
+    GET /api/v1/advice/jobs/{job_id} or subscribe to .../events for the
+    result. Submitting the same body (or Idempotency-Key) again returns the
+    existing job with 200.
+    """
+    queue = require_jobs()
+    payload = request.model_dump()
     try:
-        # All users have access to feedback feature
-        is_premium = True
-        
-        total_expenses = sum(request.expenses.values())
-        
-        # Analyze expenses using AI
-        expense_analysis_prompt = f"""You are "Paisa Ko Sahayogi" - Nepal's smartest expense analyzer.
-
-Analyze the following monthly expenses for {request.month}:
-{json.dumps(request.expenses, indent=2)}
-Total: NPR {total_expenses:,.2f}
-
-Provide feedback in JSON format:
-{{
-  "rights": [
-    {{"title": "What they did right", "amount": saved_amount, "description": "explanation", "solution": "how to continue"}},
-    ... (3-5 items)
-  ],
-  "wrongs": [
-    {{"title": "What they did wrong", "amount": wasted_amount, "description": "explanation", "solution": "how to fix"}},
-    ... (3-5 items)
-  ],
-  "suggestions": ["suggestion 1", "suggestion 2", ...]
-}}
+        job, created = await queue.submit(payload, request_priority(payload), idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Too many advice jobs waiting, please retry later: {e}", headers={"Retry-After": "30"})
+    location = f"/api/v1/advice/jobs/{job['job_id']}"
+    return JSONResponse(
+        content=json.loads(job_view(job).model_dump_json()),
+        status_code=202 if created else 200,
+        headers={"Location": location},
+    )
+
+@app.get("/api/v1/advice/jobs/{job_id}", response_model=AdviceJob)
+async def get_advice_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=30, description="Seconds to wait for the job to finish before answering"),
+):
+    """A job's status, with the AdviceResponse once it is done"""
+    job = await require_jobs().wait(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (finished jobs are kept for ADVICE_JOBS_RETENTION_SECONDS)")
+    return job_view(job)
+
+@app.get("/api/v1/advice/jobs/{job_id}/events")
+async def advice_job_events(job_id: str):
+    """
+    Server-Sent Events for a job: `status` when subscribing and every 15 s
+    while it runs, then `result` (the AdviceResponse) or `error`
+    """
+    queue = require_jobs()
+    job = await queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        current = job
+        while True:
+            if current["status"] == "done":
+                yield sse_event("result", current["result"])
+                return
+            if current["status"] == "failed":
+                yield sse_event("error", {"status": current["status_code"], "detail": current["error"]})
+                return
+            yield sse_event("status", {"job_id": job_id, "status": current["status"], "attempts": current["attempts"]})
+            current = await queue.wait(job_id, 15)
+            if current is None:
+                yield sse_event("error", {"status": 404, "detail": "Job not found"})
+                return
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
+def build_feedback_prompt(request: FeedbackRequest, analysis: Dict[str, Any]) -> str:
+    """Compact prompt from the local expense analysis (no raw expense JSON)"""
+    totals = f"Total: {analysis['total']:,.0f}"
+    if request.monthly_income_npr:
+        totals += f"; income {request.monthly_income_npr:,.0f}"
+    if analysis["previous_total"] is not None:
+        totals += f"; last month {analysis['previous_total']:,.0f}"
+    
+    def item_lines(items: List[Dict[str, Any]]) -> str:
+        if not items:
+            return "(none)"
+        return "\n".join(f"- [{item['id']}] {item['amount']:,} {item['note']}" for item in items)
+    
+    group_lines = "\n".join(f"- {line}" for line in analysis["lines"])
+    return f"""You are "Paisa Ko Sahayogi" - Nepal's smartest expense analyzer.
+
+Monthly expenses for {request.month} ({request.location}), already analyzed. Amounts in NPR.
+{totals}
+By group: amount, share of spending/typical share{", change vs last month" if analysis["previous_total"] is not None else ""}, [expense names]:
+{group_lines}
+
+RIGHTS:
+{item_lines(analysis["rights"])}
+
+WRONGS:
+{item_lines(analysis["wrongs"])}
+
+For each item write a title, description and solution (how to continue / how to fix), keeping its id and list. Use only the numbers given. Then give 3 suggestions.
 Focus on Nepal-specific context. Be encouraging but honest. All text in English only."""
 
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=expense_analysis_prompt
+def merge_feedback_items(items: List[Dict[str, Any]], notes: List[Any]) -> List[Dict[str, Any]]:
+    """Locally computed items with the model's text; an item the model skipped keeps its default text"""
+    written = {note.get("id"): note for note in notes if isinstance(note, dict)}
+    merged = []
+    for item in items:
+        note = written.get(item["id"], {})
+        merged.append({
+            "title": note.get("title") or item["title"],
+            "amount": item["amount"],
+            "description": note.get("description") or item["description"],
+            "solution": note.get("solution"),
+        })
+    return merged
+
+registry.callback(
+    "paisa_invest_simulations_total", "Investment simulations run, in this process or over the process pool",
+    lambda: {(mode,): count for mode, count in investment_simulator.stats()["runs"].items()},
+    ["mode"], kind="counter",
+)
+
+@app.on_event("shutdown")
+async def stop_investment_simulator():
+    """Shut down the simulation process pool, if a large run started one"""
+    investment_simulator.close()
+
+@app.post("/api/v1/invest/simulate", response_model=InvestSimulationResponse)
+async def simulate_investment(request: InvestSimulationRequest):
+    """Monte Carlo projection of a monthly investment plan; computed locally, never calls Gemini"""
+    try:
+        assumptions = None
+        if request.assumptions:
+            assumptions = {
+                asset: (assumption.annual_return, assumption.annual_volatility)
+                for asset, assumption in request.assumptions.items()
+            }
+        result = await investment_simulator.run(
+            request.monthly_investment_npr,
+            months=request.months,
+            paths=request.paths,
+            initial_investment=request.initial_investment_npr,
+            allocation=request.allocation,
+            assumptions=assumptions,
+            seed=request.seed,
+            parallel=request.parallel,
         )
-        
-        content = response.text
-        
-        # Extract JSON
-        if "```json" in content:
-            start = content.find("```json") + 7
-            end = content.find("```", start)
-            content = content[start:end].strip()
-        elif "```" in content:
-            start = content.find("```") + 3
-            end = content.find("```", start)
-            content = content[start:end].strip()
-        
-        if '{' in content and '}' in content:
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            content = content[start_idx:end_idx]
-        
-        analysis_data = json.loads(content)
-        
-        # Handle premium blurring
-        rights = analysis_data.get("rights", [])[:3] if not is_premium else analysis_data.get("rights", [])
-        wrongs = analysis_data.get("wrongs", [])[:3] if not is_premium else analysis_data.get("wrongs", [])
-        
-        # Blur solutions for free users
-        if not is_premium:
-            for item in rights + wrongs:
-                if "solution" in item:
-                    item["solution"] = "🔒 Upgrade to premium to see solutions!"
-        
-        # Add premium teaser if free user
-        if not is_premium and len(analysis_data.get("rights", [])) > 3:
-            wrongs.append({
-                "title": "More insights available",
-                "amount": 0,
-                "description": "🔒 Upgrade to premium to see all 5 rights and wrongs with detailed solutions!",
-                "solution": None
-            })
-        
-        return FeedbackResponse(
+        return InvestSimulationResponse(**result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Simulation Error: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error running simulation: {str(e)}")
+
+@app.post("/api/v1/feedback", response_model=FeedbackResponse)
+async def get_feedback(request: FeedbackRequest):
+    """Monthly feedback on past expenditures"""
+    with observe_request("feedback", "feedback", "none"):
+        return await generate_feedback(request)
+
+async def with_previous_month(request: FeedbackRequest, endpoint: str) -> FeedbackRequest:
+    """Fill in last month's expenses from the user's history and queue this month's"""
+    if history is None:
+        return request
+    # Last month's expenses from the user's own history, unless sent
+    if request.previous_expenses is None and previous_month(request.month):
+        with stage_timer(endpoint, "history_lookup", "feedback", "none"):
+            previous = await history.month_expenses(request.user_id, previous_month(request.month))
+        if previous is not None:
+            request = request.model_copy(update={"previous_expenses": previous})
+    # Batched write; later advice requests see it as "Past Month Data"
+    history.record_month(request.user_id, request.month, request.expenses)
+    return request
+
+async def answer_feedback(request: FeedbackRequest, analysis: Dict[str, Any], endpoint: str) -> Tuple[FeedbackResponse, bool]:
+    """Feedback for one analysed request; True with it when the answer is a stale fallback"""
+    # All users have access to feedback feature
+    is_premium = True
+    total_expenses = analysis["total"]
+    
+    with stage_timer(endpoint, "prompt_build", "feedback", "none"):
+        expense_analysis_prompt = build_feedback_prompt(request, analysis)
+
+    cache_key = feedback_fingerprint(request)
+    with stage_timer(endpoint, "cache_lookup", "feedback", "none"):
+        analysis_data = await response_cache.get(cache_key)
+    from_cache = analysis_data is not None
+    CACHE_LOOKUPS.inc(endpoint=endpoint, category="feedback", result="hit" if from_cache else "miss")
+    stale = False
+    if not from_cache:
+        try:
+            analysis_data = await generate_json(endpoint, "feedback", "none", expense_analysis_prompt, FEEDBACK_SCHEMA)
+        except Exception as e:
+            analysis_data = await stale_answer(endpoint, "feedback", cache_key, e)
+            if analysis_data is None:
+                raise
+            from_cache = stale = True
+    
+    all_rights = merge_feedback_items(analysis["rights"], analysis_data.get("rights", []))
+    all_wrongs = merge_feedback_items(analysis["wrongs"], analysis_data.get("wrongs", []))
+    
+    # Handle premium blurring
+    rights = all_rights[:3] if not is_premium else all_rights
+    wrongs = all_wrongs[:3] if not is_premium else all_wrongs
+    
+    # Blur solutions for free users
+    if not is_premium:
+        for item in rights + wrongs:
+            if "solution" in item:
+                item["solution"] = "🔒 Upgrade to premium to see solutions!"
+    
+    # Add premium teaser if free user
+    if not is_premium and len(all_rights) > 3:
+        wrongs.append({
+            "title": "More insights available",
+            "amount": 0,
+            "description": "🔒 Upgrade to premium to see all 5 rights and wrongs with detailed solutions!",
+            "solution": None
+        })
+    
+    with stage_timer(endpoint, "validation", "feedback", "none"):
+        feedback_response = FeedbackResponse(
             month=request.month,
             total_expenses=total_expenses,
             rights=rights,
@@ -692,14 +2077,166 @@ Focus on Nepal-specific context. Be encouraging but honest. All text in English
             suggestions=analysis_data.get("suggestions", [])[:3] if not is_premium else analysis_data.get("suggestions", []),
             is_premium=is_premium
         )
+    if not from_cache:
+        await response_cache.set(cache_key, analysis_data, "feedback")
+    return feedback_response, stale
+
+def feedback_http_error(exc: Exception) -> HTTPException:
+    """Map a feedback generation failure to the HTTP error /api/v1/feedback returns"""
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, (LLMQueueFullError, LLMUnavailableError)):
+        return llm_busy_error(exc)
+    if isinstance(exc, LLMTimeoutError):
+        return HTTPException(status_code=504, detail=str(exc))
+    print(f"Feedback Error: {exc}")
+    import traceback
+    traceback.print_exc()
+    return HTTPException(status_code=500, detail=f"Error generating feedback: {str(exc)}")
+
+async def generate_feedback(request: FeedbackRequest) -> Response:
+    """Body of /api/v1/feedback, instrumented per stage"""
+    try:
+        request = await with_previous_month(request, "feedback")
+        
+        # Shares, deviations from the local reference budget and the
+        # rights/wrongs with their amounts are computed here; the model only
+        # writes the text
+        with stage_timer("feedback", "expense_analysis", "feedback", "none"):
+            analysis = analyze_expenses(
+                request.expenses, request.location, request.previous_expenses, request.monthly_income_npr
+            )
+        feedback_response, stale = await answer_feedback(request, analysis, "feedback")
+        return json_response(feedback_response, "feedback", "feedback", "none", degraded=stale)
+    except Exception as e:
+        raise feedback_http_error(e)
+
+@app.post("/api/v1/feedback/batch", response_model=BatchFeedbackResponse)
+async def batch_feedback(requests: List[FeedbackRequest]):
+    """
+    Feedback for many users in one call. Every user's expenses are scored
+    together in one (users x groups) pass, the text is written
+    ADVICE_BATCH_CONCURRENCY requests at a time, and a failed request is
+    reported in its own item instead of failing the batch.
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+    if len(requests) > ADVICE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has {len(requests)} requests; the limit is {ADVICE_BATCH_MAX_ITEMS}"
+        )
+    
+    with observe_request("feedback_batch", "feedback", "none"):
+        requests = list(await asyncio.gather(*(with_previous_month(request, "feedback_batch") for request in requests)))
+        with stage_timer("feedback_batch", "expense_analysis", "feedback", "none"):
+            analyses = analyze_expenses_many(
+                [request.expenses for request in requests],
+                [request.location for request in requests],
+                [request.previous_expenses for request in requests],
+                [request.monthly_income_npr for request in requests],
+            )
+        
+        semaphore = asyncio.Semaphore(ADVICE_BATCH_CONCURRENCY)
+        
+        async def item(index: int) -> BatchFeedbackItem:
+            try:
+                async with semaphore:
+                    result, _ = await answer_feedback(requests[index], analyses[index], "feedback_batch")
+                return BatchFeedbackItem(index=index, status=200, result=result)
+            except Exception as e:
+                error = feedback_http_error(e)
+                return BatchFeedbackItem(index=index, status=error.status_code, error=str(error.detail))
+        
+        results = await asyncio.gather(*(item(i) for i in range(len(requests))))
+        succeeded = sum(1 for result in results if result.status == 200)
+        return BatchFeedbackResponse(
+            results=results,
+            total=len(requests),
+            succeeded=succeeded,
+            failed=len(requests) - succeeded,
+        )
+
+@app.post("/api/v1/query", response_model=QueryResponse)
+async def query_documents(request: QueryRequest):
+    """Semantic search over a user's uploaded documents"""
+    try:
+        # Keyword-only search needs no embedding call
+        query_vector = None
+        if request.mode != "keyword":
+            query_vector = (await embedder.embed([request.query]))[0]
+        hits = await asyncio.to_thread(
+            vector_store.search,
+            request.user_id,
+            query_vector,
+            request.top_k,
+            request.query,
+            request.mode,
+            embedder.name,
+        )
+        results = [QueryResult(**hit) for hit in hits]
+        return QueryResponse(
+            user_id=request.user_id,
+            query=request.query,
+            results=results,
+            total_results=len(results)
+        )
+    except (LLMQueueFullError, LLMUnavailableError) as e:
+        raise llm_busy_error(e)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except IndexMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Query Error: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error querying documents: {str(e)}")
+
+@app.post("/api/v1/documents", response_model=IngestResponse)
+async def upload_document(
+    request: Request,
+    user_id: str = Query(..., description="Owner of the document"),
+    filename: str = Query("document.pdf", description="Original file name, stored in chunk metadata"),
+):
+    """
+    Ingest a PDF sent as the raw request body (Content-Type: application/pdf)
+    into the user's index for /api/v1/query
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        # Spool the upload to disk so large statements never sit in memory
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            async for part in request.stream():
+                size += len(part)
+                if size > INGEST_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"PDF is larger than {INGEST_MAX_BYTES} bytes")
+                digest.update(part)
+                f.write(part)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Request body is empty. Send the PDF bytes as the body.")
         
+        stats = await ingest_pdf(path, user_id, filename, embedder, vector_store, doc_hash=digest.hexdigest())
+        return IngestResponse(user_id=user_id, **stats)
     except HTTPException:
         raise
+    except InvalidDocumentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IndexMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except (LLMQueueFullError, LLMUnavailableError) as e:
+        raise llm_busy_error(e)
+    except LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        print(f"Feedback Error: {e}")
+        print(f"Ingest Error: {e}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error generating feedback: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error ingesting document: {str(e)}")
+    finally:
+        os.remove(path)
 
 if __name__ == "__main__":
     import uvicorn
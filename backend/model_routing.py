@@ -0,0 +1,187 @@
+"""
+Model routing: which Gemini model, output limit and prompt budget a request gets.
+
+Routes are looked up by ``"<category>:<mode>"`` with ``*`` wildcards, most
+specific first (``buy:simple``, ``buy:*``, ``*:simple``, ``*:*``); feedback
+uses category ``feedback`` and mode ``none``. The built-in table can be
+overridden entry by entry with LLM_ROUTES, e.g.
+
+    LLM_ROUTES='{"*:simple": {"model": "gemini-2.5-flash-lite", "max_output_tokens": 1024}}'
+
+so simple-mode traffic can move to a faster, cheaper model without a code
+change. Gemini 2.5 models count their thinking tokens against
+``max_output_tokens``, which is why the defaults leave room well beyond the
+~100/300 words the prompts ask for.
+
+Prompts are measured with ``estimate_tokens`` (no tokenizer call) before
+they are sent; ``ModelRouter.record`` keeps calls, latency, tokens,
+truncated replies, the share of input tokens read from Gemini's context
+cache and an estimated USD cost per route, priced from
+MODEL_PRICES (LLM_MODEL_PRICES overrides it).
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+
+# USD per 1M tokens (input, output), Gemini API paid tier. Cached input is
+# billed at CACHED_INPUT_DISCOUNT of the input price; thinking tokens as output.
+MODEL_PRICES: Dict[str, tuple] = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+}
+CACHED_INPUT_DISCOUNT = 0.25
+
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "*:simple": {"model": "gemini-2.5-flash", "max_output_tokens": 2048},
+    "*:indepth": {"model": "gemini-2.5-flash", "max_output_tokens": 4096},
+    "feedback:*": {"model": "gemini-2.5-flash", "max_output_tokens": 4096},
+    "*:*": {"model": "gemini-2.5-flash", "max_output_tokens": 4096},
+}
+
+
+class Route:
+    """One row of the routing table"""
+
+    __slots__ = ("name", "model", "max_output_tokens", "max_prompt_tokens")
+
+    def __init__(self, name: str, model: str, max_output_tokens: Optional[int], max_prompt_tokens: Optional[int]):
+        self.name = name
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+
+    def config_kwargs(self) -> Dict[str, Any]:
+        """Extra GenerateContentConfig fields for this route"""
+        return {"max_output_tokens": self.max_output_tokens} if self.max_output_tokens else {}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough prompt size: ~4 ASCII characters per token, and one token per
+    other character (Devanagari and emoji tokenize far worse than English)
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
+
+
+def output_tokens(usage: Any) -> int:
+    """Billed output tokens: everything after the prompt, thinking tokens included"""
+    prompt = usage.prompt_token_count or 0
+    return max((usage.total_token_count or 0) - prompt, usage.candidates_token_count or 0)
+
+
+def usage_cost(model: str, usage: Any, prices: Dict[str, tuple]) -> float:
+    """Estimated USD cost of one response's usage_metadata (0 for unpriced models)"""
+    price = prices.get(model)
+    if price is None or usage is None:
+        return 0.0
+    prompt = usage.prompt_token_count or 0
+    cached = usage.cached_content_token_count or 0
+    input_price, output_price = price
+    return (
+        (prompt - cached) * input_price
+        + cached * input_price * CACHED_INPUT_DISCOUNT
+        + output_tokens(usage) * output_price
+    ) / 1_000_000
+
+
+class ModelRouter:
+    """Routing table plus per-route latency, token and cost counters"""
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_prompt_tokens: Optional[int] = 4000,
+        prices: Optional[Dict[str, tuple]] = None,
+    ):
+        self.prices = dict(MODEL_PRICES if prices is None else prices)
+        self.routes: Dict[str, Route] = {}
+        for name, spec in {**DEFAULT_ROUTES, **(routes or {})}.items():
+            self.routes[name] = Route(
+                name,
+                spec["model"],
+                spec.get("max_output_tokens"),
+                spec.get("max_prompt_tokens", max_prompt_tokens),
+            )
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def route(self, category: str, mode: str) -> Route:
+        """Most specific route for a category and mode"""
+        for name in (f"{category}:{mode}", f"{category}:*", f"*:{mode}", "*:*"):
+            route = self.routes.get(name)
+            if route is not None:
+                return route
+        raise KeyError(f"No route for {category}:{mode}")
+
+    def over_budget(self, route: Route, prompt: str) -> Optional[int]:
+        """The prompt's estimated token count if it exceeds the route's budget, else None"""
+        if not route.max_prompt_tokens:
+            return None
+        tokens = estimate_tokens(prompt)
+        return tokens if tokens > route.max_prompt_tokens else None
+
+    def record(
+        self, route: Route, seconds: float, usage: Any = None, truncated: bool = False, failed: bool = False
+    ) -> None:
+        """Count one Gemini call made for ``route``"""
+        stats = self._stats.get(route.name)
+        if stats is None or stats["model"] != route.model:
+            stats = self._stats[route.name] = {
+                "model": route.model, "calls": 0, "failures": 0, "truncated": 0, "seconds": 0.0,
+                "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+            }
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        if failed:
+            stats["failures"] += 1
+        if truncated:
+            stats["truncated"] += 1
+        if usage is not None:
+            stats["input_tokens"] += usage.prompt_token_count or 0
+            stats["cached_input_tokens"] += usage.cached_content_token_count or 0
+            stats["output_tokens"] += output_tokens(usage)
+            stats["cost_usd"] += usage_cost(route.model, usage, self.prices)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": {
+                name: {
+                    "model": route.model,
+                    "max_output_tokens": route.max_output_tokens,
+                    "max_prompt_tokens": route.max_prompt_tokens,
+                }
+                for name, route in self.routes.items()
+            },
+            "usage": {
+                name: {
+                    **stats,
+                    "seconds": round(stats["seconds"], 3),
+                    "avg_seconds": round(stats["seconds"] / stats["calls"], 3) if stats["calls"] else 0.0,
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "cached_input_ratio": (
+                        round(stats["cached_input_tokens"] / stats["input_tokens"], 4) if stats["input_tokens"] else 0.0
+                    ),
+                }
+                for name, stats in self._stats.items()
+            },
+        }
+
+
+def router_from_env() -> ModelRouter:
+    """
+    LLM_ROUTES (JSON, merged over DEFAULT_ROUTES), LLM_MAX_PROMPT_TOKENS
+    (default prompt budget, 0 disables), LLM_MODEL_PRICES (JSON of
+    {"model": [input, output]} USD per 1M tokens, merged over MODEL_PRICES)
+    """
+    routes = json.loads(os.getenv("LLM_ROUTES", "") or "{}")
+    prices = {**MODEL_PRICES, **{
+        model: tuple(price) for model, price in json.loads(os.getenv("LLM_MODEL_PRICES", "") or "{}").items()
+    }}
+    return ModelRouter(
+        routes,
+        max_prompt_tokens=int(os.getenv("LLM_MAX_PROMPT_TOKENS", "4000")) or None,
+        prices=prices,
+    )
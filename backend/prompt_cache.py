@@ -0,0 +1,216 @@
+"""
+Gemini context caching for the static advice system instructions.
+
+Every advice call starts with its category's system instruction
+(ADVICE_INSTRUCTIONS in main.py: the category prompt, the guidelines shared
+by all categories and the compact response schema), sent apart from the
+per-request user context. It is registered once with Gemini as cached
+content (``client.aio.caches``): calls then reference the cache by name
+instead of resending the text, its tokens are billed at the cached input
+rate and Gemini does not process them again. Gemini reports them in
+``usage_metadata.cached_content_token_count``.
+
+Gemini refuses cached content below a minimum size (1,024 tokens on 2.5
+Flash, more on some models; ``min_tokens``), so the instructions are kept
+above it. A smaller text is never registered and always goes inline.
+
+A cache is created in the background on a prompt's first use (that call
+goes inline) or by ``warm`` at startup, one per model and category in each
+worker. ``run`` extends, shortly before they expire, the caches used since
+their last extension and lets unused ones lapse; a cache is never handed out
+within ``refresh_margin_seconds`` of its expiry. A failed creation is retried
+after ``retry_seconds``, and ``discard`` forgets a cache Gemini no longer
+knows about.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from model_routing import estimate_tokens
+
+
+class _Entry:
+    __slots__ = ("text", "cacheable", "name", "expires_at", "used", "retry_at", "task")
+
+    def __init__(self, text: str, cacheable: bool):
+        self.text = text
+        self.cacheable = cacheable
+        self.name: Optional[str] = None
+        self.expires_at = 0.0
+        self.used = False
+        self.retry_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+class PromptCache:
+    """Cached content per (model, key), falling back to the inline system instruction"""
+
+    def __init__(
+        self,
+        client: Any,
+        enabled: bool = True,
+        ttl_seconds: float = 3600,
+        refresh_margin_seconds: float = 300,
+        min_tokens: int = 1024,
+        retry_seconds: float = 900,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.client = client
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.min_tokens = min_tokens
+        self.retry_seconds = retry_seconds
+        self._clock = clock
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._counts = {
+            "cached_calls": 0, "inline_calls": 0, "created": 0, "extended": 0,
+            "expired": 0, "failed": 0, "discarded": 0,
+        }
+
+    def config_kwargs(self, model: str, key: str, system_instruction: str) -> Dict[str, Any]:
+        """
+        GenerateContentConfig arguments carrying ``system_instruction``: the
+        name of its live cache, else the text itself
+        """
+        name = self._live_name(model, key, system_instruction)
+        if name is None:
+            self._counts["inline_calls"] += 1
+            return {"system_instruction": system_instruction}
+        self._counts["cached_calls"] += 1
+        return {"cached_content": name}
+
+    def warm(self, prompts: Iterable[Tuple[str, str, str]]) -> None:
+        """Start registering (model, key, system_instruction) prompts ahead of their first call"""
+        for model, key, text in prompts:
+            self._live_name(model, key, text, use=False)
+
+    def _live_name(self, model: str, key: str, text: str, use: bool = True) -> Optional[str]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get((model, key))
+        if entry is None or entry.text != text:
+            # First use, or the prompt changed: the old cache is left to expire
+            entry = self._entries[(model, key)] = _Entry(text, estimate_tokens(text) >= self.min_tokens)
+        if not entry.cacheable:
+            return None
+        now = self._clock()
+        if entry.name is not None and entry.expires_at - now > self.refresh_margin_seconds:
+            entry.used = entry.used or use
+            return entry.name
+        if entry.name is not None and entry.expires_at <= now:
+            entry.name = None
+            self._counts["expired"] += 1
+        if entry.task is None and now >= entry.retry_at:
+            entry.task = asyncio.create_task(self._register(model, key, entry))
+        return None
+
+    async def _register(self, model: str, key: str, entry: _Entry) -> None:
+        """Create the entry's cache, or extend it if it still exists"""
+        started = self._clock()
+        ttl = f"{int(self.ttl_seconds)}s"
+        try:
+            if entry.name is not None:
+                await self.client.aio.caches.update(name=entry.name, config={"ttl": ttl})
+                self._counts["extended"] += 1
+            else:
+                cached = await self.client.aio.caches.create(
+                    model=model,
+                    config={"system_instruction": entry.text, "ttl": ttl, "display_name": f"paisa-{key}"},
+                )
+                entry.name = cached.name
+                self._counts["created"] += 1
+            entry.expires_at = started + self.ttl_seconds
+            entry.used = False
+        except Exception as e:
+            entry.name = None
+            entry.retry_at = self._clock() + self.retry_seconds
+            self._counts["failed"] += 1
+            print(f"Prompt cache for {model} {key} failed: {e}")
+        finally:
+            entry.task = None
+
+    async def refresh(self) -> None:
+        """Extend the caches used since their last extension that would otherwise stop being handed out before the next pass"""
+        now = self._clock()
+        horizon = self.refresh_margin_seconds + self.refresh_interval
+        tasks = []
+        for (model, key), entry in list(self._entries.items()):
+            if entry.name is None or entry.task is not None:
+                continue
+            if entry.expires_at <= now:
+                entry.name = None
+                self._counts["expired"] += 1
+            elif entry.used and entry.expires_at - now <= horizon:
+                entry.task = asyncio.create_task(self._register(model, key, entry))
+                tasks.append(entry.task)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    @property
+    def refresh_interval(self) -> float:
+        return max(1.0, self.refresh_margin_seconds / 2)
+
+    async def run(self) -> None:
+        """Refresh pass every ``refresh_interval`` seconds, until cancelled"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Prompt cache refresh failed: {e}")
+
+    def discard(self, model: str, key: str, exc: BaseException) -> bool:
+        """Forget the cache behind a call that failed because Gemini no longer has it"""
+        entry = self._entries.get((model, key))
+        if entry is None or entry.name is None:
+            return False
+        if "cachedcontent" not in str(exc).lower().replace(" ", "").replace("_", ""):
+            return False
+        entry.name = None
+        self._counts["discarded"] += 1
+        return True
+
+    async def close(self) -> None:
+        """Delete this worker's caches so they stop being billed for storage"""
+        for entry in self._entries.values():
+            if entry.name is None:
+                continue
+            try:
+                await self.client.aio.caches.delete(name=entry.name)
+            except Exception as e:
+                print(f"Prompt cache delete failed: {e}")
+            entry.name = None
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        calls = self._counts["cached_calls"] + self._counts["inline_calls"]
+        return {
+            "enabled": self.enabled,
+            "min_tokens": self.min_tokens,
+            "ttl_seconds": self.ttl_seconds,
+            "cached": {
+                f"{model}:{key}": round(entry.expires_at - now)
+                for (model, key), entry in self._entries.items() if entry.name is not None
+            },
+            "too_small": sorted({key for (_, key), entry in self._entries.items() if not entry.cacheable}),
+            **self._counts,
+            "cached_call_rate": round(self._counts["cached_calls"] / calls, 4) if calls else 0.0,
+        }
+
+
+def prompt_cache_from_env(client: Any) -> PromptCache:
+    """
+    PROMPT_CACHE_ENABLED, PROMPT_CACHE_TTL_SECONDS,
+    PROMPT_CACHE_REFRESH_MARGIN_SECONDS, PROMPT_CACHE_MIN_TOKENS,
+    PROMPT_CACHE_RETRY_SECONDS
+    """
+    return PromptCache(
+        client,
+        enabled=os.getenv("PROMPT_CACHE_ENABLED", "true").strip().lower() not in ("0", "false", "no"),
+        ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600")),
+        refresh_margin_seconds=float(os.getenv("PROMPT_CACHE_REFRESH_MARGIN_SECONDS", "300")),
+        min_tokens=int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024")),
+        retry_seconds=float(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "900")),
+    )
@@ -0,0 +1,163 @@
+"""
+Building blocks for calling a slow, occasionally failing upstream.
+
+- ``LatencyTracker``: rolling window of recent call latencies, for adaptive
+  timeouts and hedge delays taken from observed percentiles.
+- ``CircuitBreaker``: after ``failure_threshold`` consecutive failures, calls
+  fail fast for ``reset_seconds``; then one probe call at a time is let
+  through until one succeeds.
+- ``backoff_delay``: exponential backoff with full jitter between retries.
+- ``hedged``: start a second, identical attempt once the first has run
+  longer than a delay, and keep whichever succeeds first.
+
+The LLM pool combines them around each Gemini call (see ``llm_pool``).
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# HTTP status codes worth retrying: rate limited or upstream trouble
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Transient upstream failure (5xx/429, connection error) rather than a bad request"""
+    if isinstance(exc, (asyncio.TimeoutError, OSError)):
+        return True
+    return getattr(exc, "code", None) in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int, base_seconds: float = 0.5, max_seconds: float = 4.0) -> float:
+    """Seconds to sleep before retry number ``attempt`` (0-based), full jitter"""
+    return random.uniform(0.0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Observed latency at quantile ``q`` (0-1), or None until enough samples"""
+        if len(self._samples) < self.min_samples:
+            return None
+        return float(np.quantile(np.fromiter(self._samples, dtype=float), q))
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95, p99 = (self.quantile(q) for q in (0.5, 0.95, 0.99))
+        return {
+            "samples": len(self._samples),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "p99_seconds": round(p99, 3) if p99 is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._opens = 0
+        self._rejected = 0
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go upstream now. While not closed, one probe is
+        let through per ``reset_seconds``, so a probe whose outcome is never
+        recorded (e.g. cancelled) cannot wedge the breaker.
+        """
+        if self.state == self.CLOSED:
+            return True
+        now = self._clock()
+        if now - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self._opened_at = now
+            return True
+        self._rejected += 1
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed (0 when closed)"""
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(0.0, self.reset_seconds - (self._clock() - self._opened_at))
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self._failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self._opened_at = self._clock()
+            self._opens += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opens": self._opens,
+            "rejected": self._rejected,
+            "retry_after_seconds": round(self.retry_after(), 1),
+        }
+
+
+async def hedged(
+    factory: Callable[[], Awaitable[Any]],
+    delay: Optional[float],
+    should_hedge: Callable[[], bool] = lambda: True,
+) -> Tuple[Any, int]:
+    """
+    Await ``factory()``; if it is still running after ``delay`` seconds and
+    ``should_hedge()`` agrees, start a second attempt and return the first
+    successful result. Returns (result, index of the attempt that won). The
+    loser is cancelled; if both fail, the first attempt's error is raised.
+    """
+    attempts = [asyncio.ensure_future(factory())]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and should_hedge():
+                attempts.append(asyncio.ensure_future(factory()))
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), attempts.index(task)
+        return attempts[0].result(), 0  # raises the first attempt's error
+    finally:
+        for task in attempts:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark a losing attempt's error as retrieved
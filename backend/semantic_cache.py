@@ -0,0 +1,305 @@
+"""
+Semantic cache for advice: reuse an answer for a paraphrased question.
+
+The exact response cache only matches questions that normalize to the same
+text. This layer embeds ``AdviceRequest.message`` and, per category, keeps a
+small table of recent answers with their message vectors. An answer is
+reused when the new request is in the same profile bucket and its message
+is at least ``threshold`` cosine-similar to the cached one. Numbers that
+depend on the user (savings, months, progress) are recomputed locally by
+the caller, as for exact hits.
+
+The profile bucket holds what must match for an answer to be reusable:
+mode, location, income/savings/expenses in ~10% bands, the user's history
+context, and every number written in the message ("Pulsar 220" must not
+match "Pulsar 150"). Each category table holds at most ``max_entries``
+rows and evicts the least recently used; rows also expire with the
+response cache's TTL for the category. Candidate rows are picked only after
+the message is embedded, so an ``add`` that reuses a row while a lookup
+waits on the embedder cannot hand that lookup another bucket's answer.
+
+Off by default: with the Gemini embedder every lookup that has candidates
+costs one embedding call (reused by the ``add`` after a miss).
+
+False hits are sampled: with probability ``audit_rate`` a hit is also
+answered by the LLM in the background and compared with the cached answer
+(``record_audit``); a mismatch evicts the row and is kept in ``stats()``.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from advice_cache import normalize_message
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+# Width of an income/savings/expense band (log scale): 10%
+_BAND_RATIO = 1.1
+
+# Relative difference in target_amount_npr above which an audited hit counts as false
+FALSE_HIT_TOLERANCE = 0.15
+
+
+def _band(value: Optional[float]) -> int:
+    if not value or value <= 0:
+        return 0
+    return int(round(math.log(float(value)) / math.log(_BAND_RATIO)))
+
+
+def message_numbers(message: str) -> List[str]:
+    """Numbers written in the message, normalized ("1,50,000" -> "150000")"""
+    return sorted({match.replace(",", "") for match in _NUMBER_RE.findall(message or "")})
+
+
+def profile_bucket(request: Any, past_context: str = "") -> str:
+    """Everything except the message wording that must match for a reuse"""
+    raw = json.dumps({
+        "mode": request.mode,
+        "location": (request.location or "").strip().lower(),
+        "income": _band(request.monthly_income_npr),
+        "savings": _band(request.current_savings_npr),
+        "expenses": _band(sum(request.monthly_expenses_npr.values())),
+        "extra_profile": request.extra_profile or {},
+        "past_context": past_context,
+        "numbers": message_numbers(request.message),
+    }, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class SemanticHit:
+    """A reusable cached answer and why it matched"""
+
+    __slots__ = ("value", "similarity", "category", "row", "generation", "matched_message")
+
+    def __init__(
+        self, value: Dict[str, Any], similarity: float, category: str, row: int, generation: int, matched_message: str
+    ):
+        self.value = value
+        self.similarity = similarity
+        self.category = category
+        self.row = row
+        self.generation = generation
+        self.matched_message = matched_message
+
+
+class _CategoryTable:
+    """Fixed-capacity vector table for one category"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.vectors: Optional[np.ndarray] = None  # allocated on first add (dim known then)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)
+        # Bumped on every write, so a hit can tell whether its row was reused since
+        self.generations = np.zeros(capacity, dtype=np.int64)
+        self.buckets: List[Optional[str]] = [None] * capacity
+        self.messages: List[str] = [""] * capacity
+        self.values: List[Optional[str]] = [None] * capacity
+
+    def free_row(self) -> Tuple[int, bool]:
+        """(row to write, whether a live row is evicted)"""
+        free = np.flatnonzero(~self.used)
+        if free.size:
+            return int(free[0]), False
+        return int(np.argmin(self.last_used)), True
+
+    def live_rows(self, bucket: str, now: float) -> Tuple[List[int], int]:
+        """(unexpired rows of ``bucket``, number of expired rows cleared)"""
+        live, expired = [], 0
+        for row in np.flatnonzero(self.used):
+            if self.buckets[row] != bucket:
+                continue
+            if self.expires_at[row] <= now:
+                self.clear_row(row)
+                expired += 1
+            else:
+                live.append(int(row))
+        return live, expired
+
+    def clear_row(self, row: int) -> None:
+        self.used[row] = False
+        self.buckets[row] = None
+        self.values[row] = None
+        self.messages[row] = ""
+
+
+class SemanticCache:
+    """Per-category nearest-neighbour cache of advice answers"""
+
+    def __init__(
+        self,
+        embedder: Any,
+        threshold: float = 0.9,
+        max_entries: int = 512,
+        ttl_for: Callable[[str], int] = lambda category: 3600,
+        audit_rate: float = 0.02,
+        memo_size: int = 2048,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_for = ttl_for
+        self.audit_rate = audit_rate
+        self._clock = clock
+        self._tables: Dict[str, _CategoryTable] = {}
+        self._tick = 0
+        # Message vectors, so the add after a miss does not embed again
+        self._memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memo_size = memo_size
+        self._lookups = 0
+        self._hits = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._embed_calls = 0
+        self._embed_seconds = 0.0
+        self._audits = 0
+        self._false_hits = 0
+        self._false_hit_samples: deque = deque(maxlen=20)
+
+    async def _vector(self, message: str) -> np.ndarray:
+        key = normalize_message(message)
+        vector = self._memo.get(key)
+        if vector is not None:
+            self._memo.move_to_end(key)
+            return vector
+        started = time.perf_counter()
+        vector = (await self.embedder.embed([key]))[0]
+        self._embed_calls += 1
+        self._embed_seconds += time.perf_counter() - started
+        self._memo[key] = vector
+        if len(self._memo) > self._memo_size:
+            self._memo.popitem(last=False)
+        return vector
+
+    def _table(self, category: str) -> _CategoryTable:
+        table = self._tables.get(category)
+        if table is None:
+            table = self._tables[category] = _CategoryTable(self.max_entries)
+        return table
+
+    async def lookup(self, request: Any, past_context: str = "") -> Optional[SemanticHit]:
+        """Closest cached answer in the same category and profile bucket, if similar enough"""
+        table = self._tables.get(request.category)
+        self._lookups += 1
+        if table is None or table.vectors is None or not table.used.any():
+            return None
+        bucket = profile_bucket(request, past_context)
+        live, expired = table.live_rows(bucket, self._clock())
+        self._expirations += expired
+        if not live:
+            return None  # nothing to compare with, so no embedding call
+        vector = await self._vector(request.message)
+        # Rows may have been evicted and rewritten while embedding: pick them again,
+        # with no await between here and reading the row
+        live, expired = table.live_rows(bucket, self._clock())
+        self._expirations += expired
+        if not live or table.vectors is None or vector.shape[0] != table.vectors.shape[1]:
+            return None  # embedder changed; the table refills under the new one
+        similarities = table.vectors[live] @ vector
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.threshold:
+            return None
+        row = int(live[best])
+        self._tick += 1
+        table.last_used[row] = self._tick
+        self._hits += 1
+        return SemanticHit(
+            json.loads(table.values[row]), similarity, request.category, row, int(table.generations[row]), table.messages[row]
+        )
+
+    async def add(self, request: Any, value: Dict[str, Any], past_context: str = "") -> None:
+        """Remember a fresh answer for later paraphrases"""
+        ttl = self.ttl_for(request.category)
+        if ttl <= 0:
+            return
+        vector = await self._vector(request.message)
+        table = self._table(request.category)
+        if table.vectors is None or table.vectors.shape[1] != vector.shape[0]:
+            table.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            table.used[:] = False
+        row, evicted = table.free_row()
+        if evicted:
+            self._evictions += 1
+        self._tick += 1
+        table.vectors[row] = vector
+        table.generations[row] += 1
+        table.used[row] = True
+        table.last_used[row] = self._tick
+        table.expires_at[row] = self._clock() + ttl
+        table.buckets[row] = profile_bucket(request, past_context)
+        table.messages[row] = request.message[:200]
+        table.values[row] = json.dumps(value, ensure_ascii=False, default=str)
+
+    def should_audit(self) -> bool:
+        return self.audit_rate > 0 and random.random() < self.audit_rate
+
+    def record_audit(self, hit: SemanticHit, message: str, fresh: Dict[str, Any]) -> bool:
+        """
+        Compare a sampled hit with a fresh LLM answer for the same request.
+        Returns False (and evicts the row) when the two disagree on the target amount.
+        """
+        self._audits += 1
+        cached_target = float(hit.value.get("target_amount_npr") or 0)
+        fresh_target = float(fresh.get("target_amount_npr") or 0)
+        scale = max(cached_target, fresh_target)
+        if scale <= 0 or abs(cached_target - fresh_target) / scale <= FALSE_HIT_TOLERANCE:
+            return True
+        self._false_hits += 1
+        self._false_hit_samples.append({
+            "category": hit.category,
+            "message": message[:200],
+            "matched_message": hit.matched_message,
+            "similarity": round(hit.similarity, 4),
+            "cached_target_npr": cached_target,
+            "fresh_target_npr": fresh_target,
+        })
+        table = self._tables.get(hit.category)
+        if table is not None and table.used[hit.row] and table.generations[hit.row] == hit.generation:
+            table.clear_row(hit.row)
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embedder": getattr(self.embedder, "name", type(self.embedder).__name__),
+            "threshold": self.threshold,
+            "entries": {category: int(table.used.sum()) for category, table in self._tables.items()},
+            "max_entries_per_category": self.max_entries,
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "hit_rate": round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "embed_calls": self._embed_calls,
+            "avg_embed_ms": round(self._embed_seconds / self._embed_calls * 1000, 2) if self._embed_calls else 0.0,
+            "audits": self._audits,
+            "false_hits": self._false_hits,
+            "false_hit_rate": round(self._false_hits / self._audits, 4) if self._audits else 0.0,
+            "false_hit_samples": list(self._false_hit_samples),
+        }
+
+
+def semantic_cache_from_env(embedder: Any, ttl_for: Callable[[str], int]) -> Optional[SemanticCache]:
+    """
+    SEMANTIC_CACHE_ENABLED (default off), SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES (per category), SEMANTIC_CACHE_AUDIT_RATE
+    """
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "false").strip().lower() in ("0", "false", "no"):
+        return None
+    return SemanticCache(
+        embedder,
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512")),
+        ttl_for=ttl_for,
+        audit_rate=float(os.getenv("SEMANTIC_CACHE_AUDIT_RATE", "0.02")),
+    )
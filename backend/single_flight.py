@@ -0,0 +1,82 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+While a call for a key is running, later callers with the same key wait on
+that call instead of starting their own, and all of them get its result (or
+its exception). Nothing is kept once the call finishes, so this is not a
+cache: a request that arrives after the call completed starts a new one.
+
+Cancellation is per caller: a caller that goes away stops waiting, but the
+shared call keeps running for the others and is only cancelled when its last
+caller has left.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+
+def prompt_fingerprint(model: str, contents: Any, config: Any = None) -> str:
+    """Stable key for one upstream generate call"""
+    if hasattr(config, "model_dump_json"):
+        config_key = config.model_dump_json(exclude_none=True)
+    else:
+        config_key = repr(config)
+    payload = json.dumps([model, contents, config_key], sort_keys=True, default=repr, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._started = 0
+        self._coalesced = 0
+        self._abandoned = 0
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark the exception as retrieved when every caller left before it finished
+        if not call.task.cancelled():
+            call.task.exception()
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await ``factory()``, or the already running call for ``key``"""
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            self._started += 1
+        else:
+            self._coalesced += 1
+        call.waiters += 1
+        try:
+            # shield: cancelling one caller must not cancel the shared call
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._abandoned += 1
+                call.task.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of coalescing counters"""
+        return {
+            "in_flight_keys": len(self._calls),
+            "upstream_calls": self._started,
+            "coalesced_calls": self._coalesced,
+            "abandoned_calls": self._abandoned,
+        }
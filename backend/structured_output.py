@@ -0,0 +1,373 @@
+"""
+Schema-constrained JSON generation and the shared parse/coerce path.
+
+Gemini is asked for ``application/json`` with a response schema derived from
+the public Pydantic models, so a normal reply is bare JSON of the right
+shape. Every reply, streamed or not, then goes through the same steps:
+
+1. ``json.loads`` of the whole reply (the normal case)
+2. the tolerant extractor for fenced / chatty replies
+3. local repair of truncated output (open string, brackets, trailing comma)
+4. one targeted upstream repair: only the broken text, the parse error and
+   the schema are sent to a small model, instead of re-running the prompt
+
+The parsed object is coerced to the schema's types (e.g. "15,000" or 15000.4
+for an integer field) so callers see one consistent shape.
+"""
+import json
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from json_stream import extract_json_object
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+PARSE_STAGES = ("json", "extracted", "local_repair", "upstream_repair", "failed")
+
+REPAIR_PROMPT = """The text below was meant to be one JSON object matching the given schema, but it is invalid: {error}
+
+Return only the corrected JSON object. Keep every value that is present; do not add commentary.
+
+Schema:
+{schema}
+
+Text:
+{text}"""
+
+
+# -- schema ---------------------------------------------------------------------
+
+def _convert(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One Pydantic JSON-schema node as a Gemini Schema dict. The Gemini API
+    (API-key client) accepts only type, description, enum, format, items,
+    properties and required, so Optional[X] becomes X left out of required.
+    """
+    if "$ref" in node:
+        return _convert(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+    if "anyOf" in node:
+        options = [option for option in node["anyOf"] if option.get("type") != "null"]
+        if len(options) != 1:
+            raise ValueError("Union types cannot be used in a response schema")
+        return _convert(options[0], defs)
+
+    schema_type = node.get("type")
+    if schema_type is None and "enum" in node:
+        schema_type = "string"
+    converted: Dict[str, Any] = {"type": schema_type.upper()}
+    if node.get("description"):
+        converted["description"] = node["description"]
+    if "enum" in node:
+        converted["enum"] = [str(value) for value in node["enum"]]
+    if schema_type == "array":
+        converted["items"] = _convert(node.get("items", {"type": "string"}), defs)
+    elif schema_type == "object":
+        properties = node.get("properties")
+        if not properties:
+            raise ValueError("Free-form objects (Dict[str, Any]) cannot be used in a response schema")
+        converted["properties"] = {name: _convert(value, defs) for name, value in properties.items()}
+        converted["required"] = list(node.get("required", []))
+    return converted
+
+
+def _drop_path(schema: Dict[str, Any], path: str) -> None:
+    """Remove a dotted property path (arrays are stepped through)"""
+    head, _, rest = path.partition(".")
+    node = schema
+    while node.get("type") == "ARRAY":
+        node = node["items"]
+    properties = node.get("properties", {})
+    if head not in properties:
+        return
+    if rest:
+        _drop_path(properties[head], rest)
+        return
+    del properties[head]
+    node["required"] = [name for name in node.get("required", []) if name != head]
+
+
+def gemini_schema(model: Type[BaseModel], exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Gemini response schema for a Pydantic model, minus ``exclude`` (dotted
+    paths such as ``"alternatives.months_needed"``). Excluded fields are the
+    ones the server fills in itself.
+    """
+    json_schema = model.model_json_schema()
+    defs = json_schema.get("$defs", {})
+    exclude = list(exclude)
+    top_level = {path for path in exclude if "." not in path}
+    pruned = dict(json_schema)
+    pruned["properties"] = {k: v for k, v in json_schema["properties"].items() if k not in top_level}
+    pruned["required"] = [k for k in json_schema.get("required", []) if k not in top_level]
+    schema = _convert(pruned, defs)
+    for path in exclude:
+        if "." in path:
+            _drop_path(schema, path)
+    return schema
+
+
+# -- parse and coerce -----------------------------------------------------------
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value.replace(",", ""))
+        if match:
+            return float(match.group())
+    return None
+
+
+def coerce_to_schema(value: Any, schema: Dict[str, Any]) -> Any:
+    """Coerce parsed JSON to the schema's types; values that cannot be coerced are left for validation"""
+    if value is None:
+        return None
+    schema_type = schema.get("type")
+    if schema_type == "OBJECT" and isinstance(value, dict):
+        properties = schema.get("properties", {})
+        return {
+            key: coerce_to_schema(item, properties[key]) if key in properties else item
+            for key, item in value.items()
+        }
+    if schema_type == "ARRAY":
+        if not isinstance(value, list):
+            value = [value]
+        return [coerce_to_schema(item, schema["items"]) for item in value]
+    if schema_type in ("INTEGER", "NUMBER"):
+        number = _to_number(value)
+        if number is None:
+            return value
+        return int(round(number)) if schema_type == "INTEGER" else number
+    if schema_type == "STRING" and not isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+    return value
+
+
+def drop_incomplete_items(value: Any, schema: Dict[str, Any]) -> Any:
+    """Remove array elements missing required fields (the cut-off tail of a repaired reply)"""
+    schema_type = schema.get("type")
+    if schema_type == "OBJECT" and isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for key in list(value):
+            if key in properties:
+                value[key] = drop_incomplete_items(value[key], properties[key])
+    elif schema_type == "ARRAY" and isinstance(value, list):
+        items = schema.get("items", {})
+        value = [drop_incomplete_items(item, items) for item in value]
+        if items.get("type") == "OBJECT":
+            value = [item for item in value if not isinstance(item, dict) or not missing_required(item, items)]
+    return value
+
+
+def missing_required(data: Dict[str, Any], schema: Dict[str, Any]) -> List[str]:
+    """Required fields of an object schema absent from ``data``"""
+    return [name for name in schema.get("required", []) if data.get(name) is None]
+
+
+def _close(text: str, stack: List[str]) -> Optional[Dict[str, Any]]:
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += " null"
+    try:
+        data = json.loads(text + "".join(reversed(stack)))
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def close_truncated_json(text: str, max_backoff: int = 3) -> Optional[Dict[str, Any]]:
+    """
+    Parse a JSON object that was cut off (e.g. at the output token limit) by
+    closing its open string and brackets. If the cut left a dangling key or
+    partial value, back off to one of the last ``max_backoff`` commas and
+    drop the incomplete member. None when that does not help.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+    stack: List[str] = []
+    commas: List[Tuple[int, List[str]]] = []
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                return None
+            stack.pop()
+            if not stack:
+                return None  # the object did close, so truncation is not the problem
+        elif char == ",":
+            commas.append((i, list(stack)))
+    if escaped:
+        text = text[:-1]
+    data = _close(text + '"' if in_string else text, stack)
+    for position, comma_stack in reversed(commas[-max_backoff:]):
+        if data is not None:
+            break
+        data = _close(text[:position], comma_stack)
+    return data
+
+
+class UnparseableOutputError(json.JSONDecodeError):
+    """Model output that could not be parsed or repaired into a JSON object"""
+
+    def __init__(self, message: str, doc: str):
+        ValueError.__init__(self, message)
+        self.msg = message
+        self.doc = doc
+        self.pos = self.lineno = self.colno = 0
+
+
+def parse_locally(text: str) -> Tuple[Optional[Dict[str, Any]], str, str]:
+    """(object or None, stage, error) using only the local steps"""
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, "json", ""
+    except (json.JSONDecodeError, TypeError):
+        pass
+    try:
+        return extract_json_object(text or ""), "extracted", ""
+    except json.JSONDecodeError as e:
+        error = str(e)
+    repaired = close_truncated_json(text or "")
+    if repaired is not None:
+        return repaired, "local_repair", ""
+    return None, "failed", error
+
+
+# -- generation -----------------------------------------------------------------
+
+class StructuredGenerator:
+    """Response schema configs, the shared parse path and its metrics"""
+
+    def __init__(
+        self,
+        pool: Any,
+        repair_model: str = "gemini-2.5-flash-lite",
+        repair_enabled: bool = True,
+        repair_max_output_tokens: int = 4096,
+    ):
+        self.pool = pool
+        self.repair_model = repair_model
+        self.repair_enabled = repair_enabled
+        self.repair_max_output_tokens = repair_max_output_tokens
+        self._stages = {stage: 0 for stage in PARSE_STAGES}
+        self._missing_fields = 0
+        self._repair_calls = 0
+        self._repair_prompt_tokens = 0
+        self._repair_output_tokens = 0
+        self._repair_seconds = 0.0
+
+    @staticmethod
+    def config(schema: Dict[str, Any], **kwargs: Any) -> "types.GenerateContentConfig":
+        """GenerateContentConfig asking for JSON that matches ``schema``"""
+        # Imported here: google.genai is slow to import and only needed once
+        # a Gemini call is actually made
+        from google.genai import types
+
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=schema,
+            **kwargs,
+        )
+
+    async def parse(self, text: Optional[str], schema: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Parse a reply through the local steps, then one upstream repair if
+        needed. Raises UnparseableOutputError (a json.JSONDecodeError) when the
+        reply cannot be recovered.
+        """
+        text = text or ""
+        data, stage, error = parse_locally(text)
+        if stage == "local_repair":
+            data = drop_incomplete_items(data, schema)
+        if data is not None:
+            missing = missing_required(data, schema)
+            if missing:
+                self._missing_fields += 1
+                data, error = None, f"missing required fields: {', '.join(missing)}"
+        if data is None and self.repair_enabled:
+            data, error = await self._repair(text, schema, error)
+            stage = "upstream_repair"
+        if data is None:
+            self._stages["failed"] += 1
+            print(f"Unparseable LLM output ({error}): {text[:500]}")
+            raise UnparseableOutputError(error or "No JSON object in model output", text)
+        self._stages[stage] += 1
+        return coerce_to_schema(data, schema)
+
+    async def _repair(self, text: str, schema: Dict[str, Any], error: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        self._repair_calls += 1
+        started = time.perf_counter()
+        try:
+            response = await self.pool.generate_content(
+                model=self.repair_model,
+                contents=REPAIR_PROMPT.format(error=error, schema=json.dumps(schema), text=text),
+                config=self.config(schema, max_output_tokens=self.repair_max_output_tokens),
+            )
+        except Exception as e:
+            # A timeout, open breaker or 429 on the repair leaves the reply
+            # unparseable, not the request failed for another reason
+            return None, f"{error}; repair call failed: {type(e).__name__}: {e}"
+        finally:
+            self._repair_seconds += time.perf_counter() - started
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            self._repair_prompt_tokens += usage.prompt_token_count or 0
+            self._repair_output_tokens += usage.candidates_token_count or 0
+        data, _, repair_error = parse_locally(response.text or "")
+        if data is None:
+            return None, f"{error}; repair failed: {repair_error}"
+        missing = missing_required(data, schema)
+        if missing:
+            return None, f"repair is missing required fields: {', '.join(missing)}"
+        return data, ""
+
+    def stats(self) -> Dict[str, Any]:
+        """Parse outcomes by stage, failure rate and what repairs cost"""
+        total = sum(self._stages.values())
+        # Replies that were not valid JSON as sent (fenced but intact output is not a failure)
+        failures = self._stages["local_repair"] + self._stages["upstream_repair"] + self._stages["failed"]
+        return {
+            "parses": total,
+            "stages": dict(self._stages),
+            "parse_failure_rate": round(failures / total, 4) if total else 0.0,
+            "missing_required_fields": self._missing_fields,
+            "repair_calls": self._repair_calls,
+            "repair_prompt_tokens": self._repair_prompt_tokens,
+            "repair_output_tokens": self._repair_output_tokens,
+            "repair_seconds": round(self._repair_seconds, 3),
+        }
+
+
+def structured_from_env(pool: Any) -> StructuredGenerator:
+    """LLM_REPAIR_MODEL / LLM_REPAIR_ENABLED / LLM_REPAIR_MAX_OUTPUT_TOKENS"""
+    return StructuredGenerator(
+        pool,
+        repair_model=os.getenv("LLM_REPAIR_MODEL", "gemini-2.5-flash-lite"),
+        repair_enabled=os.getenv("LLM_REPAIR_ENABLED", "true").strip().lower() not in ("0", "false", "no"),
+        repair_max_output_tokens=int(os.getenv("LLM_REPAIR_MAX_OUTPUT_TOKENS", "4096")),
+    )
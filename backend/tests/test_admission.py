@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import PRIORITY_HIGH, PRIORITY_LOW, AdmissionController, AdmissionRejected, admission_from_env
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_off_by_default(monkeypatch):
+    monkeypatch.delenv("ADMISSION_ENABLED", raising=False)
+    assert admission_from_env() is None
+    monkeypatch.setenv("ADMISSION_ENABLED", "true")
+    assert admission_from_env().user_burst == 50
+
+
+def test_user_bucket_rejects_past_burst():
+    async def run():
+        clock = _Clock()
+        controller = AdmissionController(user_rate=1, user_burst=3, clock=clock)
+        for _ in range(3):
+            controller.release(await controller.acquire("user:a"))
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("user:a")
+        assert rejected.value.status == 429
+        # Other users have their own bucket
+        controller.release(await controller.acquire("user:b"))
+        clock.now += 1
+        controller.release(await controller.acquire("user:a"))
+
+    asyncio.run(run())
+
+
+def test_saturated_in_flight_cap_rejects_at_once():
+    async def run():
+        clock = _Clock()
+        controller = AdmissionController(max_in_flight=2, max_wait_seconds=2.0, clock=clock)
+        # Requests have been holding their slot for 5 seconds
+        admitted_at = await controller.acquire("user:a")
+        clock.now += 5
+        controller.release(admitted_at)
+        await controller.acquire("user:a")
+        await controller.acquire("user:b")
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("user:c")
+        assert time.monotonic() - started < 0.5
+        assert rejected.value.status == 503
+        assert rejected.value.retry_after == 5
+        assert controller.stats()["rejected_overload"] == 1
+
+    asyncio.run(run())
+
+
+def test_queued_request_gets_the_released_slot_by_priority():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, max_wait_seconds=2.0)
+        first = await controller.acquire("user:a")
+        low = asyncio.create_task(controller.acquire("user:b", PRIORITY_LOW))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(controller.acquire("user:c", PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 2
+        controller.release(first)
+        await high
+        assert not low.done()
+        controller.release()
+        await low
+        controller.release()
+        assert controller.stats()["in_flight"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from advice_jobs import DONE, FAILED, IdempotencyConflict, JobFailed, JobQueue
+
+
+def _run(path, handler, body, **kw):
+    async def run():
+        queue = JobQueue(str(path), handler, **kw)
+        await queue.start()
+        try:
+            return await body(queue)
+        finally:
+            await queue.stop()
+
+    return asyncio.run(run())
+
+
+async def _echo(request):
+    return {"answer": request["message"]}
+
+
+def test_job_runs_and_wait_returns_the_result(tmp_path):
+    async def body(queue):
+        job, created = await queue.submit({"message": "hi"}, priority=0)
+        assert created
+        return await queue.wait(job["job_id"], timeout=5)
+
+    job = _run(tmp_path / "jobs.db", _echo, body)
+    assert job["status"] == DONE
+    assert job["result"] == {"answer": "hi"}
+
+
+def test_submissions_are_idempotent(tmp_path):
+    async def body(queue):
+        first, _ = await queue.submit({"message": "hi"}, priority=0, idempotency_key="k1")
+        again, created = await queue.submit({"message": "hi"}, priority=0, idempotency_key="k1")
+        assert not created and again["job_id"] == first["job_id"]
+        with pytest.raises(IdempotencyConflict):
+            await queue.submit({"message": "other"}, priority=0, idempotency_key="k1")
+        return queue.stats()
+
+    assert _run(tmp_path / "jobs.db", _echo, body)["deduplicated"] == 1
+
+
+def test_busy_failures_are_retried_then_fail(tmp_path):
+    async def busy(request):
+        raise JobFailed(503, "busy", retry_after=0.01)
+
+    async def body(queue):
+        job, _ = await queue.submit({"message": "hi"}, priority=0)
+        return await queue.wait(job["job_id"], timeout=5)
+
+    job = _run(tmp_path / "jobs.db", busy, body, max_attempts=2)
+    assert job["status"] == FAILED
+    assert job["attempts"] == 2
+    assert job["status_code"] == 503
+
+
+def test_wait_returns_at_once_when_the_job_finishes_before_it_subscribes(tmp_path):
+    async def body(queue):
+        gate = asyncio.Event()
+
+        async def blocked(request):
+            await gate.wait()
+            return {"answer": "late"}
+
+        queue.handler = blocked
+        job, _ = await queue.submit({"message": "hi"}, priority=0)
+        while (await queue.get(job["job_id"]))["status"] != "running":
+            await asyncio.sleep(0.01)
+
+        # The job finishes right after wait() has read it as running
+        real_get = queue.get
+        reads = 0
+
+        async def get(job_id):
+            nonlocal reads
+            found = await real_get(job_id)
+            reads += 1
+            if reads == 1:
+                gate.set()
+                while (await real_get(job_id))["status"] != DONE:
+                    await asyncio.sleep(0.01)
+            return found
+
+        queue.get = get
+        started = time.monotonic()
+        job = await queue.wait(job["job_id"], timeout=5)
+        assert time.monotonic() - started < 1
+        assert queue._finished == {}
+        return job
+
+    assert _run(tmp_path / "jobs.db", _echo, body)["status"] == DONE
@@ -0,0 +1,26 @@
+import asyncio
+
+from chat_sessions import SessionStore
+
+
+def test_background_sweep_drops_idle_sessions():
+    now = [0.0]
+    store = SessionStore(idle_seconds=10, sweep_seconds=0.01, clock=lambda: now[0])
+
+    async def run():
+        store.start()
+        try:
+            store.create({"category": "buy"})
+            now[0] = 5.0
+            kept = store.create({"category": "tax"})
+            now[0] = 12.0
+            # No create or resume from here on: only the sweep can evict
+            await asyncio.sleep(0.05)
+            return kept
+        finally:
+            await store.stop()
+
+    kept = asyncio.run(run())
+    assert store.stats()["active"] == 1
+    assert store.stats()["evicted_idle"] == 1
+    assert store.resume(kept.session_id) is kept
@@ -0,0 +1,35 @@
+from expense_analytics import analyze_expenses, analyze_expenses_many, expense_group
+
+
+def test_generic_payment_words_do_not_decide_the_group():
+    assert expense_group("netflix_fee") == "entertainment"
+    assert expense_group("gym_fee") == "health"
+    assert expense_group("school_fee") == "education"
+    assert expense_group("phone_bill") == "utilities"
+
+
+def test_generic_payment_words_are_the_fallback():
+    assert expense_group("fee") == "education"
+    assert expense_group("monthly_bills") == "utilities"
+    assert expense_group("misc") == "other"
+
+
+def test_analysis_without_previous_month():
+    analysis = analyze_expenses({"rent": 18000, "netflix_fee": 1500, "food": 14200}, "Pokhara", income=60000)
+    assert analysis["total"] == 33700
+    assert analysis["previous_total"] is None
+    assert analysis["tier"] == "city"
+    assert any("[netflix_fee]" in line and line.startswith("entertainment") for line in analysis["lines"])
+    assert analysis["rights"][0]["id"] == "savings_rate"
+
+
+def test_batch_scores_each_user_as_alone():
+    users = [
+        ({"rent": 18000, "daraz_shopping": 26800, "sip": 5000}, "Kathmandu", {"rent": 18000}, 90000),
+        ({"food": 9000}, "Dharan", None, None),
+        ({}, None, None, 40000),
+    ]
+    batch = analyze_expenses_many(*(list(column) for column in zip(*users)))
+    assert batch == [analyze_expenses(*user) for user in users]
+    assert batch[0]["previous_total"] == 18000
+    assert batch[1]["tier"] == "city"
@@ -0,0 +1,20 @@
+from google import genai
+
+from genai_client import _use_pooled_session
+
+
+def _client():
+    return genai.Client(api_key="test-key")
+
+
+def test_pooled_session_on_the_pinned_version():
+    client = _client()
+    assert _use_pooled_session(client, 4)
+    assert "_request_unauthorized" in vars(client._api_client)
+
+
+def test_other_versions_keep_the_sdk_request_path(monkeypatch):
+    monkeypatch.setattr(genai, "__version__", "1.1.0")
+    client = _client()
+    assert not _use_pooled_session(client, 4)
+    assert "_request_unauthorized" not in vars(client._api_client)
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_pool import LLMPool, LLMQueueFullError, LLMTimeoutError
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Models:
+    """client.aio.models the way google-genai 1.0.0 runs it: a blocking call in a worker thread"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _blocking(self, contents):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.latency)
+        with self._lock:
+            self.active -= 1
+        return _Response(contents)
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.calls += 1
+        return await asyncio.to_thread(self._blocking, contents)
+
+
+class _Client:
+    def __init__(self, latency=0.05):
+        self.aio = type("Aio", (), {})()
+        self.aio.models = _Models(latency)
+
+
+def _pool(client, **kwargs):
+    kwargs.setdefault("hedge", False)
+    kwargs.setdefault("max_retries", 0)
+    return LLMPool(client, **kwargs)
+
+
+def test_calls_run_up_to_the_cap_not_the_default_executor_size():
+    client = _Client(latency=0.1)
+    pool = _pool(client, max_concurrency=40, max_queue=100, coalesce=False)
+
+    async def burst():
+        pool.install_executor()
+        await asyncio.gather(*(pool.generate_content(model="m", contents=str(i)) for i in range(80)))
+
+    asyncio.run(burst())
+    # The stock default executor has min(32, CPUs + 4) threads
+    assert client.aio.models.peak == 40
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_full_queue_is_rejected():
+    client = _Client(latency=0.2)
+    pool = _pool(client, max_concurrency=1, max_queue=1, coalesce=False)
+
+    async def burst():
+        # One call holds the only slot, one waits in the queue, the third finds it full
+        tasks = []
+        for i in range(3):
+            tasks.append(asyncio.ensure_future(pool.generate_content(model="m", contents=str(i))))
+            await asyncio.sleep(0.02)
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert sum(isinstance(result, LLMQueueFullError) for result in results) == 1
+    assert sum(isinstance(result, _Response) for result in results) == 2
+
+
+def test_slow_call_times_out():
+    pool = _pool(_Client(latency=0.3), timeout_seconds=0.05, min_timeout_seconds=0.01)
+    with pytest.raises(LLMTimeoutError):
+        asyncio.run(pool.generate_content(model="m", contents="x"))
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    client = _Client(latency=0.05)
+    pool = _pool(client, max_concurrency=4)
+
+    async def burst():
+        return await asyncio.gather(*(pool.generate_content(model="m", contents="same") for _ in range(10)))
+
+    results = asyncio.run(burst())
+    assert client.aio.models.calls == 1
+    assert {result.text for result in results} == {"same"}
+
+
+def test_installing_the_executor_shuts_down_the_one_it_replaces():
+    pool = _pool(_Client(latency=0), max_concurrency=4)
+
+    async def install_twice():
+        loop = asyncio.get_running_loop()
+        await asyncio.to_thread(lambda: None)  # creates the stock default executor
+        stock = loop._default_executor
+        pool.install_executor()
+        first = loop._default_executor
+        pool.install_executor()
+        return stock, first, loop._default_executor
+
+    stock, first, current = asyncio.run(install_twice())
+    assert stock._shutdown and first._shutdown
+    assert current._max_workers == 12
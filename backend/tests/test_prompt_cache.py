@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+from prompt_cache import PromptCache
+
+LONG = "Shared advisor guidelines. " * 200  # ~1,350 estimated tokens
+
+
+class _Caches:
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    async def create(self, model, config):
+        self.created.append((model, config["display_name"]))
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    async def update(self, name, config):
+        self.updated.append(name)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+def _cache(now):
+    caches = _Caches()
+    client = SimpleNamespace(aio=SimpleNamespace(caches=caches))
+    return PromptCache(client, ttl_seconds=100, refresh_margin_seconds=20, clock=lambda: now[0]), caches
+
+
+def test_instruction_is_cached_and_extended_before_expiry():
+    now = [0.0]
+    cache, caches = _cache(now)
+
+    async def run():
+        # First call goes inline while the cache is created
+        first = cache.config_kwargs("m", "buy", LONG)
+        await asyncio.sleep(0)
+        second = cache.config_kwargs("m", "buy", LONG)
+        now[0] = 75.0  # within refresh margin + interval of expiry
+        await cache.refresh()
+        now[0] = 150.0  # past the first TTL
+        third = cache.config_kwargs("m", "buy", LONG)
+        await cache.close()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == {"system_instruction": LONG}
+    assert second == third == {"cached_content": "cachedContents/1"}
+    assert caches.created == [("m", "paisa-buy")]
+    assert caches.updated == ["cachedContents/1"]
+    assert caches.deleted == ["cachedContents/1"]
+    assert cache.stats()["cached_calls"] == 2
+
+
+def test_instruction_below_the_minimum_stays_inline():
+    cache, caches = _cache([0.0])
+
+    async def run():
+        for _ in range(2):
+            cache.config_kwargs("m", "tax", "short prompt")
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert caches.created == []
+    assert cache.stats()["too_small"] == ["tax"]
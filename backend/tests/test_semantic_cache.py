@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from semantic_cache import SemanticCache, message_numbers, profile_bucket
+
+
+class _Embedder:
+    """One-hot vector per word list; ``gate`` holds embed() open"""
+
+    name = "test"
+
+    def __init__(self):
+        self.gate = None
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        vectors = []
+        for text in texts:
+            vector = np.zeros(64, dtype=np.float32)
+            for word in text.split():
+                vector[hash(word) % 64] += 1.0
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.stack(vectors)
+
+
+def _request(message, income=85000.0, **kw):
+    fields = dict(
+        category="buy", mode="simple", location="Kathmandu", message=message, monthly_income_npr=income,
+        current_savings_npr=120000.0, monthly_expenses_npr={"food": 14200.0}, extra_profile=None,
+    )
+    fields.update(kw)
+    return SimpleNamespace(**fields)
+
+
+def test_paraphrase_hits_only_within_the_profile_bucket():
+    async def run():
+        cache = SemanticCache(_Embedder(), threshold=0.5)
+        await cache.add(_request("can i buy a pulsar bike"), {"target_amount_npr": 250000})
+        hit = await cache.lookup(_request("can i buy a pulsar bike soon"))
+        assert hit is not None and hit.value == {"target_amount_npr": 250000}
+        assert await cache.lookup(_request("can i buy a pulsar bike soon", income=200000.0)) is None
+
+    asyncio.run(run())
+
+
+def test_numbers_in_the_message_are_part_of_the_bucket():
+    assert message_numbers("Pulsar 220 for 1,50,000") == ["150000", "220"]
+    assert profile_bucket(_request("buy pulsar 220")) != profile_bucket(_request("buy pulsar 150"))
+
+
+def test_no_embedding_without_candidates():
+    async def run():
+        embedder = _Embedder()
+        cache = SemanticCache(embedder)
+        await cache.add(_request("can i buy a pulsar bike"), {"target_amount_npr": 1})
+        calls = embedder.calls
+        assert await cache.lookup(_request("can i buy a pulsar bike", income=500000.0)) is None
+        assert embedder.calls == calls
+
+    asyncio.run(run())
+
+
+def test_row_reused_while_embedding_is_not_returned():
+    async def run():
+        embedder = _Embedder()
+        cache = SemanticCache(embedder, threshold=0.5, max_entries=1)
+        mine = _request("can i buy a pulsar bike")
+        await cache.add(mine, {"owner": "mine"})
+
+        embedder.gate = asyncio.Event()
+        lookup = asyncio.create_task(cache.lookup(_request("can i buy a pulsar bike now")))
+        await asyncio.sleep(0)
+        # Another profile's answer takes over the only row, with the same wording
+        embedder.gate.set()
+        await cache.add(_request("can i buy a pulsar bike now", income=300000.0), {"owner": "other"})
+        assert await lookup is None
+
+    asyncio.run(run())
+
+
+def test_false_hit_audit_spares_a_reused_row():
+    async def run():
+        cache = SemanticCache(_Embedder(), threshold=0.5, max_entries=1)
+        await cache.add(_request("can i buy a pulsar bike"), {"target_amount_npr": 250000})
+        hit = await cache.lookup(_request("can i buy a pulsar bike soon"))
+        await cache.add(_request("can i buy a pulsar bike", income=300000.0), {"target_amount_npr": 250000})
+        assert not cache.record_audit(hit, "can i buy a pulsar bike soon", {"target_amount_npr": 900000})
+        assert cache.stats()["entries"] == {"buy": 1}
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight, prompt_fingerprint
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def burst():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(burst()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["coalesced_calls"] == 4
+    assert flight.stats()["in_flight_keys"] == 0
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        return len(calls)
+
+    async def twice():
+        return [await flight.do("k", work), await flight.do("k", work)]
+
+    assert asyncio.run(twice()) == [1, 2]
+
+
+def test_exception_reaches_every_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def burst():
+        return await asyncio.gather(*(flight.do("k", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_leaves_shared_call_running():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "answer"
+
+    async def scenario():
+        leaving = asyncio.ensure_future(flight.do("k", work))
+        staying = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(scenario()) == "answer"
+    assert finished == [1]
+
+
+def test_call_is_cancelled_when_its_last_caller_leaves():
+    flight = SingleFlight()
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+
+    async def scenario():
+        caller = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.08)
+
+    asyncio.run(scenario())
+    assert finished == []
+    assert flight.stats()["abandoned_calls"] == 1
+    assert flight.stats()["in_flight_keys"] == 0
+
+
+def test_fingerprint_depends_on_model_contents_and_config():
+    base = prompt_fingerprint("m", "prompt", {"temperature": 0})
+    assert base == prompt_fingerprint("m", "prompt", {"temperature": 0})
+    assert base != prompt_fingerprint("other", "prompt", {"temperature": 0})
+    assert base != prompt_fingerprint("m", "prompt!", {"temperature": 0})
+    assert base != prompt_fingerprint("m", "prompt", {"temperature": 1})
@@ -0,0 +1,90 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Union
+
+import pytest
+from google.genai import models
+from google.genai._api_client import ApiClient
+from pydantic import BaseModel
+
+from llm_pool import LLMUnavailableError
+from structured_output import StructuredGenerator, UnparseableOutputError, gemini_schema, parse_locally
+
+
+class Item(BaseModel):
+    name: str
+    price: int
+    note: Optional[str] = None
+
+
+class Answer(BaseModel):
+    text: str
+    count: Optional[int] = None
+    items: List[Item]
+
+
+def _request_config(schema: Dict[str, Any]) -> Dict[str, Any]:
+    # The conversion google-genai applies before an API-key (Gemini API) request
+    return models._GenerateContentConfig_to_mldev(ApiClient(api_key="test"), StructuredGenerator.config(schema), {})
+
+
+def _keys(node: Any) -> set:
+    if isinstance(node, dict):
+        return set(node).union(*(_keys(value) for value in node.values()))
+    if isinstance(node, list):
+        return set().union(*(_keys(value) for value in node))
+    return set()
+
+
+def test_schema_uses_only_fields_the_gemini_api_accepts():
+    schema = gemini_schema(Answer)
+    assert not _keys(schema) & {"nullable", "any_of", "anyOf", "property_ordering", "default", "title"}
+    _request_config(schema)
+
+
+def test_optional_fields_are_left_out_of_required():
+    schema = gemini_schema(Answer)
+    assert schema["required"] == ["text", "items"]
+    assert schema["properties"]["count"]["type"] == "INTEGER"
+    assert schema["properties"]["items"]["items"]["required"] == ["name", "price"]
+
+
+def test_excluded_paths_are_dropped():
+    schema = gemini_schema(Answer, exclude=["count", "items.price"])
+    assert "count" not in schema["properties"]
+    item = schema["properties"]["items"]["items"]
+    assert "price" not in item["properties"] and "price" not in item["required"]
+
+
+def test_unsupported_types_are_refused():
+    class Mixed(BaseModel):
+        value: Union[int, str]
+
+    class Free(BaseModel):
+        extra: Dict[str, Any]
+
+    with pytest.raises(ValueError):
+        gemini_schema(Mixed)
+    with pytest.raises(ValueError):
+        gemini_schema(Free)
+
+
+def test_truncated_reply_is_closed_locally():
+    data, stage, _ = parse_locally('{"text": "hello", "items": [{"name": "a", "price": 1}, {"name": "b"')
+    assert stage == "local_repair"
+    assert data["text"] == "hello"
+
+
+def test_failed_repair_call_is_a_parse_failure():
+    class _BreakerOpen:
+        async def generate_content(self, **kwargs):
+            raise LLMUnavailableError("circuit open", retry_after=5)
+
+    generator = StructuredGenerator(_BreakerOpen())
+    with pytest.raises(UnparseableOutputError) as error:
+        asyncio.run(generator.parse("not json at all", gemini_schema(Answer)))
+    assert isinstance(error.value, json.JSONDecodeError)
+    assert error.value.doc == "not json at all"
+    assert "LLMUnavailableError" in error.value.msg
+    assert generator.stats()["stages"]["failed"] == 1
+    assert generator.stats()["repair_calls"] == 1
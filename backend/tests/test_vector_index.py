@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from vector_index import IndexMismatchError, VectorStore
+
+
+def _store(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.add("u1", np.eye(4, dtype=np.float32), ["a", "b", "c", "d"], embedder_name="hashing-4")
+    return store
+
+
+def test_query_from_the_index_embedder_is_served(tmp_path):
+    hits = _store(tmp_path).search("u1", np.array([0, 1, 0, 0], dtype=np.float32), 1, embedder_name="hashing-4")
+    assert hits[0]["content"] == "b"
+
+
+def test_other_embedder_or_dim_is_a_mismatch(tmp_path):
+    store = _store(tmp_path)
+    with pytest.raises(IndexMismatchError):
+        store.search("u1", np.ones(4, dtype=np.float32), 1, embedder_name="gemini-text-embedding-004")
+    with pytest.raises(IndexMismatchError):
+        store.search("u1", np.ones(8, dtype=np.float32), 1, embedder_name="hashing-4")
+    with pytest.raises(IndexMismatchError):
+        store.add("u1", np.ones((1, 4), dtype=np.float32), ["e"], embedder_name="gemini-text-embedding-004")
+
+
+def test_bad_search_mode_is_not_a_mismatch(tmp_path):
+    with pytest.raises(ValueError) as error:
+        _store(tmp_path).search("u1", None, 1, mode="fuzzy")
+    assert not isinstance(error.value, IndexMismatchError)
@@ -0,0 +1,592 @@
+"""
+Per-user vector index for /api/v1/query.
+
+Each user gets a directory under the index root:
+
+    vectors.f32     raw float32 rows (count x dim), appended, read via np.memmap
+    vectors.i8      int8 copy of the rows (count x dim), scanned instead of vectors.f32
+    scales.f32      per-row dequantization scale of vectors.i8
+    chunks.jsonl    one {"content", "metadata"} line per row
+    chunks.idx      uint64 byte offset of each line in chunks.jsonl
+    hashes.txt      content hashes already indexed (for ingestion dedup)
+    manifest.json   dim, row count, embedder name, IVF build info
+    ivf_*.npy       IVF centroids / posting order / list offsets (optional)
+    bm25_*          lexical inverted index over the same rows (see bm25.py)
+
+Small corpora are searched brute force with one matrix-vector product. Once a
+user passes ``ivf_threshold`` rows an IVF (k-means inverted file) index is
+built and only the ``nprobe`` closest lists are scanned; rows added after the
+last build are scanned brute force until the index is rebuilt. Nothing is
+re-embedded on restart: everything is read back from the memory-mapped files.
+
+With int8 quantization (the default) candidates are scored against the int8
+rows, a quarter of the bytes of float32, and only a shortlist of
+``rerank_factor`` x ``top_k`` rows is re-scored with the float32 rows, so
+the returned scores are exact and vectors.f32 is only touched a few pages
+at a time. Indexes written before quantization are converted on first open.
+
+VectorStore keeps every user's index object but only the memory-mapped
+arrays of recently searched users: once their estimated resident size passes
+``memory_budget_bytes`` the least recently used indexes are closed, and
+reopened from disk on their next query.
+
+Hybrid search runs the vector search and a BM25 keyword search over the same
+rows and fuses the two rankings with reciprocal-rank fusion.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from embeddings import normalize_rows
+
+_SAFE_ID_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+SEARCH_MODES = ("hybrid", "vector", "keyword")
+QUANTIZATIONS = ("int8", "none")
+
+# Rows dequantized per matrix-vector product: small enough to stay in cache
+_SCAN_BLOCK = 4096
+
+
+class IndexMismatchError(ValueError):
+    """Raised when an index was built with a different embedder or embedding dim"""
+
+
+def _user_dirname(user_id: str) -> str:
+    """Filesystem-safe directory name that cannot collide across user ids"""
+    digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:10]
+    return f"{_SAFE_ID_RE.sub('_', user_id)[:48]}-{digest}"
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on normalized rows; returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # Reseed empty lists with random rows
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def quantize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 codes and the float32 scale that restores each row"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales
+
+
+class UserVectorIndex:
+    """Vectors, chunk text and optional IVF structure for one user"""
+
+    def __init__(
+        self,
+        path: str,
+        ivf_threshold: int = 20000,
+        nprobe: int = 8,
+        quantization: str = "int8",
+        rerank_factor: int = 4,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.path = path
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._read_manifest()
+        self._vectors: Optional[np.memmap] = None
+        self._codes: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        self._ivf: Optional[Dict[str, np.ndarray]] = None
+        self._hashes: Optional[set] = None
+        self._lexical: Optional[BM25Index] = None
+
+    # -- files -----------------------------------------------------------------
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._file("manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dim": None, "count": 0, "embedder": None, "ivf_count": 0}
+
+    def _write_manifest(self) -> None:
+        tmp = self._file("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp, self._file("manifest.json"))
+
+    @property
+    def count(self) -> int:
+        return self._manifest["count"]
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._manifest["dim"]
+
+    def check_embedder(self, embedder_name: Optional[str], dim: Optional[int]) -> None:
+        """Raise IndexMismatchError unless rows from this embedder and dim belong in the index"""
+        built_with = self._manifest.get("embedder")
+        if embedder_name and built_with and embedder_name != built_with:
+            raise IndexMismatchError(f"Index was built with embedder {built_with}, not {embedder_name}")
+        if dim is not None and self.dim is not None and dim != self.dim:
+            raise IndexMismatchError(f"Embedding dim {dim} does not match index dim {self.dim}")
+
+    def vectors(self) -> np.ndarray:
+        """Memory-mapped (count, dim) matrix, opened lazily"""
+        if self.count == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self._vectors is None or self._vectors.shape[0] != self.count:
+            self._vectors = np.memmap(
+                self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(self.count, self.dim)
+            )
+        return self._vectors
+
+    def quantized(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Memory-mapped int8 codes (count, dim) and scales (count,), converting older rows first"""
+        with self._lock:
+            done = self._manifest.get("int8_count", 0)
+            if done < self.count:
+                vectors = self.vectors()
+                with open(self._file("vectors.i8"), "r+b" if done else "wb") as codes_file, \
+                        open(self._file("scales.f32"), "r+b" if done else "wb") as scales_file:
+                    codes_file.seek(done * self.dim)
+                    scales_file.seek(done * 4)
+                    for start in range(done, self.count, 65536):
+                        codes, scales = quantize_rows(vectors[start:start + 65536])
+                        codes_file.write(codes.tobytes())
+                        scales_file.write(scales.tobytes())
+                self._manifest["int8_count"] = self.count
+                self._write_manifest()
+            if self.count == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.int8), np.zeros(0, dtype=np.float32)
+            if self._codes is None or self._codes.shape[0] != self.count:
+                self._codes = np.memmap(self._file("vectors.i8"), dtype=np.int8, mode="r", shape=(self.count, self.dim))
+                self._scales = np.memmap(self._file("scales.f32"), dtype=np.float32, mode="r", shape=(self.count,))
+            return self._codes, self._scales
+
+    def _chunk_offsets(self) -> np.ndarray:
+        if self._offsets is None or self._offsets.shape[0] != self.count:
+            self._offsets = np.memmap(self._file("chunks.idx"), dtype=np.uint64, mode="r", shape=(self.count,))
+        return self._offsets
+
+    def chunk(self, row: int) -> Dict[str, Any]:
+        """Content and metadata stored for one row"""
+        offset = int(self._chunk_offsets()[row])
+        with open(self._file("chunks.jsonl"), "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def lexical(self) -> BM25Index:
+        """BM25 index over the same rows, backfilled from chunks.jsonl if behind"""
+        with self._lock:
+            if self._lexical is None:
+                self._lexical = BM25Index(self.path)
+                missing = range(self._lexical.count, self.count)
+                if len(missing):
+                    self._lexical.add(missing.start, [self.chunk(row)["content"] for row in missing])
+            return self._lexical
+
+    def _known_hashes(self) -> set:
+        if self._hashes is None:
+            try:
+                with open(self._file("hashes.txt"), "r", encoding="utf-8") as f:
+                    self._hashes = {line.strip() for line in f if line.strip()}
+            except FileNotFoundError:
+                self._hashes = set()
+        return self._hashes
+
+    def has_hash(self, digest: str) -> bool:
+        """Whether a chunk (or document) with this content hash is indexed"""
+        with self._lock:
+            return digest in self._known_hashes()
+
+    def add_hashes(self, digests: List[str]) -> None:
+        with self._lock:
+            known = self._known_hashes()
+            new = [d for d in digests if d and d not in known]
+            if not new:
+                return
+            with open(self._file("hashes.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(d + "\n" for d in new))
+            known.update(new)
+
+    # -- writes ----------------------------------------------------------------
+
+    def add(
+        self,
+        vectors: np.ndarray,
+        contents: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        embedder_name: Optional[str] = None,
+    ) -> List[int]:
+        """Append rows; returns their row ids"""
+        vectors = normalize_rows(vectors)
+        if len(vectors) != len(contents):
+            raise ValueError("vectors and contents must have the same length")
+        metadatas = metadatas or [{} for _ in contents]
+        with self._lock:
+            self.check_embedder(embedder_name, int(vectors.shape[1]))
+            if self.dim is None:
+                self._manifest["dim"] = int(vectors.shape[1])
+                self._manifest["embedder"] = embedder_name
+
+            start = self.count
+            lexical = self.lexical()
+            with open(self._file("chunks.jsonl"), "ab") as f:
+                position = f.tell()
+                offsets = []
+                for content, metadata in zip(contents, metadatas):
+                    line = json.dumps({"content": content, "metadata": metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    offsets.append(position)
+                    f.write(line)
+                    position += len(line)
+            with open(self._file("chunks.idx"), "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            with open(self._file("vectors.f32"), "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            # Only kept in step once the int8 files exist (or for a new index);
+            # otherwise quantized() converts the backlog on the next search
+            if self.quantization == "int8" and self._manifest.get("int8_count", 0) == start:
+                codes, scales = quantize_rows(vectors)
+                with open(self._file("vectors.i8"), "ab") as f:
+                    f.write(codes.tobytes())
+                with open(self._file("scales.f32"), "ab") as f:
+                    f.write(scales.tobytes())
+                self._manifest["int8_count"] = start + len(vectors)
+
+            self._manifest["count"] = start + len(vectors)
+            self._write_manifest()
+            lexical.add(start, contents)
+            self.add_hashes([m.get("content_hash") for m in metadatas])
+            self._maybe_build_ivf()
+            return list(range(start, self.count))
+
+    # -- IVF -------------------------------------------------------------------
+
+    def _maybe_build_ivf(self) -> None:
+        built = self._manifest.get("ivf_count", 0)
+        if self.count < self.ivf_threshold:
+            return
+        # Rebuild when the unindexed tail grows past 25% of the indexed part
+        if built and (self.count - built) < 0.25 * built:
+            return
+        self.build_ivf()
+
+    def build_ivf(self, sample_size: int = 20000) -> None:
+        """(Re)build the IVF lists over every row currently stored"""
+        with self._lock:
+            vectors = np.asarray(self.vectors())
+            count = len(vectors)
+            nlist = max(1, int(np.sqrt(count)))
+            rng = np.random.default_rng(0)
+            sample = vectors if count <= sample_size else vectors[rng.choice(count, size=sample_size, replace=False)]
+            centroids = _kmeans(sample, min(nlist, len(sample)))
+
+            assign = np.empty(count, dtype=np.int32)
+            for start in range(0, count, 8192):
+                block = vectors[start:start + 8192]
+                assign[start:start + 8192] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+
+            np.save(self._file("ivf_centroids.npy"), centroids)
+            np.save(self._file("ivf_order.npy"), order)
+            np.save(self._file("ivf_offsets.npy"), offsets)
+            self._manifest["ivf_count"] = count
+            self._write_manifest()
+            self._ivf = None
+
+    def _load_ivf(self) -> Optional[Dict[str, np.ndarray]]:
+        if not self._manifest.get("ivf_count"):
+            return None
+        if self._ivf is None:
+            self._ivf = {
+                name: np.load(self._file(f"ivf_{name}.npy"), mmap_mode="r")
+                for name in ("centroids", "order", "offsets")
+            }
+        return self._ivf
+
+    # -- search ----------------------------------------------------------------
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows to score: the probed IVF lists plus the unindexed tail, or None for all rows"""
+        ivf = self._load_ivf()
+        if ivf is None:
+            return None
+        built = self._manifest["ivf_count"]
+        centroid_scores = ivf["centroids"] @ query
+        nprobe = min(self.nprobe, len(centroid_scores))
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        offsets = ivf["offsets"]
+        probed = np.sort(np.concatenate([ivf["order"][offsets[c]:offsets[c + 1]] for c in probe]))
+        # Rows added since the last build are contiguous and always scanned
+        return np.concatenate([probed, np.arange(built, self.count, dtype=np.int64)])
+
+    def _float_scores(self, query: np.ndarray, candidates: Optional[np.ndarray]) -> np.ndarray:
+        vectors = self.vectors()
+        if candidates is None:
+            return vectors @ query
+        built = self._manifest["ivf_count"]
+        probed = candidates[:len(candidates) - (self.count - built)]
+        # The tail is scored as a slice instead of being gathered
+        return np.concatenate([vectors[probed] @ query, vectors[built:self.count] @ query])
+
+    def _int8_scores(self, query: np.ndarray, candidates: Optional[np.ndarray]) -> np.ndarray:
+        """Approximate cosine scores from the int8 rows, dequantized a block at a time"""
+        codes, scales = self.quantized()
+        rows = len(codes) if candidates is None else len(candidates)
+        scores = np.empty(rows, dtype=np.float32)
+        for start in range(0, rows, _SCAN_BLOCK):
+            if candidates is None:
+                block = codes[start:start + _SCAN_BLOCK]
+            else:
+                block = codes[candidates[start:start + _SCAN_BLOCK]]
+            scores[start:start + _SCAN_BLOCK] = block.astype(np.float32) @ query
+        scores *= scales if candidates is None else scales[candidates]
+        return scores
+
+    def search_rows(self, query: np.ndarray, top_k: int) -> List[tuple]:
+        """(row, score) pairs for the best ``top_k`` rows by cosine similarity"""
+        with self._lock:
+            if self.count == 0:
+                return []
+            self.check_embedder(None, int(query.shape[-1]))
+            query = normalize_rows(query.reshape(1, -1))[0]
+            candidates = self._candidates(query)
+            if candidates is not None and len(candidates) == 0:
+                return []
+            if self.quantization == "none":
+                scores = self._float_scores(query, candidates)
+                k = min(top_k, len(scores))
+                best = np.argpartition(-scores, k - 1)[:k]
+                best = best[np.argsort(-scores[best])]
+                rows = best if candidates is None else candidates[best]
+                return [(int(row), float(scores[i])) for row, i in zip(rows, best)]
+
+            approx = self._int8_scores(query, candidates)
+            shortlist_size = min(top_k * self.rerank_factor, len(approx))
+            shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+            rows = np.sort(shortlist if candidates is None else candidates[shortlist])
+            # Exact float32 scores for the shortlist only (ascending rows read the file in order)
+            scores = self.vectors()[rows] @ query
+            k = min(top_k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(int(rows[i]), float(scores[i])) for i in best]
+
+    def resident_bytes(self) -> int:
+        """Estimated memory held by this index's open arrays (what the store's budget counts)"""
+        total = 0
+        if self.quantization == "none" and self._vectors is not None:
+            total += self._vectors.nbytes
+        if self._codes is not None:
+            total += self._codes.nbytes + self._scales.nbytes
+        if self._offsets is not None:
+            total += self._offsets.nbytes
+        if self._ivf is not None:
+            total += sum(array.nbytes for array in self._ivf.values())
+        if self._lexical is not None:
+            total += self._lexical.resident_bytes()
+        return total
+
+    def close(self) -> None:
+        """Drop the memory-mapped arrays and cached structures; they reopen on next use"""
+        with self._lock:
+            self._vectors = None
+            self._codes = None
+            self._scales = None
+            self._offsets = None
+            self._ivf = None
+            self._hashes = None
+            self._lexical = None
+
+    def search(
+        self,
+        query: Optional[np.ndarray],
+        top_k: int,
+        query_text: Optional[str] = None,
+        mode: str = "vector",
+        embedder_name: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Scored chunks with their metadata. ``mode`` is "vector" (cosine),
+        "keyword" (BM25) or "hybrid" (RRF of both; score is the fused score).
+        A query embedded by a different embedder raises IndexMismatchError.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        if query is not None:
+            self.check_embedder(embedder_name, int(query.shape[-1]))
+        vector_hits: List[tuple] = []
+        keyword_hits: List[tuple] = []
+        # Fuse deeper lists than requested so rows ranked well by only one
+        # retriever can still make the cut
+        depth = top_k if mode != "hybrid" else max(4 * top_k, 50)
+        if mode in ("vector", "hybrid") and query is not None:
+            vector_hits = self.search_rows(query, depth)
+        if mode in ("keyword", "hybrid") and query_text:
+            keyword_hits = self.lexical().search(query_text, depth)
+
+        vector_scores = dict(vector_hits)
+        keyword_scores = dict(keyword_hits)
+        if mode == "vector":
+            ranked = vector_hits
+        elif mode == "keyword":
+            ranked = keyword_hits
+        else:
+            ranked = reciprocal_rank_fusion(
+                [[row for row, _ in vector_hits], [row for row, _ in keyword_hits]]
+            )[:top_k]
+
+        results = []
+        for row, score in ranked:
+            chunk = self.chunk(row)
+            metadata = dict(chunk.get("metadata") or {})
+            metadata["chunk_id"] = row
+            if mode == "hybrid":
+                metadata["vector_score"] = vector_scores.get(row)
+                metadata["bm25_score"] = keyword_scores.get(row)
+            results.append({"content": chunk["content"], "score": score, "metadata": metadata})
+        return results
+
+
+class VectorStore:
+    """
+    Opens per-user indexes under one root directory on first use and keeps
+    the arrays of at most ``memory_budget_bytes`` of them open
+    """
+
+    def __init__(
+        self,
+        root: str,
+        ivf_threshold: int = 20000,
+        nprobe: int = 8,
+        quantization: str = "int8",
+        rerank_factor: int = 4,
+        memory_budget_bytes: Optional[int] = 1024 * 1024 * 1024,
+    ):
+        self.root = root
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.memory_budget_bytes = memory_budget_bytes
+        self._indexes: Dict[str, UserVectorIndex] = {}
+        # Users whose arrays may be open, least recently used first
+        self._open: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._evictions = 0
+
+    def index(self, user_id: str) -> UserVectorIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = UserVectorIndex(
+                    os.path.join(self.root, _user_dirname(user_id)),
+                    ivf_threshold=self.ivf_threshold,
+                    nprobe=self.nprobe,
+                    quantization=self.quantization,
+                    rerank_factor=self.rerank_factor,
+                )
+                self._indexes[user_id] = index
+            if user_id in self._open:
+                self._open.move_to_end(user_id)
+            else:
+                self._open[user_id] = index
+                self._loads += 1
+            return index
+
+    def _enforce_budget(self, keep: str) -> None:
+        """Close least recently used indexes (never ``keep``) until the open ones fit the budget"""
+        if not self.memory_budget_bytes:
+            return
+        with self._lock:
+            total = sum(index.resident_bytes() for index in self._open.values())
+            for user_id in list(self._open):
+                if total <= self.memory_budget_bytes:
+                    break
+                if user_id == keep:
+                    continue
+                index = self._open.pop(user_id)
+                total -= index.resident_bytes()
+                index.close()
+                self._evictions += 1
+
+    def has_user(self, user_id: str) -> bool:
+        return user_id in self._indexes or os.path.isdir(os.path.join(self.root, _user_dirname(user_id)))
+
+    def add(self, user_id: str, vectors: np.ndarray, contents: List[str], metadatas=None, embedder_name=None) -> List[int]:
+        rows = self.index(user_id).add(vectors, contents, metadatas, embedder_name)
+        self._enforce_budget(user_id)
+        return rows
+
+    def search(
+        self,
+        user_id: str,
+        query: Optional[np.ndarray],
+        top_k: int,
+        query_text: Optional[str] = None,
+        mode: str = "vector",
+        embedder_name: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        if not self.has_user(user_id):
+            return []
+        results = self.index(user_id).search(
+            query, top_k, query_text=query_text, mode=mode, embedder_name=embedder_name
+        )
+        self._enforce_budget(user_id)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "quantization": self.quantization,
+                "rerank_factor": self.rerank_factor,
+                "known_users": len(self._indexes),
+                "open_users": len(self._open),
+                "resident_bytes": sum(index.resident_bytes() for index in self._open.values()),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loads": self._loads,
+                "evictions": self._evictions,
+            }
+
+
+def store_from_env() -> VectorStore:
+    """
+    VECTOR_INDEX_DIR, VECTOR_IVF_THRESHOLD, VECTOR_IVF_NPROBE,
+    VECTOR_QUANTIZATION (int8 or none), VECTOR_RERANK_FACTOR and
+    VECTOR_MEMORY_BUDGET_MB (0 disables eviction) configure the store
+    """
+    return VectorStore(
+        os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "vector_index")),
+        ivf_threshold=int(os.getenv("VECTOR_IVF_THRESHOLD", "20000")),
+        nprobe=int(os.getenv("VECTOR_IVF_NPROBE", "8")),
+        quantization=os.getenv("VECTOR_QUANTIZATION", "int8").strip().lower(),
+        rerank_factor=int(os.getenv("VECTOR_RERANK_FACTOR", "4")),
+        memory_budget_bytes=int(float(os.getenv("VECTOR_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024),
+    )